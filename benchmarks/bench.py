@@ -0,0 +1,225 @@
+""" Benchmarks for the bridgestyle conversions.
+
+Times each stage of the ArcGIS Pro conversion pipeline (parsing the .lyrx JSON, converting it to GeoStyler
+and writing it with each GeoStyler writer) over the .lyrx files in test/data/arcgis and over synthetic
+styles with a growing number of rules, and stores the results as JSON.
+
+    python benchmarks/bench.py run -o results.json
+    python benchmarks/bench.py compare baseline.json results.json
+
+"compare" exits with status 1 if any stage got slower than the threshold, or fails where it didn't before.
+"""
+import argparse
+import datetime
+import gc
+import glob
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import traceback
+
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _here)
+sys.path.insert(0, os.path.join(os.path.dirname(_here), "src"))
+
+import generator  # noqa: E402
+from bridgestyle import expressioncache  # noqa: E402
+from bridgestyle.arcgis import symbolcache  # noqa: E402
+from bridgestyle.arcgis import togeostyler as arcgis  # noqa: E402
+from bridgestyle.version import __version__  # noqa: E402
+
+DATA_FOLDER = os.path.join(os.path.dirname(_here), "test", "data", "arcgis")
+WRITERS = ("sld", "mapboxgl", "mapserver")
+STAGES = ("parse", "togeostyler") + WRITERS
+DEFAULT_RULES = (100, 1000, 5000)
+
+# Stages that cannot run on the synthetic ArcGIS Pro layers, with the reason
+SYNTHETIC_CIM_SKIPPED = {
+    "mapboxgl": "the MapLibre writer needs an opacity on outline-only fills, which the ArcGIS Pro reader "
+                "does not set",
+}
+
+
+def _writer(name):
+    if name == "sld":
+        from bridgestyle.sld import fromgeostyler
+    elif name == "mapboxgl":
+        from bridgestyle.mapboxgl import fromgeostyler
+    else:
+        from bridgestyle.mapserver import fromgeostyler
+    return fromgeostyler.convert
+
+
+def lyrxCases():
+    for filename in sorted(glob.glob(os.path.join(DATA_FOLDER, "*.lyrx"))):
+        with open(filename) as f:
+            yield "arcgis/" + os.path.basename(filename), f.read(), True, {}
+
+
+def syntheticCases(rules=DEFAULT_RULES, depth=3, pictureEvery=10):
+    for n in rules:
+        yield ("synthetic/cim-%d" % n, json.dumps(generator.cimLayer(n, depth, pictureEvery)), True,
+               SYNTHETIC_CIM_SKIPPED)
+        yield "synthetic/geostyler-%d" % n, json.dumps(generator.geostylerStyle(n, depth, pictureEvery)), False, {}
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+def runCase(text, repeat=3, lyrx=True, skipped=None):
+    """ Runs every stage on the given .lyrx content (or GeoStyler style, if not ``lyrx``) ``repeat`` times
+    and returns the timings of each stage. A stage that fails is reported with its error, and the stages
+    depending on it are skipped. The writers in ``skipped`` (a dict of reasons) are not run. """
+    skipped = skipped or {}
+    times = {stage: [] for stage in STAGES}
+    errors = {}
+    options = {"iconfolder": tempfile.mkdtemp(prefix="bridgestyle-bench")}
+    for _ in range(repeat):
+        # every repetition starts cold, as a new process would
+        expressioncache.clearCache()
+        symbolcache.clearCache()
+        shutil.rmtree(options["iconfolder"], ignore_errors=True)
+        gc.collect()
+        try:
+            elapsed, style = _timed(json.loads, text)
+            times["parse"].append(elapsed)
+            if lyrx:
+                elapsed, (geostyler, _, _) = _timed(arcgis.convert, style, options)
+                times["togeostyler"].append(elapsed)
+            else:
+                geostyler = style
+        except Exception:
+            errors.setdefault("togeostyler", traceback.format_exc(limit=1).strip().splitlines()[-1])
+            break
+        for name in WRITERS:
+            if name in errors or name in skipped:
+                continue
+            try:
+                elapsed, _ = _timed(_writer(name), geostyler)
+                times[name].append(elapsed)
+            except Exception:
+                errors[name] = traceback.format_exc(limit=1).strip().splitlines()[-1]
+    shutil.rmtree(options["iconfolder"], ignore_errors=True)
+
+    result = {}
+    for stage in STAGES:
+        if stage in skipped:
+            result[stage] = {"skipped": skipped[stage]}
+        elif stage in errors:
+            result[stage] = {"error": errors[stage]}
+        elif times[stage]:
+            result[stage] = {"min": min(times[stage]), "median": statistics.median(times[stage]),
+                             "mean": statistics.mean(times[stage])}
+    return result
+
+
+def run(cases, repeat=3, log=None):
+    results = {
+        "version": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "repeat": repeat,
+        "cases": {},
+    }
+    for name, text, lyrx, skipped in cases:
+        results["cases"][name] = runCase(text, repeat, lyrx, skipped)
+        if log is not None:
+            log(name, results["cases"][name])
+    return results
+
+
+def compare(baseline, current, threshold=0.2, minDelta=0.001):
+    """ Returns the regressions of ``current`` against ``baseline``, as (case, stage, message) tuples.
+    A stage regresses if its minimum time grew by more than ``threshold`` (relative) and ``minDelta`` seconds,
+    or if it fails and did not fail in the baseline. """
+    regressions = []
+    for case, stages in current["cases"].items():
+        base = baseline["cases"].get(case)
+        if base is None:
+            continue
+        for stage, timing in stages.items():
+            old = base.get(stage)
+            if old is None or "skipped" in timing or "skipped" in old:
+                continue
+            if "error" in timing:
+                if "error" not in old:
+                    regressions.append((case, stage, "fails: %s" % timing["error"]))
+            elif "error" not in old:
+                delta = timing["min"] - old["min"]
+                if delta > minDelta and delta > old["min"] * threshold:
+                    regressions.append((case, stage, "%.4fs -> %.4fs (%+.0f%%)"
+                                        % (old["min"], timing["min"], 100 * delta / old["min"])))
+    return regressions
+
+
+def _printCase(name, stages):
+    timings = []
+    for stage in STAGES:
+        if stage in stages:
+            timing = stages[stage]
+            if "skipped" in timing:
+                timings.append("%s SKIPPED" % stage)
+            else:
+                timings.append("%s %s" % (stage, "ERROR" if "error" in timing else "%.4fs" % timing["min"]))
+    print("%-40s %s" % (name, "  ".join(timings)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the bridgestyle conversions")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    runParser = subparsers.add_parser("run", help="Run the benchmarks and write the results as JSON")
+    runParser.add_argument("-o", "--output", help="File to write the results to (default: stdout)")
+    runParser.add_argument("-r", "--repeat", type=int, default=3, help="Number of runs of each stage")
+    runParser.add_argument("-n", "--rules", type=int, nargs="*", default=list(DEFAULT_RULES),
+                           help="Number of rules of the synthetic styles")
+    runParser.add_argument("--depth", type=int, default=3, help="Nesting depth of the synthetic expressions")
+    runParser.add_argument("--pictures", type=int, default=10,
+                           help="Embed a picture in every Nth synthetic rule (0 for none)")
+    runParser.add_argument("--no-files", action="store_true", help="Skip the .lyrx files in test/data/arcgis")
+
+    compareParser = subparsers.add_parser("compare", help="Compare results against a stored baseline")
+    compareParser.add_argument("baseline")
+    compareParser.add_argument("current")
+    compareParser.add_argument("-t", "--threshold", type=float, default=0.2,
+                               help="Relative slowdown to report as a regression (default: 0.2)")
+    compareParser.add_argument("--min-delta", type=float, default=0.001,
+                               help="Ignore slowdowns smaller than this many seconds (default: 0.001)")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        cases = []
+        if not args.no_files:
+            cases.extend(lyrxCases())
+        cases.extend(syntheticCases(args.rules, args.depth, args.pictures))
+        log = _printCase if args.output else None
+        results = run(cases, args.repeat, log)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2)
+        else:
+            print(json.dumps(results, indent=2))
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold, args.min_delta)
+        for case, stage, message in regressions:
+            print("REGRESSION %s [%s]: %s" % (case, stage, message))
+        if not regressions:
+            print("No regressions")
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+""" Generators for large synthetic styles, used by the benchmarks.
+
+geostylerStyle() builds a GeoStyler style and cimLayer() an ArcGIS Pro (CIM) layer document.
+Both take the number of rules, the nesting depth of the generated expressions and how often a rule
+uses an embedded picture. The same arguments always produce the same style.
+"""
+import base64
+import struct
+import zlib
+
+FIELDS = ["TYPE", "CLASS", "ZONE", "STATUS", "OWNER", "REGION", "LEVEL", "SOURCE"]
+
+
+def png(width=16, height=16, rgba=(200, 30, 30, 255)):
+    """ Returns a minimal single color PNG image. """
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    row = b"\x00" + bytes(rgba) * width
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * height))
+            + chunk(b"IEND", b""))
+
+
+def _color(i):
+    return "#%02x%02x%02x" % ((i * 37) % 256, (i * 91) % 256, (i * 151) % 256)
+
+
+def _fieldValues(i, depth):
+    return [FIELDS[d % len(FIELDS)] for d in range(depth)], ["v%d_%d" % (d, (i >> d) % 7 + i) for d in range(depth)]
+
+
+def _filter(i, depth):
+    # (F0 = a AND (F1 = b OR (F2 = c AND ...)))
+    fields, values = _fieldValues(i, depth)
+    exp = ["PropertyIsEqualTo", ["PropertyName", fields[-1]], values[-1]]
+    for d in range(depth - 2, -1, -1):
+        operator = "And" if d % 2 == 0 else "Or"
+        exp = [operator, ["PropertyIsEqualTo", ["PropertyName", fields[d]], values[d]], exp]
+    return exp
+
+
+def _arithmetic(depth, field="WIDTH"):
+    # ((((WIDTH * 2) + 1) * 2) + 1) ...
+    exp = ["PropertyName", field]
+    for d in range(depth):
+        exp = ["Add" if d % 2 else "Mul", exp, 1 if d % 2 else 2]
+    return exp
+
+
+def geostylerStyle(rules=1000, depth=3, pictureEvery=10, name="synthetic"):
+    """ Returns a GeoStyler style with the given number of rules, cycling through fill, line, point and
+    label rules. Filters and some property values are expressions nested ``depth`` levels deep. Every
+    ``pictureEvery``-th rule (if > 0) has an icon referring to an image file. """
+    result = []
+    for i in range(rules):
+        symbolizers = []
+        kind = i % 4
+        if kind == 0:
+            symbolizers.append({"kind": "Fill", "color": _color(i), "opacity": 1.0, "fillOpacity": 0.8,
+                                "outlineColor": "#333333", "outlineWidth": 1, "outlineOpacity": 1.0, "Z": 0})
+        elif kind == 1:
+            symbolizers.append({"kind": "Line", "color": _color(i), "opacity": 1.0, "width": _arithmetic(depth),
+                                "cap": "round", "join": "round", "Z": 0})
+        elif kind == 2:
+            symbolizers.append({"kind": "Mark", "wellKnownName": "circle", "color": _color(i), "opacity": 1.0,
+                                "fillOpacity": 1.0, "strokeColor": "#000000", "strokeOpacity": 1.0,
+                                "strokeWidth": 1, "size": _arithmetic(depth, "SIZE"), "rotate": 0, "Z": 1})
+        else:
+            symbolizers.append({"kind": "Text", "label": ["Concatenate", ["PropertyName", "NAME"], " ",
+                                                          ["PropertyName", FIELDS[i % len(FIELDS)]]],
+                                "font": "Arial", "size": 10, "color": "#000000", "haloColor": "#ffffff",
+                                "haloSize": 1, "haloOpacity": 1.0, "anchor": "center", "group": True})
+        if pictureEvery and i % pictureEvery == 0:
+            symbolizers.append({"kind": "Icon", "image": "icons/icon%d.png" % (i % 50), "opacity": 1.0,
+                                "size": 16, "rotate": 0, "color": None, "Z": 2})
+        rule = {"name": "rule %d" % i, "filter": _filter(i, depth), "symbolizers": symbolizers}
+        if i % 3 == 0:
+            rule["scaleDenominator"] = {"min": 1000 * (i % 5 + 1), "max": 1000000}
+        result.append(rule)
+    return {"name": name, "rules": result}
+
+
+def _cimColor(i):
+    return {"type": "CIMRGBColor", "values": [(i * 37) % 256, (i * 91) % 256, (i * 151) % 256, 100]}
+
+
+def _cimSymbol(i, pictureUrl):
+    if pictureUrl is not None:
+        return {"type": "CIMPointSymbol", "symbolLayers": [
+            {"type": "CIMPictureMarker", "enable": True, "anchorPointUnits": "Relative", "size": 12,
+             "url": pictureUrl, "rotation": 0, "scaleX": 1}]}
+    if i % 2 == 0:
+        return {"type": "CIMPolygonSymbol", "symbolLayers": [
+            {"type": "CIMSolidStroke", "enable": True, "capStyle": "Round", "joinStyle": "Round",
+             "width": 0.4, "color": {"type": "CIMRGBColor", "values": [110, 110, 110, 100]}},
+            {"type": "CIMSolidFill", "enable": True, "color": _cimColor(i)}]}
+    return {"type": "CIMLineSymbol", "symbolLayers": [
+        {"type": "CIMSolidStroke", "enable": True, "capStyle": "Butt", "joinStyle": "Miter",
+         "width": 1 + i % 3, "color": _cimColor(i)}]}
+
+
+def cimLayer(rules=1000, depth=3, pictureEvery=10, name="synthetic"):
+    """ Returns an ArcGIS Pro layer document with a unique value renderer on ``depth`` fields, with the given
+    number of classes. Each class matches two value combinations. Every ``pictureEvery``-th class (if > 0)
+    uses a picture marker with an embedded PNG image. """
+    pictureUrl = "data:image/png;base64," + base64.b64encode(png()).decode()
+    fields = [FIELDS[d % len(FIELDS)] for d in range(max(depth, 1))]
+    classes = []
+    for i in range(rules):
+        values = [{"type": "CIMUniqueValue", "fieldValues": _fieldValues(i * 2 + n, len(fields))[1]}
+                  for n in range(2)]
+        picture = pictureUrl if pictureEvery and i % pictureEvery == 0 else None
+        classes.append({"type": "CIMUniqueValueClass", "label": "class %d" % i, "patch": "Default",
+                        "symbol": {"type": "CIMSymbolReference", "symbol": _cimSymbol(i, picture)},
+                        "values": values, "visible": True})
+    layer = {
+        "type": "CIMFeatureLayer",
+        "name": name,
+        "renderer": {"type": "CIMUniqueValueRenderer", "fields": fields,
+                     "groups": [{"type": "CIMUniqueValueGroup", "classes": classes}]},
+    }
+    return {"type": "CIMLayerDocument", "version": "2.6.0", "layers": ["CIMPATH=map/%s.xml" % name],
+            "layerDefinitions": [layer]}
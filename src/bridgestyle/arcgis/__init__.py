@@ -2,10 +2,21 @@ import json
 
 from . import fromgeostyler
 from . import togeostyler
+from ..profiling import span
 
 
 def toGeostyler(style, options=None):
-    return togeostyler.convert(json.loads(style), options)
+    with span(options, "parse"):
+        arcgis = json.loads(style)
+    return togeostyler.convert(arcgis, options)
+
+
+def toGeostylerLayers(style, options=None, jobs=None):
+    """ Converts every layer in a layer file, including those in group layers. Returns a list with
+    a (geostyler, icons, warnings) tuple for each layer. """
+    with span(options, "parse"):
+        arcgis = json.loads(style)
+    return togeostyler.convertLayers(arcgis, options, jobs)
 
 
 def fromGeostyler(style, options=None):
@@ -1,5 +1,6 @@
 # For now, this is limited to compound labels using the python, VB or Arcade syntax
 from ..geostyler.custom_properties import WellKnownText
+from ..geostyler.expressions import combine
 
 
 def convertExpression(expression, engine, tolowercase):
@@ -105,14 +106,7 @@ def convertWhereClause(clause, tolowercase):
                     stringToParameter(v, tolowercase),
                 ]
             )
-        expression = []
-        if len(values) == 1:
-            return subexpressions[0]
-        else:
-            accum = ["Or", subexpressions[0], subexpressions[1]]
-            for subexpression in subexpressions[2:]:
-                accum = ["Or", accum, subexpression]
-            return accum
+        return combine("Or", subexpressions)
 
     return clause
 
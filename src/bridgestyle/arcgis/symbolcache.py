@@ -0,0 +1,169 @@
+import copy
+import hashlib
+import json
+import marshal
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 1024
+
+# Conversion options that change how a CIM symbol is converted
+SYMBOL_OPTIONS = ("replaceesri", "tolowercase", "iconfolder")
+
+
+def _key(symbol, options):
+    # A hash of the canonical JSON form of the symbol and the options, the same in every process and run
+    data = json.dumps([[options.get(name) for name in SYMBOL_OPTIONS], symbol], sort_keys=True,
+                      separators=(",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def _copy(symbolizers):
+    try:
+        return marshal.loads(marshal.dumps(symbolizers))
+    except ValueError:  # not plain JSON-like data
+        return copy.deepcopy(symbolizers)
+
+
+class SymbolCache:
+    """ Bounded LRU cache of the GeoStyler symbolizers converted from CIM symbols.
+
+    Big unique value renderers often repeat the same symbol in many classes. Entries are keyed on a SHA-256 hash
+    of the conversion options that affect symbols and of the symbol as canonical JSON, and hold the symbolizers with the
+    warnings and icons that converting the symbol added to the conversion context. These are added again to
+    the context of every later conversion of the same symbol. Each caller gets its own copy of the symbolizers,
+    so they can be modified.
+
+    The cache is used if the "symbolcache" conversion option is set. Looking up and copying a symbol costs about
+    as much as converting a plain fill or line symbol, so it pays off for symbols that are expensive to convert,
+    such as pictures with color substitutions. If the option is set to a folder, converted symbols are also
+    stored there as JSON files, so that other processes (e.g. the workers of a style2style batch) and later
+    runs can reuse them.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def convert(self, symbol, options, context, convert):
+        """ Returns the symbolizers for a CIM symbol: a copy of the cached ones, or else those returned
+        by convert(). """
+        setting = options.get("symbolcache")
+        folder = setting if isinstance(setting, str) else None
+        if not setting or (self.maxsize <= 0 and not folder):
+            return convert()
+        try:
+            key = _key(symbol, options)
+        except (TypeError, ValueError):  # not plain JSON data
+            return convert()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None and folder:
+            entry = _readEntry(folder, key)
+            if entry is not None:
+                self._store(key, entry)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            symbolizers, warnings, icons = entry
+            context.warnings.extend(warnings)
+            for icon in icons:
+                context.icons[icon] = icon
+            return _copy(symbolizers)
+
+        with self._lock:
+            self.misses += 1
+        start = len(context.warnings)
+        iconsBefore = set(context.icons)
+        symbolizers = convert()
+        entry = (_copy(symbolizers), tuple(context.warnings[start:]),
+                 tuple(icon for icon in context.icons if icon not in iconsBefore))
+        self._store(key, entry)
+        if folder:
+            _writeEntry(folder, key, entry)
+        return symbolizers
+
+    def _store(self, key, entry):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+
+def _entryPath(folder, key):
+    return os.path.join(folder, key + ".json")
+
+
+def _readEntry(folder, key):
+    try:
+        with open(_entryPath(folder, key)) as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    icons = tuple(entry["icons"])
+    if not all(os.path.exists(icon) for icon in icons):  # e.g. removed from the icon store since
+        return None
+    return entry["symbolizers"], tuple(entry["warnings"]), icons
+
+
+def _writeEntry(folder, key, entry):
+    symbolizers, warnings, icons = entry
+    path = _entryPath(folder, key)
+    try:
+        data = json.dumps({"symbolizers": symbolizers, "warnings": warnings, "icons": icons})
+    except (TypeError, ValueError):
+        return
+    os.makedirs(folder, exist_ok=True)
+    # Write to a temporary file first, so other processes never read a partly written entry
+    temp = "%s.%d-%d.tmp" % (path, os.getpid(), threading.get_ident())
+    with open(temp, "w") as f:
+        f.write(data)
+    os.replace(temp, path)
+
+
+symbolCache = SymbolCache()
+
+
+def cacheInfo():
+    """ Returns the hits, misses, hit rate, size and maximum size of the shared symbol cache. """
+    return symbolCache.info()
+
+
+def clearCache():
+    symbolCache.clear()
+
+
+def setCacheSize(maxsize):
+    """ Sets the maximum number of cached symbols. A size of 0 disables the in-memory cache. """
+    symbolCache.resize(maxsize)
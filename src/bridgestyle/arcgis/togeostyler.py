@@ -1,44 +1,95 @@
 import base64
+import hashlib
 import math
 import os
-import tempfile
-import uuid
+import threading
+from collections import OrderedDict
 from typing import Union
 
 
+from ..context import ConversionContext
+from ..geostyler.expressions import combine, simplifyRules
+from ..iconstore import iconFolder, storeIcon
+from ..profiling import getProfiler
 from .constants import ESRI_SYMBOLS_FONT, POLYGON_FILL_RESIZE_FACTOR, OFFSET_FACTOR, pt_to_px
 from .expressions import convertExpression, convertWhereClause, processRotationExpression
+from .symbolcache import symbolCache
 from .wkt_geometries import to_wkt
 
 
-_usedIcons = []
-_warnings = []
+def convert(arcgis, options=None):
+    return _convertLayer((arcgis["layerDefinitions"][0], options))
 
 
-def convert(arcgis, options=None):
-    global _usedIcons
-    _usedIcons = []
-    global _warnings
-    _warnings = []
-    geostyler = processLayer(arcgis["layerDefinitions"][0], options)
-    return geostyler, _usedIcons, _warnings
+def convertLayers(arcgis, options=None, jobs=None):
+    """ Converts every layer of an ArcGIS Pro layer document (see featureLayers()) and returns a list with
+    a (geostyler, icons, warnings) tuple for each of them.
+
+    Layers are converted in parallel by ``jobs`` worker processes (all CPUs by default). With jobs=1,
+    or if the options hold a profiler, they are converted one after the other in this process.
+    """
+    layers = featureLayers(arcgis)
+    tasks = [(layer, options) for layer in layers]
+    if jobs == 1 or len(tasks) <= 1 or getProfiler(options) is not None:
+        return [_convertLayer(task) for task in tasks]
+
+    from concurrent.futures import ProcessPoolExecutor
+    jobs = min(jobs or os.cpu_count() or 1, len(tasks))
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        return list(pool.map(_convertLayer, tasks))
+
+
+def featureLayers(arcgis):
+    """ Returns the layer definitions of an ArcGIS Pro layer document that are not group layers.
+
+    Group layers are replaced by the layers they contain, so layers are returned in table of contents order,
+    followed by any layer definitions that the document (or its group layers) does not refer to.
+    """
+    definitions = arcgis.get("layerDefinitions", [])
+    byUri = {layer["uRI"]: layer for layer in definitions if "uRI" in layer}
+    layers = []
+    visited = set()
+
+    def _visit(layer):
+        if id(layer) in visited:
+            return
+        visited.add(id(layer))
+        if layer.get("type") == "CIMGroupLayer":
+            for uri in layer.get("layers", []):
+                if uri in byUri:
+                    _visit(byUri[uri])
+        else:
+            layers.append(layer)
+
+    for layer in [byUri[uri] for uri in arcgis.get("layers", []) if uri in byUri] + definitions:
+        _visit(layer)
+    return layers
+
 
+def _convertLayer(task):
+    layer, options = task
+    context = ConversionContext(options)
+    with context.span("togeostyler"):
+        geostyler = processLayer(layer, options, context)
+    return geostyler, list(context.icons), context.warnings
 
-def processLayer(layer, options=None):
+
+def processLayer(layer, options=None, context=None):
     # layer is a dictionary with the ArcGIS Pro Json style
     options = options or {}
+    context = context or ConversionContext(options)
     tolowercase = options.get("tolowercase", False)
     geostyler = {"name": layer["name"]}
     if layer["type"] == "CIMFeatureLayer":
         renderer = layer["renderer"]
         rules = []
         if renderer["type"] == "CIMSimpleRenderer":
-            rules.append(processSimpleRenderer(renderer, options))
+            rules.append(processSimpleRenderer(renderer, options, context))
         elif renderer["type"] == "CIMUniqueValueRenderer":
             if "groups" in renderer:
                 for group in renderer["groups"]:
                     rules.extend(
-                        processUniqueValueGroup(renderer["fields"], group, options)
+                        processUniqueValueGroup(renderer["fields"], group, options, context)
                     )
             else:
                 if "defaultSymbol" in renderer:
@@ -46,7 +97,7 @@ def processLayer(layer, options=None):
                     rule = {
                         "name": "",
                         "symbolizers": processSymbolReference(
-                            renderer["defaultSymbol"], options
+                            renderer["defaultSymbol"], options, context
                         ),
                     }
                     rules.append(rule)
@@ -55,12 +106,12 @@ def processLayer(layer, options=None):
             renderer["type"] == "CIMClassBreaksRenderer"
             and renderer.get("classBreakType") in ["GraduatedColor", "GraduatedSymbol"]
         ):
-            rules.extend(processClassBreaksRenderer(renderer, options))
+            rules.extend(processClassBreaksRenderer(renderer, options, context))
         
         elif renderer["type"] == "CIMChartRenderer":
-            rules.extend(processChartRenderer(renderer, options))
+            rules.extend(processChartRenderer(renderer, options, context))
         else:
-            _warnings.append("Unsupported renderer type: %s" % str(renderer))
+            context.warnings.append("Unsupported renderer type: %s" % str(renderer))
             return geostyler
 
         if layer.get("labelVisibility", False):
@@ -74,16 +125,19 @@ def processLayer(layer, options=None):
             for rule in rules:
                 [symbolizer.update({"rotate": rotation}) for symbolizer in rule["symbolizers"]]
 
+        if options.get("simplify", True):
+            with context.span("togeostyler.simplify"):
+                simplifyRules(rules)
         geostyler["rules"] = rules
     elif layer["type"] == "CIMRasterLayer":
-        _warnings.append('CIMRasterLayer are not supported yet.')
+        context.warnings.append('CIMRasterLayer are not supported yet.')
         # rules = [{"name": layer["name"], "symbolizers": [rasterSymbolizer(layer)]}]
         # geostyler["rules"] = rules
 
     return geostyler
 
 
-def processClassBreaksRenderer(renderer, options):
+def processClassBreaksRenderer(renderer, options, context):
     rules = []
     symbolsAscending = []
     field = renderer["field"]
@@ -91,7 +145,8 @@ def processClassBreaksRenderer(renderer, options):
     tolowercase = options.get("tolowercase", False)
     rotation = _getSymbolRotationFromVisualVariables(renderer, tolowercase)
     for classbreak in renderer.get("breaks", []):
-        symbolizers = processSymbolReference(classbreak["symbol"], options)
+        with context.span("togeostyler.rule", classbreak):
+            symbolizers = processSymbolReference(classbreak["symbol"], options, context)
         upperbound = classbreak.get("upperBound", 0)
         if lastbound is not None:
             filt = [
@@ -130,7 +185,7 @@ def processClassBreaksRenderer(renderer, options):
     return rules
 
 
-def processChartRenderer(renderer, options):
+def processChartRenderer(renderer, options, context):
     rules = []
 
     # Basic setup for chart renderer
@@ -139,7 +194,7 @@ def processChartRenderer(renderer, options):
     norm_fields = [f.lower() if to_lower else f for f in fields]
 
     if not norm_fields:
-        _warnings.append(
+        context.warnings.append(
             "CIMChartRenderer skipped: fieldNames list is empty; "
             "chart cannot be generated."
         )
@@ -154,7 +209,7 @@ def processChartRenderer(renderer, options):
         None
     )
     if not chart_layer:
-        _warnings.append(
+        context.warnings.append(
             "CIMChartRenderer skipped: unsupported symbol layer "
             "(only CIMPieChartMarker, CIMBarChartMarker, or CIMStackedBarChartMarker are handled)."
         )
@@ -231,7 +286,7 @@ def processChartRenderer(renderer, options):
     # Include base symbolizers if a baseSymbol is present
     base_symbolizers = []
     if "baseSymbol" in renderer:
-        base_symbolizers = processSymbolReference(renderer["baseSymbol"], options)
+        base_symbolizers = processSymbolReference(renderer["baseSymbol"], options, context)
 
     rules.append({
         "name": "Chart",
@@ -325,25 +380,17 @@ def processLabelClass(labelClass, tolowercase=False):
     return rule
 
 
-def processSimpleRenderer(renderer, options):
+def processSimpleRenderer(renderer, options, context):
     rule = {
         "name": renderer.get("label", ""),
-        "symbolizers": processSymbolReference(renderer["symbol"], options),
+        "symbolizers": processSymbolReference(renderer["symbol"], options, context),
     }
     return rule
 
 
-def processUniqueValueGroup(fields, group, options):
+def processUniqueValueGroup(fields, group, options, context):
     tolowercase = options.get("tolowercase", False)
 
-    def _and(a, b):
-        return ["And", a, b]
-
-    def _or(listConditions):
-        orConditions = listConditions
-        orConditions.insert(0, 'Or')
-        return orConditions
-
     def _equal(name, val):
         if val == "<Null>":
             return [
@@ -364,21 +411,24 @@ def processUniqueValueGroup(fields, group, options):
         for v in values:
             if "fieldValues" in v:
                 fieldValues = v["fieldValues"]
-                condition = _equal(fields[0], fieldValues[0])
-                for fieldValue, fieldName in zip(fieldValues[1:], fields[1:]):
-                    condition = _and(condition, _equal(fieldName, fieldValue))
-                conditions.append(condition)
+                conditions.append(combine("And", [_equal(fieldName, fieldValue)
+                                                  for fieldName, fieldValue in zip(fields, fieldValues)]))
         if conditions:
-            ruleFilter = conditions[0] if len(conditions) <= 1 else _or(conditions)
-
-            rule["filter"] = ruleFilter
-            rule["symbolizers"] = processSymbolReference(clazz["symbol"], options)
+            rule["filter"] = combine("Or", conditions)
+            with context.span("togeostyler.rule", clazz):
+                rule["symbolizers"] = processSymbolReference(clazz["symbol"], options, context)
             rules.append(rule)
 
     return rules
 
 
-def processSymbolReference(symbolref, options):
+def processSymbolReference(symbolref, options, context):
+    # Converted symbols are cached: many classes share the same symbol
+    return symbolCache.convert(symbolref["symbol"], options, context,
+                               lambda: _processSymbolReference(symbolref, options, context))
+
+
+def _processSymbolReference(symbolref, options, context):
     symbol = symbolref["symbol"]
     symbolizers = []
     if "symbolLayers" not in symbol:
@@ -386,7 +436,7 @@ def processSymbolReference(symbolref, options):
     for layer in symbol["symbolLayers"][::-1]:  # drawing order for geostyler is inverse of rule order
         if not layer["enable"]:
             continue
-        symbolizer = processSymbolLayer(layer, symbol["type"], options)
+        symbolizer = processSymbolLayer(layer, symbol["type"], options, context)
         if symbolizer is None:
             continue
         if layer["type"] in [
@@ -398,13 +448,13 @@ def processSymbolReference(symbolref, options):
                 # Functions "xyzPoint" and "xyzAngle" are not supported in the legend in GeoServer,
                 # so we include this symbol only on the map and not in the legend (using inclusion: "mapOnly")
                 if layer["type"] == "CIMCharacterMarker" and _orientedMarkerAtRatioOfLine(layer["markerPlacement"], 1):
-                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "end", options)
+                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "end", options, context)
                     symbolizer["inclusion"] = "mapOnly"
                 elif layer["type"] == "CIMCharacterMarker" and _orientedMarkerAtRatioOfLine(layer["markerPlacement"], 0.5):
-                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "mid", options)
+                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "mid", options, context)
                     symbolizer["inclusion"] = "mapOnly"
                 elif layer["type"] == "CIMCharacterMarker" and _orientedMarkerAtRatioOfLine(layer["markerPlacement"], 0):
-                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "start", options)
+                    symbolizer = _processOrientedMarkerAtFunctionOfLine(layer, "start", options, context)
                     symbolizer["inclusion"] = "mapOnly"
                 else:
                     symbolizer = _formatLineSymbolizer(symbolizer)
@@ -448,13 +498,13 @@ def _formatPolygonSymbolizer(symbolizer, markerPlacement):
         }
     return symbolizer
 
-def _processOrientedMarkerAtFunctionOfLine(layer, functionPrefix, options):
+def _processOrientedMarkerAtFunctionOfLine(layer, functionPrefix, options, context):
     replaceesri = options.get("replaceesri", False)
     fontFamily = layer["fontFamilyName"]
     charindex = layer["characterIndex"]
     hexcode = hex(charindex)
     if fontFamily == ESRI_SYMBOLS_FONT and replaceesri:
-        name = _esriFontToStandardSymbols(charindex)
+        name = _esriFontToStandardSymbols(charindex, context)
     else:
         name = "ttf://%s#%s" % (fontFamily, hexcode)
     rotation = layer.get("rotation", 0)
@@ -552,7 +602,7 @@ def _hatchMarkerForAngle(angle):
     ][quadrant]
 
 
-def _esriFontToStandardSymbols(charindex):
+def _esriFontToStandardSymbols(charindex, context):
     mapping = {
         33: "circle",
         34: "square",
@@ -568,50 +618,92 @@ def _esriFontToStandardSymbols(charindex):
     if charindex in mapping:
         return mapping[charindex]
     else:
-        _warnings.append(
+        context.warnings.append(
             f"Unsupported symbol from ESRI font (character index {charindex}) replaced by default marker"
         )
         return "circle"
 
 
-def apply_color_substitution(image_data, substitutions):
+COLOR_SUBSTITUTION_CACHE_SIZE = 128
+
+_colorSubstitutionCache = OrderedDict()  # (image hash, color map) -> recolored PNG image
+_colorSubstitutionLock = threading.Lock()
+
+
+def apply_color_substitution(image_data, substitutions, context):
+    """ Returns the image with the color substitutions of a picture symbol applied, as a PNG image, or the
+    original image (with a warning) if they cannot be applied. """
     try:
-        from PIL import Image
-        from io import BytesIO
+        from PIL import Image  # noqa: F401
     except ImportError:
-        # Optional: emit logging warning instead of print
-        print("Warning: Pillow is not installed. Skipping color substitution.")
+        context.warnings.append("Pillow is not installed, color substitutions have not been applied")
         return image_data
 
-    try:
-        original_image = Image.open(BytesIO(image_data))
-        image = original_image.convert("RGBA")
-        pixels = image.load()
-
-        color_map = {}
-        for sub in substitutions:
-            old = _hexToRGB(_processColor(sub["oldColor"]))
-            new = _hexToRGB(_processColor(sub["newColor"]))
-            color_map[old] = new
-
-        width, height = image.size
-        for x in range(width):
-            for y in range(height):
-                r, g, b, a = pixels[x, y]
-                if (r, g, b) in color_map:
-                    nr, ng, nb = color_map[(r, g, b)]
-                    pixels[x, y] = (nr, ng, nb, a)
-
-        output = BytesIO()
-        # Use PNG as Python writes in BGR order, but Java cannot read it
-        image.save(output, format="PNG")
-        return output.getvalue()
+    colorMap = {}
+    for sub in substitutions:
+        old = _hexToRGB(_processColor(sub["oldColor"]))
+        new = _hexToRGB(_processColor(sub["newColor"]))
+        colorMap[old] = new
+    key = (hashlib.sha256(image_data).digest(), tuple(colorMap.items()))
+    with _colorSubstitutionLock:
+        if key in _colorSubstitutionCache:
+            _colorSubstitutionCache.move_to_end(key)
+            return _colorSubstitutionCache[key]
 
+    try:
+        result = _substituteColors(image_data, colorMap)
     except Exception as e:
-        print(f"Warning: Failed to apply color substitution: {e}")
-        return None
+        context.warnings.append(f"Failed to apply color substitutions: {e}")
+        return image_data
+
+    with _colorSubstitutionLock:
+        _colorSubstitutionCache[key] = result
+        while len(_colorSubstitutionCache) > COLOR_SUBSTITUTION_CACHE_SIZE:
+            _colorSubstitutionCache.popitem(last=False)
+    return result
+
+
+def _substituteColors(image_data, colorMap):
+    """ Replaces the RGB colors in the keys of colorMap by their values (keeping the alpha of each pixel),
+    all at once for the whole image, and returns the result as a PNG image. """
+    from PIL import Image, ImageChops
+    from io import BytesIO
 
-def processSymbolLayer(layer, symboltype, options):
+    image = Image.open(BytesIO(image_data)).convert("RGBA")
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    if numpy is not None:
+        pixels = numpy.array(image)
+        rgb = pixels[..., :3].astype(numpy.uint32)
+        packed = (rgb[..., 0] << 16) | (rgb[..., 1] << 8) | rgb[..., 2]
+        # Masks are computed on the original colors, so a substituted color is not substituted again
+        masks = [(packed == ((r << 16) | (g << 8) | b), new) for (r, g, b), new in colorMap.items()]
+        for mask, new in masks:
+            pixels[mask, :3] = new
+        image = Image.fromarray(pixels, "RGBA")
+    else:
+        bands = image.split()
+        newBands = [band.copy() for band in bands[:3]]
+        for old, new in colorMap.items():
+            # 255 where the band has the old value, 0 elsewhere, and then where all 3 bands have it
+            masks = [band.point([255 if v == value else 0 for v in range(256)]) for band, value in zip(bands, old)]
+            mask = ImageChops.multiply(ImageChops.multiply(masks[0], masks[1]), masks[2])
+            if mask.getbbox() is None:
+                continue
+            for band, value in zip(newBands, new):
+                band.paste(value, None, mask)
+        image = Image.merge("RGBA", newBands + [bands[3]])
+
+    output = BytesIO()
+    # Use PNG as Python writes in BGR order, but Java cannot read it
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def processSymbolLayer(layer, symboltype, options, context):
     replaceesri = options.get("replaceesri", False)
     if layer["type"] == "CIMSolidStroke":
         effects = _extractEffect(layer)
@@ -652,7 +744,7 @@ def processSymbolLayer(layer, symboltype, options):
         hexcode = hex(charindex)
         size = _ptToPxProp(layer, "size", 12)
         if fontFamily == ESRI_SYMBOLS_FONT and replaceesri:
-            name = _esriFontToStandardSymbols(charindex)
+            name = _esriFontToStandardSymbols(charindex, context)
         else:
             name = "ttf://%s#%s" % (fontFamily, hexcode)
         rotate = layer.get("rotation", 0)
@@ -702,7 +794,7 @@ def processSymbolLayer(layer, symboltype, options):
         if markerGraphics:
             # TODO: support multiple marker graphics
             markerGraphic = markerGraphics[0]
-            marker = processSymbolReference(markerGraphic, {})[0]
+            marker = processSymbolReference(markerGraphic, {}, context)[0]
             sublayers = [sublayer for sublayer in markerGraphic["symbol"]["symbolLayers"] if sublayer["enable"]]
             fillColor = _extractFillColor(sublayers)
             strokeColor, strokeWidth = _extractStroke(sublayers)
@@ -788,33 +880,32 @@ def processSymbolLayer(layer, symboltype, options):
                 # In case of slash pattern, the pattern is the hypotenuse, we want the X (or Y) value for the size.
                 neededSize = math.cos(math.radians(45)) * neededSize
                 # The trick with the margin to keep the original size is not possible.
-                _warnings.append('Unable to keep the original size of CIMHatchFill with tilted symbol (slash).')
+                context.warnings.append('Unable to keep the original size of CIMHatchFill with tilted symbol (slash).')
             fill["graphicFill"][0]["size"] = neededSize
         return fill
 
     elif layer["type"] in ["CIMPictureFill", "CIMPictureMarker"]:
         url = layer["url"]
-        if not os.path.exists(url):
+        colorSubstitutions = layer.get("colorSubstitutions")
+        # The same picture is often used by many classes: decode and store it only once
+        pictureKey = (url, repr(colorSubstitutions))
+        if pictureKey in context.pictures:
+            url = context.pictures[pictureKey]
+        elif not os.path.exists(url):
             tokens = url.split(";")
             if len(tokens) == 2:
                 ext = tokens[0].split("/")[-1]
                 data = tokens[1][len("base64,") :]
-                path = os.path.join(
-                    tempfile.gettempdir(),
-                    "bridgestyle",
-                    str(uuid.uuid4()).replace("-", ""),
-                )
-                image = base64.decodebytes(data.encode())
-                colorSubstitutions = layer.get("colorSubstitutions")
-                if colorSubstitutions:
-                    image = apply_color_substitution(image, colorSubstitutions)
-                    ext = "png" # Color substitution requires PNG format
-                iconName = f"{str(uuid.uuid4())}.{ext}"
-                iconFile = os.path.join(path, iconName)
-                os.makedirs(path, exist_ok=True)
-                with open(iconFile, "wb") as f:
-                    f.write(image)
-                    _usedIcons.append(iconFile)
+                with context.span("togeostyler.picture"):
+                    image = base64.decodebytes(data.encode())
+                    if colorSubstitutions:
+                        recolored = apply_color_substitution(image, colorSubstitutions, context)
+                        if recolored is not image:
+                            # Recolored images are PNG images
+                            image, ext = recolored, "png"
+                    iconFile = storeIcon(image, ext, iconFolder(options))
+                context.icons[iconFile] = iconFile
+                context.pictures[pictureKey] = iconFile
                 url = iconFile
 
         rotate = layer.get("rotation", 0)
@@ -0,0 +1,27 @@
+from .profiling import NO_SPAN, getProfiler
+
+
+class ConversionContext:
+    """ Holds the state of a single style conversion.
+
+    Each ``convert()`` call creates its own context and passes it down explicitly to every function
+    that needs to record warnings, icons, sprites or symbols. Nothing is kept in module globals,
+    so several conversions can safely run at the same time (e.g. on a thread pool).
+    """
+
+    def __init__(self, options=None):
+        self.options = options or {}
+        self.warnings = []
+        self.icons = {}     # icon path -> source (file path or QGIS symbol layer)
+        self.pictures = {}  # ArcGIS only: (picture URL, color substitutions) -> extracted icon path
+        self.sprites = {}   # sprite name -> {"image": Image, "image2x": Image}
+        self.symbols = []   # MapServer SYMBOL definitions
+        self.expressionConverter = None  # QGIS only: ExpressionConverter for the layer being converted
+        self.profiler = getProfiler(self.options)
+
+    def span(self, stage, rule=None):
+        """ Returns a context manager that reports the time spent in its block to the profiler given in
+        the options (see profiling.Profiler), or does nothing if there is none. """
+        if self.profiler is None:
+            return NO_SPAN
+        return self.profiler.span(stage, rule)
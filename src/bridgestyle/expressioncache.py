@@ -0,0 +1,101 @@
+import marshal
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAXSIZE = 4096
+
+
+def _call(convert, exp, context, args):
+    return convert(exp, *args) if context is None else convert(exp, context, *args)
+
+
+class ExpressionCache:
+    """ Bounded LRU cache of translated GeoStyler expressions, shared by the SLD, MapLibre and MapServer writers.
+
+    Entries are keyed on the writer, any extra arguments that change the translation and the canonical form
+    of the expression. Writers only cache whole expressions (not their parts) and skip the cache for plain
+    literals, which are cheaper to translate than to look up. The warnings a translation adds to the conversion
+    context are stored with it and added again to the context of every later conversion that gets the
+    same translation from the cache.
+
+    Cached translations are shared between conversions, so they must not be modified.
+    """
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def translate(self, writer, exp, convert, context=None, *args):
+        """ Returns convert(exp, context, *args) (or convert(exp, *args) if no context is given), from the
+        cache if the same expression was translated before by the same writer. """
+        if self.maxsize <= 0:
+            return _call(convert, exp, context, args)
+        try:
+            # A fast and deterministic canonical form, which also tells 1, 1.0, True and "1" apart
+            key = (writer, args, marshal.dumps(exp, 2))
+        except ValueError:  # not a plain literal, e.g. WellKnownText
+            return _call(convert, exp, context, args)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:  # evicted by another thread in the meantime
+                pass
+            result, warnings = entry
+            if warnings:
+                context.warnings.extend(warnings)
+            return result
+
+        self.misses += 1
+        start = len(context.warnings) if context is not None else 0
+        result = _call(convert, exp, context, args)
+        warnings = tuple(context.warnings[start:]) if context is not None else ()
+        with self._lock:
+            self._entries[key] = (result, warnings)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return result
+
+    def info(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hitRate": self.hits / lookups if lookups else 0.0,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._entries) > max(maxsize, 0):
+                self._entries.popitem(last=False)
+
+
+expressionCache = ExpressionCache()
+
+
+def cacheInfo():
+    """ Returns the hits, misses, hit rate, size and maximum size of the shared expression cache. """
+    return expressionCache.info()
+
+
+def clearCache():
+    expressionCache.clear()
+
+
+def setCacheSize(maxsize):
+    """ Sets the maximum number of cached translations. A size of 0 disables the cache. """
+    expressionCache.resize(maxsize)
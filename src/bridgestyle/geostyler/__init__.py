@@ -1,9 +1,18 @@
 import json
 
+from . import model
+from .expressions import simplifyRules
+from ..profiling import span
+
 
 def toGeostyler(style, options=None):
-    return json.loads(style), [], []
+    geostyler = json.loads(style)
+    if (options or {}).get("simplify", True):
+        with span(options, "togeostyler.simplify"):
+            simplifyRules(geostyler.get("rules", []))
+    return geostyler, [], []
 
 
 def fromGeostyler(style, options=None):
-    return json.dumps(style), [], []
+    with span(options, "geostyler"):
+        return json.dumps(model.toDict(style)), []
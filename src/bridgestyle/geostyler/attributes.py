@@ -0,0 +1,58 @@
+""" The attributes that a GeoStyler style needs, so that publishing tools can leave out all other columns
+(e.g. with the propertyName parameter of WFS requests, SQL views or the attribute lists of vector tiles). """
+from .expressions import propertyNames
+
+
+def requiredAttributes(geostyler):
+    """ Returns the attributes referenced by the rule filters, symbolizer properties (labels, rotations, sizes...)
+    and transformation of a GeoStyler style, as a JSON-ready dict:
+
+    - "attributes": all of them, sorted
+    - "rules": the name, scale denominators (if any) and attributes of every rule
+    - "scales": the attributes needed within each scale denominator range, from "min" (inclusive) to "max"
+      (exclusive, None if unbounded), for the ranges where any rule applies
+    """
+    rules = []
+    for rule in geostyler.get("rules", []):
+        names = propertyNames(rule.get("filter"))
+        propertyNames(rule.get("symbolizers", []), names)
+        entry = {"name": rule.get("name", ""), "attributes": sorted(names)}
+        if rule.get("scaleDenominator"):
+            entry["scaleDenominator"] = dict(rule["scaleDenominator"])
+        rules.append(entry)
+
+    extra = propertyNames(geostyler.get("transformation"))
+    attributes = set(extra)
+    for rule in rules:
+        attributes.update(rule["attributes"])
+    return {
+        "name": geostyler.get("name", ""),
+        "attributes": sorted(attributes),
+        "rules": rules,
+        "scales": _scaleRanges(rules, extra),
+    }
+
+
+def _scaleRanges(rules, extra):
+    # The attributes of the rules for each distinct scale denominator range
+    byScale = {}
+    for rule in rules:
+        scale = rule.get("scaleDenominator", {})
+        byScale.setdefault((scale.get("min"), scale.get("max")), set()).update(rule["attributes"])
+    bounds = {bound for scale in byScale for bound in scale if bound is not None}
+    bounds = [None] + sorted(bounds) + [None]
+    ranges = []
+    for low, high in zip(bounds, bounds[1:]):
+        names = None
+        for (minScale, maxScale), attributes in byScale.items():
+            if ((minScale is None or (low is not None and minScale <= low))
+                    and (maxScale is None or (high is not None and maxScale >= high))):
+                names = (names or set()) | attributes
+        if names is None:  # no rule applies
+            continue
+        names = sorted(names | extra)
+        if ranges and ranges[-1]["max"] == low and ranges[-1]["attributes"] == names:
+            ranges[-1]["max"] = high
+        else:
+            ranges.append({"min": low, "max": high, "attributes": names})
+    return ranges
@@ -0,0 +1,9 @@
+# Names of the OGC operators and functions in GeoStyler expressions that the converters refer to.
+# Kept apart from qgis.expressions so that the writers do not depend on QGIS.
+OGC_PROPERTYNAME = "PropertyName"
+OGC_IS_EQUAL_TO = "PropertyIsEqualTo"
+OGC_IS_NULL = "PropertyIsNull"
+OGC_IS_NOT_NULL = "PropertyIsNotNull"
+OGC_IS_LIKE = "PropertyIsLike"
+OGC_CONCAT = "Concatenate"
+OGC_SUB = "Sub"
@@ -0,0 +1,282 @@
+""" Helpers for GeoStyler expressions: filters and property values written as nested lists, such as
+["And", ["PropertyIsEqualTo", ["PropertyName", "TYPE"], "road"], ["PropertyIsGreaterThan", ...]].
+
+"And" and "Or" take any number of operands. A class with thousands of values gives a single "Or" node with thousands
+of operands rather than a chain thousands of levels deep, and translate() switches to an explicit stack for deep
+expressions, so that neither wide nor deep expressions can exceed the recursion limit.
+"""
+import marshal
+from collections.abc import Mapping
+
+
+def combine(operator, operands):
+    """ Returns the flat n-ary ``operator`` ("And" or "Or") node of the given operands. The operands of operands
+    that are ``operator`` nodes themselves are merged in. A single operand is returned as it is. """
+    node = [operator]
+    for operand in operands:
+        if isinstance(operand, list) and operand and operand[0] == operator:
+            node.extend(operand[1:])
+        else:
+            node.append(operand)
+    return node[1] if len(node) == 2 else node
+
+
+# Expressions are translated recursively up to this depth, which is faster for the usual (shallow) ones. Deeper
+# parts are translated with an explicit stack.
+MAX_RECURSION = 64
+
+
+def translate(exp, expand, leaf, arg=None):
+    """ Translates an expression bottom-up, without exceeding the recursion limit however deep it is.
+
+    ``expand(node, arg)`` is called for every list node, in the order a recursive translation would visit them,
+    and returns ``(children, childArg, build)``: the operands to translate first, the argument to translate them
+    with, and the function that returns the translation of the node from ``(node, translations)``, where the
+    translations of the children are in the same order. Other nodes (literals) are translated with
+    ``leaf(node, arg)``.
+    """
+    if not isinstance(exp, list):
+        return leaf(exp, arg)
+    return _translate(exp, expand, leaf, arg, MAX_RECURSION)
+
+
+def _translate(exp, expand, leaf, arg, depth):
+    if not depth:
+        return _translateWithStack(exp, expand, leaf, arg)
+    children, childArg, build = expand(exp, arg)
+    translations = []
+    for child in children:
+        if isinstance(child, list):
+            translations.append(_translate(child, expand, leaf, childArg, depth - 1))
+        else:
+            translations.append(leaf(child, childArg))
+    return build(exp, translations)
+
+
+def _translateWithStack(exp, expand, leaf, arg):
+    children, childArg, build = expand(exp, arg)
+    translations = []
+    operands = iter(children)
+    stack = []
+    while True:
+        for child in operands:
+            if isinstance(child, list):
+                # Continue with this node once the child has been translated
+                stack.append((exp, childArg, build, operands, translations))
+                exp = child
+                children, childArg, build = expand(child, childArg)
+                translations = []
+                operands = iter(children)
+                break
+            translations.append(leaf(child, childArg))
+        else:
+            translation = build(exp, translations)
+            if not stack:
+                return translation
+            exp, childArg, build, operands, translations = stack.pop()
+            translations.append(translation)
+
+
+def propertyNames(value, names=None):
+    """ Returns the set of attribute names ("PropertyName" nodes) that an expression refers to, added to ``names``
+    if given. Lists of expressions and dicts such as symbolizers are searched as well, however deeply nested. """
+    names = set() if names is None else names
+    stack = [value]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, list) and node:
+            if node[0] == "PropertyName" and len(node) == 2 and isinstance(node[1], str):
+                names.add(node[1])
+            else:
+                stack.extend(node[1:] if isinstance(node[0], str) else node)
+        elif isinstance(node, Mapping):
+            stack.extend(node.values())
+    return names
+
+
+_lowerBounds = {"PropertyIsGreaterThan": False, "PropertyIsGreaterThanOrEqualTo": True}
+_upperBounds = {"PropertyIsLessThan": False, "PropertyIsLessThanOrEqualTo": True}
+
+
+def isLiteral(value):
+    """ Returns whether a value is a string or number literal (booleans and None are not). """
+    return isinstance(value, (str, int, float)) and not isinstance(value, bool)
+
+
+def _comparison(exp):
+    # [operator, ["PropertyName", name], literal] -> (name, literal)
+    if (isinstance(exp, list) and len(exp) == 3 and isinstance(exp[1], list) and len(exp[1]) == 2
+            and exp[1][0] == "PropertyName" and isLiteral(exp[2])):
+        return exp[1][1], exp[2]
+    return None, None
+
+
+def valueSet(filt):
+    """ Returns ``(attribute, values)`` if the filter tests a single attribute for equality with one or more
+    literals (an "Or" of "PropertyIsEqualTo" comparisons), or else None. """
+    clauses = filt[1:] if isinstance(filt, list) and filt and filt[0] == "Or" else [filt]
+    attribute = None
+    values = []
+    for clause in clauses:
+        if not isinstance(clause, list) or not clause or clause[0] != "PropertyIsEqualTo":
+            return None
+        name, value = _comparison(clause)
+        if name is None or attribute not in (None, name):
+            return None
+        attribute = name
+        values.append(value)
+    return None if attribute is None else (attribute, values)
+
+
+def valueRange(filt):
+    """ Returns ``(attribute, (low, lowInclusive, high, highInclusive))`` if the filter tests a single attribute
+    against a numeric range (a comparison, or an "And" of a lower and an upper bound), or else None. Unbounded
+    ends are None. """
+    clauses = filt[1:] if isinstance(filt, list) and filt and filt[0] == "And" else [filt]
+    attribute = None
+    low = high = None
+    lowInclusive = highInclusive = False
+    for clause in clauses:
+        name, value = _comparison(clause)
+        if name is None or isinstance(value, str) or attribute not in (None, name):
+            return None
+        attribute = name
+        if clause[0] in _lowerBounds and low is None:
+            low, lowInclusive = value, _lowerBounds[clause[0]]
+        elif clause[0] in _upperBounds and high is None:
+            high, highInclusive = value, _upperBounds[clause[0]]
+        else:
+            return None
+    return None if attribute is None else (attribute, (low, lowInclusive, high, highInclusive))
+
+
+def _isNumber(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _key(exp):
+    try:
+        return marshal.dumps(exp)
+    except ValueError:
+        return repr(exp)
+
+
+def _fold(operator, a, b):
+    if operator == "Add":
+        result = a + b
+    elif operator == "Sub":
+        result = a - b
+    elif operator == "Mul":
+        result = a * b
+    else:
+        result = a / b
+        if isinstance(a, int) and isinstance(b, int) and result.is_integer():
+            return int(result)
+    # No floating point noise such as 0.30000000000000004, in significant digits so that small values are kept
+    return float("%.15g" % result) if isinstance(result, float) else result
+
+
+# Operand values that leave the other operand unchanged, by operator and operand position
+_identities = {"Add": (0, 0), "Sub": (None, 0), "Mul": (1, 1), "Div": (None, 1)}
+
+# Operators and functions that always return numbers. Other operands (such as attributes) may be strings, which an
+# operation with an identity value turns into numbers (or, with "Add", concatenates)
+_numeric = {"Sub", "Mul", "Div", "parseDouble", "parseInt", "parseLong"}
+
+
+def _isNumeric(exp):
+    return _isNumber(exp) or (isinstance(exp, list) and bool(exp) and exp[0] in _numeric)
+
+
+def _simplifyNode(node, args):
+    operator = node[0]
+    if operator in _identities and len(args) == 2:
+        a, b = args
+        if _isNumber(a) and _isNumber(b):
+            if operator == "Div" and b == 0:
+                return [operator] + args
+            return _fold(operator, a, b)
+        left, right = _identities[operator]
+        if _isNumber(a) and a == left and _isNumeric(b):
+            return b
+        if _isNumber(b) and b == right and _isNumeric(a):
+            return a
+        if operator in ("Add", "Mul") and (_isNumber(a) or _isNumber(b)):
+            # (2 * (3 * x)) is (6 * x)
+            number, other = (a, b) if _isNumber(a) else (b, a)
+            if isinstance(other, list) and len(other) == 3 and other[0] == operator:
+                if _isNumber(other[1]) and (operator == "Mul" or _isNumeric(other[2])):
+                    return _simplifyNode(node, [_fold(operator, number, other[1]), other[2]])
+                if _isNumber(other[2]) and (operator == "Mul" or _isNumeric(other[1])):
+                    return _simplifyNode(node, [other[1], _fold(operator, number, other[2])])
+    elif operator in ("And", "Or"):
+        operands = []
+        seen = set()
+        for arg in args:
+            for operand in (arg[1:] if isinstance(arg, list) and arg and arg[0] == operator else (arg,)):
+                key = _key(operand)
+                if key not in seen:
+                    seen.add(key)
+                    operands.append(operand)
+        return operands[0] if len(operands) == 1 else [operator] + operands
+    return [operator] + args
+
+
+def _expandSimplify(node, arg):
+    return node[1:], None, _simplifyNode
+
+
+def _same(value, arg):
+    return value
+
+
+def simplify(exp):
+    """ Returns the simplified version of an expression: arithmetic on number literals is computed, operations that
+    don't change a numeric operand (adding 0, multiplying by 1...) are removed, and nested "And"/"Or" nodes are
+    flattened, without repeated operands. Parts with nothing to simplify are returned as they are, not copied. """
+    if not isinstance(exp, list) or not exp or not isinstance(exp[0], str) or exp[0] == "PropertyName":
+        return exp
+    return _simplify(exp, MAX_RECURSION)
+
+
+_simplifiable = set(_identities) | {"And", "Or"}
+
+
+def _simplify(exp, depth):
+    if not depth:
+        return translate(exp, _expandSimplify, _same)
+    args = exp[1:]
+    changed = False
+    for i, arg in enumerate(args):
+        if isinstance(arg, list) and arg and arg[0] != "PropertyName":
+            simplified = _simplify(arg, depth - 1)
+            if simplified is not arg:
+                args[i] = simplified
+                changed = True
+    if changed or exp[0] in _simplifiable:
+        return _simplifyNode(exp, args)
+    return exp
+
+
+def _simplifyValue(value):
+    if isinstance(value, list):
+        if value and isinstance(value[0], str):
+            return simplify(value)
+        return [_simplifyValue(v) for v in value]
+    if isinstance(value, dict):
+        for name, v in value.items():
+            if isinstance(v, (list, dict)):
+                value[name] = _simplifyValue(v)
+    return value
+
+
+def simplifyRules(rules):
+    """ Simplifies (see simplify()) the filters and the symbolizer property expressions of GeoStyler rules,
+    in place. Symbolizers within symbolizers, such as graphic fills, are simplified as well. """
+    for rule in rules:
+        filt = rule.get("filter")
+        if isinstance(filt, list):
+            rule["filter"] = simplify(filt)
+        for symbolizer in rule.get("symbolizers", []):
+            _simplifyValue(symbolizer)
+    return rules
@@ -0,0 +1,206 @@
+""" Compact typed representation of GeoStyler styles.
+
+Style, Rule, ScaleDenominator and the symbolizer classes store the known properties of a GeoStyler object in
+``__slots__`` (so no per-object dict and no stored keys), and any other properties in a small ``extra`` dict.
+They can be converted losslessly from and to the plain dict form with fromDict() and toDict().
+
+The classes also behave as read-only mappings (``obj["name"]``, ``obj.get("name")``, ``"name" in obj``),
+so the SLD, MapLibre and MapServer writers accept them wherever they accept the dict form.
+Expressions (filters and property values) are kept as they are.
+"""
+from collections.abc import Mapping
+
+
+class _Model(Mapping):
+    __slots__ = ("extra",)
+
+    FIELDS = ()
+
+    def __init__(self, **properties):
+        self.extra = None
+        for key, value in properties.items():
+            self[key] = value
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._fieldSet = frozenset(cls.FIELDS)
+
+    def __setitem__(self, key, value):
+        if key in self._fieldSet:
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __getitem__(self, key):
+        if key in self._fieldSet:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self.extra is not None:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key in self._fieldSet:
+            return getattr(self, key, default)
+        if self.extra is not None:
+            return self.extra.get(key, default)
+        return default
+
+    def __contains__(self, key):
+        if key in self._fieldSet:
+            return hasattr(self, key)
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % item for item in self.items()))
+
+    @classmethod
+    def fromDict(cls, d):
+        if isinstance(d, cls):
+            return d
+        obj = cls.__new__(cls)
+        obj.extra = None
+        for key, value in d.items():
+            obj[key] = obj._fromDictValue(key, value)
+        return obj
+
+    def _fromDictValue(self, key, value):
+        return value
+
+    def toDict(self):
+        return {key: _toDictValue(value) for key, value in self.items()}
+
+
+def _toDictValue(value):
+    if isinstance(value, _Model):
+        return value.toDict()
+    if isinstance(value, list):
+        return [v.toDict() if isinstance(v, _Model) else v for v in value]
+    return value
+
+
+class ScaleDenominator(_Model):
+    FIELDS = ("min", "max")
+    __slots__ = FIELDS
+
+
+class Symbolizer(_Model):
+    """ Base class of the symbolizers. Their kind is a class attribute, so it takes no space in the objects. """
+    __slots__ = ()
+    kind = None
+
+    def __setitem__(self, key, value):
+        if key == "kind":
+            if value != self.kind:
+                raise ValueError("Cannot change the kind of a %s to '%s'" % (type(self).__name__, value))
+        else:
+            super().__setitem__(key, value)
+
+
+class OtherSymbolizer(Symbolizer):
+    """ A symbolizer of a kind without its own class. All its properties (including the kind) are kept in ``extra``. """
+    __slots__ = ()
+
+    @property
+    def kind(self):
+        return self.extra.get("kind") if self.extra is not None else None
+
+    def __setitem__(self, key, value):
+        _Model.__setitem__(self, key, value)
+
+
+class LineSymbolizer(Symbolizer):
+    kind = "Line"
+    FIELDS = ("kind", "color", "opacity", "width", "dasharray", "cap", "join", "perpendicularOffset",
+              "graphicStroke", "graphicStrokeInterval", "graphicStrokeOffset", "Z")
+    __slots__ = FIELDS[1:]
+
+
+class FillSymbolizer(Symbolizer):
+    kind = "Fill"
+    FIELDS = ("kind", "color", "opacity", "fillOpacity", "outlineColor", "outlineOpacity", "outlineWidth",
+              "outlineDasharray", "graphicFill", "graphicFillDistanceX", "graphicFillDistanceY",
+              "graphicFillMarginX", "graphicFillMarginY", "Z")
+    __slots__ = FIELDS[1:]
+
+
+class MarkSymbolizer(Symbolizer):
+    kind = "Mark"
+    FIELDS = ("kind", "wellKnownName", "color", "opacity", "fillOpacity", "strokeColor", "strokeOpacity",
+              "strokeWidth", "size", "rotate", "offset", "Z")
+    __slots__ = FIELDS[1:]
+
+
+class IconSymbolizer(Symbolizer):
+    kind = "Icon"
+    FIELDS = ("kind", "image", "color", "opacity", "size", "rotate", "Z")
+    __slots__ = FIELDS[1:]
+
+
+class TextSymbolizer(Symbolizer):
+    kind = "Text"
+    FIELDS = ("kind", "label", "font", "size", "color", "opacity", "rotate", "anchor", "offset",
+              "perpendicularOffset", "haloColor", "haloSize", "haloOpacity", "group", "followLine", "background")
+    __slots__ = FIELDS[1:]
+
+
+class RasterSymbolizer(Symbolizer):
+    kind = "Raster"
+    FIELDS = ("kind", "opacity", "channelSelection", "colorMap")
+    __slots__ = FIELDS[1:]
+
+
+_symbolizerClasses = {cls.kind: cls for cls in (LineSymbolizer, FillSymbolizer, MarkSymbolizer,
+                                                IconSymbolizer, TextSymbolizer, RasterSymbolizer)}
+
+
+def symbolizerFromDict(d):
+    if isinstance(d, Symbolizer):
+        return d
+    return _symbolizerClasses.get(d.get("kind"), OtherSymbolizer).fromDict(d)
+
+
+class Rule(_Model):
+    FIELDS = ("name", "filter", "scaleDenominator", "symbolizers")
+    __slots__ = FIELDS
+
+    def _fromDictValue(self, key, value):
+        if key == "scaleDenominator" and isinstance(value, dict):
+            return ScaleDenominator.fromDict(value)
+        if key == "symbolizers" and isinstance(value, list):
+            return [symbolizerFromDict(s) if isinstance(s, dict) else s for s in value]
+        return value
+
+
+class Style(_Model):
+    FIELDS = ("name", "rules", "transformation", "blendMode")
+    __slots__ = FIELDS
+
+    def _fromDictValue(self, key, value):
+        if key == "rules" and isinstance(value, list):
+            return [Rule.fromDict(r) if isinstance(r, dict) else r for r in value]
+        return value
+
+
+def fromDict(geostyler):
+    """ Returns the typed Style for a GeoStyler style in dict form. """
+    return Style.fromDict(geostyler)
+
+
+def toDict(geostyler):
+    """ Returns the dict form of a typed Style (or the style itself if it already is a dict). """
+    return geostyler.toDict() if isinstance(geostyler, _Model) else geostyler
@@ -0,0 +1,67 @@
+""" Content-addressed store for the icons that converters extract from styles (e.g. the pictures embedded in
+ArcGIS Pro layer files).
+
+Each distinct image is written once, to a file named after a hash of its content, so the same image always gets
+the same file name (also in later runs, which keeps HTTP and CDN caches valid). The store folder is set with the
+"iconfolder" conversion option, and defaults to a "bridgestyle/icons" folder in the system temp folder.
+Nothing is removed automatically: use collect() to limit the size or age of the store.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_FOLDER = os.path.join(tempfile.gettempdir(), "bridgestyle", "icons")
+
+
+def iconFolder(options=None):
+    """ Returns the icon store folder set in the conversion options, or the default one. """
+    return (options or {}).get("iconfolder") or DEFAULT_FOLDER
+
+
+def iconName(data, ext):
+    return "%s.%s" % (hashlib.sha256(data).hexdigest()[:32], ext)
+
+
+def storeIcon(data, ext, folder=None):
+    """ Stores image data with the given file extension and returns the path of the icon file.
+    The file is only written if the store does not hold the same image yet. """
+    folder = folder or DEFAULT_FOLDER
+    path = os.path.join(folder, iconName(data, ext))
+    try:
+        os.utime(path)  # keep recently used icons in collect()
+    except FileNotFoundError:
+        os.makedirs(folder, exist_ok=True)
+        # Write to a temporary file first, so other processes never see a partly written icon
+        temp = "%s.%d-%d.tmp" % (path, os.getpid(), threading.get_ident())
+        with open(temp, "wb") as f:
+            f.write(data)
+        os.replace(temp, path)
+    return path
+
+
+def collect(folder=None, maxSize=None, maxAge=None):
+    """ Removes icons from the store: those not used for more than ``maxAge`` seconds, and then the least recently
+    used ones until the store holds at most ``maxSize`` bytes. Returns the list of removed files. """
+    folder = folder or DEFAULT_FOLDER
+    try:
+        entries = [entry for entry in os.scandir(folder) if entry.is_file()]
+    except FileNotFoundError:
+        return []
+    files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries), reverse=True)
+    now = time.time()
+    total = 0
+    full = False
+    removed = []
+    for mtime, size, path in files:  # most recently used first
+        full = full or (maxSize is not None and total + size > maxSize)
+        if full or (maxAge is not None and now - mtime > maxAge):
+            try:
+                os.remove(path)
+                removed.append(path)
+            except FileNotFoundError:
+                pass
+        else:
+            total += size
+    return removed
@@ -1,9 +1,23 @@
+import json
+
 from . import fromgeostyler
 from . import togeostyler
+from ..profiling import span
 
 
 def toGeostyler(style, options=None):
-    return togeostyler.convert(style, options)  # TODO
+    with span(options, "parse"):
+        mapbox = json.loads(style)
+    return togeostyler.convert(mapbox, options)
+
+
+def toGeostylerLayers(style, options=None, jobs=None):
+    """ Converts every source layer of a style to its own GeoStyler style. Returns a list with
+    a (geostyler, icons, warnings) tuple for each source layer. The layers are read in a single pass,
+    so ``jobs`` is not used. """
+    with span(options, "parse"):
+        mapbox = json.loads(style)
+    return togeostyler.convertLayers(mapbox, options)
 
 
 def fromGeostyler(style, options=None):
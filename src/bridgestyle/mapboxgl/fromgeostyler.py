@@ -3,8 +3,7 @@ import math
 import os
 import tempfile
 
-from ..qgis import togeostyler as qgis2geostyler
-from ..qgis.expressions import (
+from ..geostyler.constants import (
     OGC_PROPERTYNAME,
     OGC_IS_EQUAL_TO,
     OGC_IS_NULL,
@@ -12,29 +11,25 @@ from ..qgis.expressions import (
     OGC_SUB,
     OGC_IS_LIKE
 )
-
-# Globals
-_warnings = []
+from ..context import ConversionContext
+from ..expressioncache import expressionCache
+from ..geostyler.expressions import translate
 
 # Constants
 SOURCE_NAME = "vector-source"
+# Zoom levels that the tiles of the vector source are available at, unless set with the "tilegrid" option
+DEFAULT_TILE_GRID = {"minzoom": 0, "maxzoom": 20}
+# Tile size that MapLibre and Mapbox GL assume
+DEFAULT_TILE_SIZE = 512
 
 
-def convertGroup(group, qgis_layers, baseUrl, workspace, name):
+def convertGroup(group, qgis_layers, baseUrl, workspace, name, options=None):
+    from ..qgis import togeostyler as qgis2geostyler  # only available in QGIS
     obj = {
         "version": 8,
         "glyphs": "mapbox://fonts/mapbox/{fontstack}/{range}.pbf",
         "name": name,
-        "sources": {
-            SOURCE_NAME: {
-                "type": "vector",
-                "tiles": [
-                    tileURLFull(baseUrl, workspace, name)
-                ],
-                "minZoom": 0,
-                "maxZoom": 20  # todo: might be able to determine these from style
-            },
-        },
+        "sources": {},
         "sprite": spriteURLFull(baseUrl, workspace, name),
         "layers": []
     }
@@ -52,12 +47,13 @@ def convertGroup(group, qgis_layers, baseUrl, workspace, name):
         allWarnings.extend(warnings)
         allSprites.update(sprites)  # combine/accumulate sprites
         geostylers[layername] = geostyler
-        mbox, mbWarnings = convert(geostyler, None)
+        mbox, mbWarnings = convert(geostyler, options)
         allWarnings.extend(mbWarnings)
         mbox_obj = json.loads(mbox)
         mapboxstyles[layername] = mbox_obj
         mblayers.extend(mbox_obj.get("layers", []))
 
+    obj["sources"][SOURCE_NAME] = vectorSource(tileURLFull(baseUrl, workspace, name), mblayers, options)
     obj["layers"] = mblayers
 
     return json.dumps(obj, indent=4), allWarnings, obj, toSpriteSheet(allSprites)
@@ -67,6 +63,7 @@ def convertGroup(group, qgis_layers, baseUrl, workspace, name):
 def toSpriteSheet(allSprites):
     if not allSprites:
         return None
+    from ..qgis import togeostyler as qgis2geostyler  # only available in QGIS
 
     height = qgis2geostyler.SPRITE_SIZE
     width = qgis2geostyler.SPRITE_SIZE * len(allSprites)
@@ -86,9 +83,14 @@ def toSpriteSheet(allSprites):
 
 
 def convert(geostyler, options=None):
-    global _warnings
-    _warnings = []
-    layers = processLayer(geostyler)
+    context = ConversionContext(options)
+    with context.span("mapboxgl"):
+        result = _convert(geostyler, context)
+    return result, context.warnings
+
+
+def _convert(geostyler, context):
+    layers = processLayer(geostyler, context)
     layers.sort(key=lambda l: l["Z"])
     [l.pop('Z', None) for l in layers]
     layers.sort(key=lambda l: l["type"] == "symbol")
@@ -98,20 +100,14 @@ def convert(geostyler, options=None):
 
         "name": geostyler["name"],
         "sources": {
-            SOURCE_NAME: {
-                "type": "vector",
-                "tiles": [
-                    tileURL(geostyler)
-                ],
-                "minZoom": 0,
-                "maxZoom": 20  # todo: might be able to determine these from style
-            },
+            SOURCE_NAME: vectorSource(tileURL(geostyler), layers, context.options),
         },
         "layers": layers,
         "sprite": "spriteSheet",
     }
 
-    return json.dumps(obj, indent=4), _warnings
+    with context.span("mapboxgl.serialize"):
+        return json.dumps(obj, indent=4)
 
 
 # requires configuration with the tiles server URL
@@ -135,6 +131,43 @@ def spriteURLFull(baseurl, workspace, layer):
         .format(baseurl, workspace, layer)
 
 
+def vectorSource(url, layers, options=None):
+    """ Returns the vector source for the given layers, with the zoom levels of the tiles they need
+    (see sourceZoomLevels()). The "tilesize" option only shifts these levels and is not written: clients reject
+    vector sources with a tileSize other than 512. """
+    minzoom, maxzoom = sourceZoomLevels(layers, options)
+    return {
+        "type": "vector",
+        "tiles": [url],
+        "minzoom": minzoom,
+        "maxzoom": maxzoom,
+    }
+
+
+def sourceZoomLevels(layers, options=None):
+    """ Returns the lowest and highest zoom levels of the tiles that the layers need, from their minzoom and maxzoom.
+    No tiles are then requested at zoom levels where none of the layers is shown.
+
+    The "tilegrid" option holds the "minzoom" and "maxzoom" that the tiles are available at (by default 0 and 20),
+    which limit the returned levels. For tiles of another "tilesize" than 512 pixels, the levels are shifted as the
+    clients do (256 pixel tiles of zoom level z + 1 are shown at zoom z).
+    """
+    options = options or {}
+    grid = dict(DEFAULT_TILE_GRID, **(options.get("tilegrid") or {}))
+    if not layers:
+        return grid["minzoom"], grid["maxzoom"]
+    offset = math.log2(DEFAULT_TILE_SIZE / options.get("tilesize", DEFAULT_TILE_SIZE))
+    lowest = min(layer.get("minzoom", 0) for layer in layers)
+    minzoom = math.floor(lowest + offset)
+    if all("maxzoom" in layer for layer in layers):
+        # A layer is shown up to (not including) its maxzoom
+        maxzoom = math.ceil(max(layer["maxzoom"] for layer in layers) + offset) - 1
+    else:
+        maxzoom = grid["maxzoom"]
+    minzoom = min(max(minzoom, grid["minzoom"]), grid["maxzoom"])
+    return minzoom, min(max(maxzoom, minzoom), grid["maxzoom"])
+
+
 def _toZoomLevel(scale):
     if scale < 1:  # scale=0 is valid in QGIS
         return 24  # 24 is largest value (according to mapbox spec)
@@ -147,24 +180,30 @@ def _toZoomLevel(scale):
     return min(max(val, 0), 24)  # keep between 0 and 24
 
 
-def processLayer(layer):
+def processLayer(layer, context):
     allLayers = []
 
-    ruleNumber = 0
     rules = layer.get("rules", [])
-    for rule in rules:
-        layers = processRule(rule, layer["name"], ruleNumber, rules)
-        ruleNumber += 1
+    # Convert each filter only once: ELSE rules need the filters of all other rules
+    with context.span("mapboxgl.filters"):
+        filters = [convertExpression(rule.get("filter", None), context) for rule in rules]
+        elseFilter = _processElseFilter(filters, context) if "ELSE" in filters else None
+    ruleLayers = []
+    for ruleNumber, rule in enumerate(rules):
+        filt = elseFilter if filters[ruleNumber] == "ELSE" else filters[ruleNumber]
+        with context.span("mapboxgl.rule", rule):
+            layers = processRule(rule, layer["name"], ruleNumber, filt, context)
+        ruleLayers.append((ruleNumber, rule.get("name", "rule"), filt, layers))
+    if context.options.get("mergelayers"):
+        with context.span("mapboxgl.merge"):
+            return mergeRuleLayers(ruleLayers, layer["name"])
+    for _, _, _, layers in ruleLayers:
         allLayers += layers
 
     return allLayers
 
 
-def processRule(rule, source, ruleNumber, rules):
-    filt = convertExpression(rule.get("filter", None))
-    if filt == "ELSE":  # None of the other filters apply
-        filt = _processElseFilter(rule, ruleNumber, rules)
-
+def processRule(rule, source, ruleNumber, filt, context):
     minzoom = None
     maxzoom = None
     if "scaleDenominator" in rule:
@@ -173,8 +212,14 @@ def processRule(rule, source, ruleNumber, rules):
             minzoom = max(_toZoomLevel(scale["max"]), 0)  # mapbox gl has maxzoom as the larger zoom number
         if "min" in scale:
             maxzoom = _toZoomLevel(scale["min"])  # mapbox gl has minzoom as the smaller zoom number
+        if context.options.get("snapzoom"):
+            # Whole zoom levels, the nearest to the scales, unless the layer would then never be shown
+            snappedMin = None if minzoom is None else math.floor(minzoom + 0.5)
+            snappedMax = None if maxzoom is None else math.floor(maxzoom + 0.5)
+            if snappedMin is None or snappedMax is None or snappedMin < snappedMax:
+                minzoom, maxzoom = snappedMin, snappedMax
     name = rule.get("name", "rule")
-    layers = [processSymbolizer(s) for s in rule["symbolizers"]]
+    layers = [processSymbolizer(s, context) for s in rule["symbolizers"]]
     layers = [item for sublist in layers for item in sublist]  # flattens list
     layers = [x for x in layers if x is not None]  # remove None symbolizers
     for i, lay in enumerate(layers):
@@ -190,22 +235,306 @@ def processRule(rule, source, ruleNumber, rules):
             if maxzoom is not None:
                 lay["maxzoom"] = maxzoom  # noqa
         except Exception:
-            _warnings.append("Empty style rule: '%s'" % (name + ":" + str(i)))
+            context.warnings.append("Empty style rule: '%s'" % (name + ":" + str(i)))
     return layers
 
 
-def _processElseFilter(elseRule, ruleNumber, rules):
-    # Wrap the other rules in a NOT ( ANY (rule1, rule2...)) to construct an explicit ELSE filter
-    otherFilters = ["any"]
-    for idx, rule in enumerate(rules):
-        if idx == ruleNumber:  # This is the ElseFilter
+# Properties that take data-driven expressions. Properties with array values are left out: they would have to be
+# wrapped as literals in those expressions.
+DATA_DRIVEN_PROPERTIES = {
+    "paint": {
+        "fill-color", "fill-opacity", "fill-outline-color", "fill-pattern",
+        "line-color", "line-width", "line-opacity", "line-offset", "line-gap-width", "line-blur", "line-pattern",
+        "circle-radius", "circle-color", "circle-opacity", "circle-blur",
+        "circle-stroke-width", "circle-stroke-color", "circle-stroke-opacity",
+        "icon-color", "icon-opacity", "icon-halo-color", "icon-halo-width",
+        "text-color", "text-opacity", "text-halo-color", "text-halo-width", "text-halo-blur",
+    },
+    "layout": {
+        "line-join", "icon-image", "icon-size", "icon-rotate", "icon-anchor", "symbol-sort-key",
+        "text-field", "text-size", "text-rotate", "text-anchor", "text-justify", "text-transform",
+        "text-letter-spacing", "text-max-width",
+    },
+}
+
+
+def mergeRuleLayers(ruleLayers, source):
+    """ Merges the layers of consecutive rules into data-driven layers, given the (rule number, rule name,
+    filter, layers) of each rule.
+
+    Rules are merged if their filters select disjoint features (value sets of the same attributes, or ranges of
+    the same attribute) and they have the same layers, with the same types, zoom range and layout, apart from
+    the values of data-driven properties. Those become "match" expressions on the attribute (or "case"
+    expressions on the rule filters), and the merged layers get the union of the filters.
+
+    Within a merged layer, features are drawn in the order of the data rather than in the order of the rules.
+    """
+    merged = []
+    group = []
+    for item in ruleLayers:
+        key = _filterKey(item[2])
+        if group and key is not None and _canMerge(group, item, key):
+            group.append((key,) + item)
             continue
-        filt = convertExpression(rule.get("filter", None))
-        if filt:
-            otherFilters.append(filt)
+        merged.extend(_mergeGroup(group, source))
+        group = [(key,) + item]
+    merged.extend(_mergeGroup(group, source))
+    return merged
+
+
+def _canMerge(group, item, key):
+    if group[0][0] is None or any(not _disjoint(member[0], key) for member in group):
+        return False
+    layers = group[0][4]
+    otherLayers = item[3]
+    if len(layers) != len(otherLayers):
+        return False
+    for layer, other in zip(layers, otherLayers):
+        if layer.keys() != other.keys() or any(layer[name] != other[name] for name in layer
+                                               if name not in ("paint", "layout", "filter", "id")):
+            return False
+        for section in ("paint", "layout"):
+            values, otherValues = layer.get(section) or {}, other.get(section) or {}
+            if values.keys() != otherValues.keys():
+                return False
+            for name, value in values.items():
+                if value != otherValues[name] and (name not in DATA_DRIVEN_PROPERTIES[section]
+                                                   or value is None or otherValues[name] is None):
+                    return False
+    return True
+
+
+def _mergeGroup(group, source):
+    if len(group) < 2:
+        return [layer for member in group for layer in member[4]]
+    key, firstNumber, name = group[0][:3]
+    clauses = []
+    for member in group:
+        filt = member[3]
+        clauses.extend(filt[1:] if filt[0] == "any" else [filt])
+    mergedFilter = _anyFilter(clauses)
+    attribute = None
+    if key[0] == "values" and len(key[1]) == 1:
+        labels = [value for member in group for (value,) in member[0][2].values()]
+        if _valueSetFilter(["get", key[1][0]], labels)[0] == "match":
+            attribute = ["get", key[1][0]]
+    merged = []
+    for i, layer in enumerate(group[0][4]):
+        layer = dict(layer)
+        for section in ("paint", "layout"):
+            if section not in layer:
+                continue
+            values = dict(layer[section])
+            for prop in values:
+                memberValues = [member[4][i][section][prop] for member in group]
+                if any(value != memberValues[0] for value in memberValues):
+                    values[prop] = _dataDrivenValue(group, memberValues, attribute)
+            layer[section] = values
+        layer["filter"] = mergedFilter
+        layer["id"] = "%s:(rule#%d-%d)%s:%d" % (source, firstNumber, group[-1][1], name, i)
+        merged.append(layer)
+    return merged
+
+
+def _dataDrivenValue(group, values, attribute):
+    # The merged filter only lets through the features of the group, so the value of the last rule can be the
+    # fallback of the expression, and the rules with that value can be left out
+    fallback = values[-1]
+    if attribute is not None:
+        outputs = {}
+        for member, value in zip(group, values):
+            if value != fallback:
+                labels = outputs.setdefault(json.dumps(value, sort_keys=True), (value, []))[1]
+                labels.extend(label for (label,) in member[0][2].values())
+        expression = ["match", attribute]
+        for value, labels in outputs.values():
+            expression.extend([labels, value])
+    else:
+        expression = ["case"]
+        for member, value in zip(group, values):
+            if value != fallback:
+                expression.extend([member[3], value])
+    return expression + [fallback]
+
+
+def _filterKey(filt):
+    # Describes the features a filter selects, to tell whether the filters of two rules are disjoint:
+    # ("values", attributes, {normalized values: values}) or ("range", attribute, (low, high, lowIncluded,
+    # highIncluded)), or None for other filters
+    if not isinstance(filt, list) or not filt:
+        return None
+    if filt[0] in _comparisons or (filt[0] == "all" and all(isinstance(c, list) and c and c[0] in _comparisons
+                                                            for c in filt[1:])):
+        interval = _range(filt)
+        if interval is not None:
+            return interval
+    clauses = filt[1:] if filt[0] == "any" else [filt]
+    attributes = None
+    values = {}
+    for clause in clauses:
+        clauseValues = _valueTuples(clause)
+        if clauseValues is None:
+            return None
+        clauseAttributes, tuples = clauseValues
+        if attributes is None:
+            attributes = clauseAttributes
+        elif clauseAttributes != attributes:
+            return None
+        for value in tuples:
+            # True == 1 in Python, but not in map clients
+            values[tuple((isinstance(v, bool), v) for v in value)] = value
+    if attributes is None:
+        return None
+    return "values", attributes, values
+
+
+def _valueTuples(clause):
+    # The attribute names and the tuples of values that an equality test (or an "all" of them on different
+    # attributes, or a value set filter) selects
+    if not isinstance(clause, list) or not clause:
+        return None
+    if clause[0] in ("match", "in"):
+        valueSet = _valueSet([clause])
+        if valueSet is None or len(valueSet[0]) != 2:
+            return None
+        return (valueSet[0][1],), [(value,) for value in valueSet[1]]
+    equalities = clause[1:] if clause[0] == "all" else [clause]
+    values = {}
+    for equality in equalities:
+        valueSet = _valueSet([equality]) if isinstance(equality, list) and equality[:1] == ["=="] else None
+        if valueSet is None or len(valueSet[0]) != 2 or valueSet[0][1] in values:
+            return None
+        values[valueSet[0][1]] = valueSet[1][0]
+    if not values:
+        return None
+    attributes = tuple(sorted(values))
+    return attributes, [tuple(values[attribute] for attribute in attributes)]
+
+
+_comparisons = {">", ">=", "<", "<="}
+
 
-    elseFilter = ["!", otherFilters]
-    return elseFilter
+def _range(filt):
+    clauses = filt[1:] if filt[0] == "all" else [filt]
+    attribute = None
+    low, high, lowIncluded, highIncluded = -math.inf, math.inf, False, False
+    for clause in clauses:
+        if len(clause) != 3 or not isinstance(clause[1], list) or clause[1][0] != "get" or len(clause[1]) != 2 \
+                or isinstance(clause[2], bool) or not isinstance(clause[2], (int, float)):
+            return None
+        if attribute is None:
+            attribute = clause[1][1]
+        elif clause[1][1] != attribute:
+            return None
+        op, value = clause[0], clause[2]
+        if op in (">", ">=") and (value > low or (value == low and op == ">")):
+            low, lowIncluded = value, op == ">="
+        elif op in ("<", "<=") and (value < high or (value == high and op == "<")):
+            high, highIncluded = value, op == "<="
+    return "range", (attribute,), (low, high, lowIncluded, highIncluded)
+
+
+def _disjoint(key, other):
+    if key is None or other is None or key[:2] != other[:2]:
+        return False
+    if key[0] == "values":
+        return not any(value in other[2] for value in key[2])
+    low, high, lowIncluded, highIncluded = key[2]
+    otherLow, otherHigh, otherLowIncluded, otherHighIncluded = other[2]
+    return high < otherLow or (high == otherLow and not (highIncluded and otherLowIncluded)) or \
+        otherHigh < low or (otherHigh == low and not (otherHighIncluded and lowIncluded))
+
+
+def _processElseFilter(filters, context):
+    # None of the other filters apply: wrap them in a NOT ( ANY (rule1, rule2...)) to construct an explicit
+    # ELSE filter. Rules without a filter or with an ELSE filter themselves are left out.
+    otherFilters = [filt for filt in filters if filt and filt != "ELSE"]
+    if context.options.get("elsefilter") == "match":
+        matchFilter = _matchElseFilter(otherFilters)
+        if matchFilter is not None:
+            return matchFilter
+    return ["!", ["any"] + otherFilters]
+
+
+def _matchElseFilter(otherFilters):
+    # If all other filters are (ORed) equality tests on the same attribute, a single "match" on
+    # that attribute is much cheaper to evaluate than a NOT ANY over all of them
+    clauses = []
+    for filt in otherFilters:
+        if isinstance(filt, list) and filt[0] == "any":
+            clauses.extend(filt[1:])
+        else:
+            clauses.append(filt)
+    valueSet = _valueSet(clauses)
+    if valueSet is None:
+        return None
+    return _valueSetFilter(*valueSet, matches=False)
+
+
+def _valueSet(clauses):
+    # Returns the attribute and the values if all clauses test the same attribute for equality with
+    # literals (as "==", or as value set filters themselves), or else None
+    attribute = None
+    values = {}
+    for clause in clauses:
+        if not isinstance(clause, list):
+            return None
+        if clause[0] == "==" and len(clause) == 3:
+            if isinstance(clause[1], list) and clause[1][0] == "get":
+                getter, clauseValues = clause[1], clause[2:]
+            elif isinstance(clause[2], list) and clause[2][0] == "get":
+                getter, clauseValues = clause[2], clause[1:2]
+            else:
+                return None
+        elif clause[0] == "match" and len(clause) == 5 and clause[3] is True and clause[4] is False:
+            getter, clauseValues = clause[1], clause[2]
+        elif clause[0] == "in" and len(clause) == 3 and isinstance(clause[2], list) and clause[2][0] == "literal":
+            getter, clauseValues = clause[1], clause[2][1]
+        else:
+            return None
+        if not isinstance(getter, list) or getter[0] != "get":
+            return None
+        if attribute is None:
+            attribute = getter
+        elif getter != attribute:
+            return None
+        for value in clauseValues:
+            if not isinstance(value, (str, int, float)):  # e.g. null, which equals missing attributes
+                return None
+            # True == 1 in Python, but not in map clients
+            values.setdefault((isinstance(value, bool), value), value)
+    if attribute is None:
+        return None
+    return attribute, list(values.values())
+
+
+def _valueSetFilter(attribute, values, matches=True):
+    # "match" needs labels of one type, and numbers must be integers. Other value sets use "in" on a literal
+    # array, which compares values like "==" does.
+    if all(isinstance(v, str) for v in values) or \
+            all(isinstance(v, (int, float)) and not isinstance(v, bool) and float(v).is_integer() for v in values):
+        return ["match", attribute, values, matches, not matches]
+    inFilter = ["in", attribute, ["literal", values]]
+    return inFilter if matches else ["!", inFilter]
+
+
+def _anyFilter(clauses):
+    # ORed equality tests on one attribute (e.g. the values of an ArcGIS unique value class) become a single
+    # "match" or "in" filter, which map clients evaluate with a lookup rather than clause by clause.
+    # Tests for null values of the same attribute are kept next to it.
+    valueClauses = []
+    nullClauses = []
+    for clause in clauses:
+        if isinstance(clause, list) and len(clause) == 2 and clause[0] == "!" and isinstance(clause[1], list) \
+                and len(clause[1]) == 2 and clause[1][0] == "has":
+            nullClauses.append(clause)
+        else:
+            valueClauses.append(clause)
+    valueSet = _valueSet(valueClauses) if len(valueClauses) > 1 else None
+    if valueSet is None or any(["get", clause[1][1]] != valueSet[0] for clause in nullClauses):
+        return ["any"] + clauses
+    valueSetFilter = _valueSetFilter(*valueSet)
+    return ["any", valueSetFilter] + nullClauses if nullClauses else valueSetFilter
 
 
 func = {
@@ -255,44 +584,83 @@ func = {
 }
 
 
-def convertExpression(exp):
-    if exp is None:
-        return None
-    if isinstance(exp, list):
-        funcName = func.get(exp[0], None)
-        if funcName is None:
-            _warnings.append("Unsupported expression function for mapbox conversion: '%s'" % exp[0])
-            return None
-        else:
-            if funcName == "!" and isinstance(exp[1], list):
-                # Special case to add "is null" support
-                convertedExp = [func.get("Not", None), ["has", convertExpression(exp[1][-1])]]
-            elif funcName == "has" and isinstance(exp[1], list):
-                # Special case to add "is not null" support
-                convertedExp = [funcName, convertExpression(exp[1][-1])]
-            elif funcName == "exp":
-                # Special case to add "exp" support: replace with e^(x)
-                convertedExp = ["^", ["e"], convertExpression(exp[1])]
-            elif funcName == "atan2":
-                # Special case to replace atan2 with a piecewise function using atan.
-                convertedExp = _convertAtan2(exp)
-            elif funcName == "in":
-                # Special case to add "LIKE %substring%" support
-                convertedExp = convertLikeExpression(exp)
-            else:
-                convertedExp = [funcName]
-                for arg in exp[1:]:
-                    convertedExp.append(convertExpression(arg))
-            return convertedExp
+def convertExpression(exp, context):
+    if not isinstance(exp, list) or exp[0] == OGC_PROPERTYNAME:
+        # Literals and attribute names are cheaper to translate than to look up
+        return _convertExpression(exp, context)
+    return expressionCache.translate("mapboxgl", exp, _convertExpression, context)
+
+
+def _convertExpression(exp, context):
+    return translate(exp, _expandExpression, _convertLiteral, context)
+
+
+def _convertLiteral(exp, context):
+    return exp
+
+
+_specialFunctions = {"!", "has", "exp", "atan2", "in"}
+
+
+def _expandExpression(exp, context):
+    funcName = func.get(exp[0], None)
+    if funcName is None:
+        context.warnings.append("Unsupported expression function for mapbox conversion: '%s'" % exp[0])
+        return (), context, _unsupported
+    elif funcName not in _specialFunctions:
+        return exp[1:], context, _function
+    elif funcName == "!" and isinstance(exp[1], list):
+        # Special case to add "is null" support
+        return [exp[1][-1]], context, _isNull
+    elif funcName == "has" and isinstance(exp[1], list):
+        # Special case to add "is not null" support
+        return [exp[1][-1]], context, _isNotNull
+    elif funcName == "exp":
+        # Special case to add "exp" support: replace with e^(x)
+        return [exp[1]], context, _exp
+    elif funcName == "atan2":
+        # Special case to replace atan2 with a piecewise function using atan.
+        return [exp[2], exp[1]], context, _convertAtan2
+    elif funcName == "in":
+        # Special case to add "LIKE %substring%" support
+        if _likeSubstring(exp, context) is None:
+            return (), context, _unsupported
+        return [exp[1]], context, _like
     else:
-        return exp
+        return exp[1:], context, _function
+
+
+def _unsupported(exp, args):
+    return None
+
+
+def _isNull(exp, args):
+    return [func.get("Not", None), ["has", args[0]]]
+
+
+def _isNotNull(exp, args):
+    return ["has", args[0]]
+
 
-def _convertAtan2(exp):
+def _exp(exp, args):
+    return ["^", ["e"], args[0]]
+
+
+def _like(exp, args):
+    return ["in", exp[2].strip('%'), args[0]]
+
+
+def _function(exp, args):
+    funcName = func[exp[0]]
+    if funcName == "any":
+        return _anyFilter(args)
+    return [funcName] + args
+
+
+def _convertAtan2(exp, args):
+    exp_x, exp_y = args
     # See https://en.wikipedia.org/wiki/Atan2#Definition%20and%20computation
     # Note that the order of x and y is reversed in the definition above
-    exp_x = convertExpression(exp[2])
-    exp_y = convertExpression(exp[1])
-
     convertedExpression = [
         "case",
             [">", exp_x, 0],
@@ -309,22 +677,23 @@ def _convertAtan2(exp):
     ]
     return convertedExpression
 
-def convertLikeExpression(exp):
-    # Special case to add "LIKE %substring%" support
+
+def _likeSubstring(exp, context):
+    # Only "LIKE %substring%" is supported: returns the substring, or None (with a warning) for other patterns
     if not isinstance(exp[2], str):
-        _warnings.append(f"LIKE Substring {exp[2]} expected to be a string literal.")
+        context.warnings.append(f"LIKE Substring {exp[2]} expected to be a string literal.")
         return None
     if not (exp[2].startswith('%') and exp[2].endswith('%')):
-        _warnings.append(f"Only enclosing % wildcards are supported in LIKE Substring {exp[2]}")
+        context.warnings.append(f"Only enclosing % wildcards are supported in LIKE Substring {exp[2]}")
         return None
     val = exp[2].strip('%')  # remove trailing %
     if '%' in val or '_' in val:
-        _warnings.append(f"Non-enclosing _ or % wildcards in LIKE Substring {exp[2]} are not supported")
+        context.warnings.append(f"Non-enclosing _ or % wildcards in LIKE Substring {exp[2]} are not supported")
         return None
-    return ["in", val, convertExpression(exp[1])]
+    return val
 
 
-def processSymbolizer(sl):
+def processSymbolizer(sl, context):
     sl_type = sl.get('kind')
     processor = {
         "Icon": _iconSymbolizer,
@@ -335,13 +704,13 @@ def processSymbolizer(sl):
         "Raster": _rasterSymbolizer
     }.get(sl_type)
     if not processor:
-        _warnings.append(f"Unknown or unsupported symbol type '{sl_type}'")
+        context.warnings.append(f"Unknown or unsupported symbol type '{sl_type}'")
 
-    geom = _geometryFromSymbolizer(sl)
+    geom = _geometryFromSymbolizer(sl, context)
     if geom is not None:
-        _warnings.append("Derived geometries are not supported in mapbox gl")
+        context.warnings.append("Derived geometries are not supported in mapbox gl")
 
-    result = processor(sl)
+    result = processor(sl, context)
     symbolizers = []
     if result:
         if isinstance(result, list):
@@ -354,32 +723,32 @@ def processSymbolizer(sl):
     return symbolizers
 
 
-def _symbolProperty(sl, name, default=None):
+def _symbolProperty(sl, name, context, default=None):
     if name in sl:
-        return convertExpression(sl[name])
+        return convertExpression(sl[name], context)
     else:
         return default
 
 
-def _textSymbolizer(sl):
+def _textSymbolizer(sl, context):
     layout = {}
     paint = {}
-    color = _symbolProperty(sl, "color")
-    fontFamily = _symbolProperty(sl, "font")
-    label = _symbolProperty(sl, "label")
-    size = _symbolProperty(sl, "size")
+    color = _symbolProperty(sl, "color", context)
+    fontFamily = _symbolProperty(sl, "font", context)
+    label = _symbolProperty(sl, "label", context)
+    size = _symbolProperty(sl, "size", context)
     if "perpendicularOffset" in sl:
         offset = sl["perpendicularOffset"]
         layout["text-offset"] = offset
     elif "offset" in sl:
         offset = sl["offset"]
-        offsetx = convertExpression(offset[0])
-        offsety = convertExpression(offset[1])
+        offsetx = convertExpression(offset[0], context)
+        offsety = convertExpression(offset[1], context)
         layout["text-offset"] = [offsetx, offsety]
 
     if "haloColor" in sl and "haloSize" in sl:
-        paint["text-halo-width"] = float(_symbolProperty(sl, "haloSize"))
-        paint["text-halo-color"] = _symbolProperty(sl, "haloColor")
+        paint["text-halo-width"] = float(_symbolProperty(sl, "haloSize", context))
+        paint["text-halo-color"] = _symbolProperty(sl, "haloColor", context)
 
     layout["text-field"] = label
     layout["text-size"] = float(size)
@@ -401,15 +770,15 @@ def _textSymbolizer(sl):
     return {"type": "symbol", "paint": paint, "layout": layout}
 
 
-def _lineSymbolizer(sl, graphicStrokeLayer=0):
-    opacity = _symbolProperty(sl, "opacity")
+def _lineSymbolizer(sl, context, graphicStrokeLayer=0):
+    opacity = _symbolProperty(sl, "opacity", context)
     color = sl.get("color", None)
     graphicStroke = sl.get("graphicStroke", None)
-    width = _symbolProperty(sl, "width")
-    dasharray = _symbolProperty(sl, "dasharray")
-    cap = _symbolProperty(sl, "cap")
-    join = _symbolProperty(sl, "join")
-    offset = _symbolProperty(sl, "offset")
+    width = _symbolProperty(sl, "width", context)
+    dasharray = _symbolProperty(sl, "dasharray", context)
+    cap = _symbolProperty(sl, "cap", context)
+    join = _symbolProperty(sl, "join", context)
+    offset = _symbolProperty(sl, "offset", context)
 
     paint = {}
     layout = {}
@@ -429,7 +798,7 @@ def _lineSymbolizer(sl, graphicStrokeLayer=0):
                 markerPaint["icon-color"] = marker.get("color")
                 markerPaint["icon-opacity"] = marker.get("opacity", 1)
             else:
-                _warnings.append(f"Unsupported graphicStroke marker kind '{kind}'")
+                context.warnings.append(f"Unsupported graphicStroke marker kind '{kind}'")
                 continue
             graphicStrokeLayers.append({"type": "symbol", "layout": markerLayout, "paint": markerPaint})
 
@@ -469,22 +838,22 @@ def _parseSpaceArray(string):
     return [number(x) for x in string.split(" ")]
 
 
-def _geometryFromSymbolizer(sl):
-    geomExpr = convertExpression(sl.get("Geometry", None))
+def _geometryFromSymbolizer(sl, context):
+    geomExpr = convertExpression(sl.get("Geometry", None), context)
     return geomExpr
 
 
-def _iconSymbolizer(sl):
+def _iconSymbolizer(sl, context):
     image = sl.get('image')
     if not image:
-        _warnings.append("Icon symbol has no image")
+        context.warnings.append("Icon symbol has no image")
         return {"type": "symbol"}
     path = os.path.splitext(os.path.basename(image)[0])
-    rotation = _symbolProperty(sl, "rotate")
+    rotation = _symbolProperty(sl, "rotate", context)
 
     paint = {
         "icon-image": path,
-        "icon-size": _symbolProperty(sl, "size", 16) / 64.0,
+        "icon-size": _symbolProperty(sl, "size", context, 16) / 64.0,
         "icon-rotate": rotation
     }
     return {
@@ -493,12 +862,12 @@ def _iconSymbolizer(sl):
     }
 
 
-def _markSymbolizer(sl):
+def _markSymbolizer(sl, context):
     shape = sl.get('wellKnownName')
     if shape is not None and shape != "circle":
         name = os.path.splitext(shape)[0]
-        rotation = _symbolProperty(sl, "rotate")
-        size = _symbolProperty(sl, "size", 16) / 64.0
+        rotation = _symbolProperty(sl, "rotate", context)
+        size = _symbolProperty(sl, "size", context, 16) / 64.0
 
         paint = {
             "icon-image": name,
@@ -508,12 +877,12 @@ def _markSymbolizer(sl):
         return {"type": "symbol", "layout": paint}
 
     # Shape is a circle (or symbol should be rendered like that)
-    size = _symbolProperty(sl, "size")
-    opacity = _symbolProperty(sl, "opacity")
-    color = _symbolProperty(sl, "color")
-    outlineColor = _symbolProperty(sl, "strokeColor")
-    outlineWidth = _symbolProperty(sl, "strokeWidth")
-    dasharray = _symbolProperty(sl, "dasharray")
+    size = _symbolProperty(sl, "size", context)
+    opacity = _symbolProperty(sl, "opacity", context)
+    color = _symbolProperty(sl, "color", context)
+    outlineColor = _symbolProperty(sl, "strokeColor", context)
+    outlineWidth = _symbolProperty(sl, "strokeWidth", context)
+    dasharray = _symbolProperty(sl, "dasharray", context)
 
     paint = {
         "circle-radius": ["/", size, 2],
@@ -529,13 +898,13 @@ def _markSymbolizer(sl):
     }
 
 
-def _fillSymbolizer(sl):
+def _fillSymbolizer(sl, context):
     paint = {}
-    opacity = _symbolProperty(sl, "opacity")
+    opacity = _symbolProperty(sl, "opacity", context)
     color = sl.get("color", None)
-    dasharray = _symbolProperty(sl, "outlineDasharray")
-    join = _symbolProperty(sl, "join")
-    offset = _symbolProperty(sl, "offset")
+    dasharray = _symbolProperty(sl, "outlineDasharray", context)
+    join = _symbolProperty(sl, "join", context)
+    offset = _symbolProperty(sl, "offset", context)
     graphicFills = sl.get("graphicFill", None)
     if graphicFills is not None:
         fill = []
@@ -548,17 +917,17 @@ def _fillSymbolizer(sl):
                 }
             })
     else:
-        paint["fill-opacity"] = opacity * _symbolProperty(sl, "fillOpacity", 1)
+        paint["fill-opacity"] = opacity * _symbolProperty(sl, "fillOpacity", context, 1)
         if color is not None:
             paint["fill-color"] = color
         fill = {"type": "fill", "paint": paint}
     line = None
-    outlineColor = _symbolProperty(sl, "outlineColor")
+    outlineColor = _symbolProperty(sl, "outlineColor", context)
     if outlineColor is not None:
         line = {"type": "line",
                 "paint": {
-                    "line-width": _symbolProperty(sl, "outlineWidth") or 1,
-                    "line-opacity": (_symbolProperty(sl, "outlineOpacity") or 1) * opacity,
+                    "line-width": _symbolProperty(sl, "outlineWidth", context) or 1,
+                    "line-opacity": (_symbolProperty(sl, "outlineOpacity", context) or 1) * opacity,
                     "line-color": outlineColor
                 },
                 "layout": {
@@ -573,5 +942,5 @@ def _fillSymbolizer(sl):
     return fill
 
 
-def _rasterSymbolizer(sl):
+def _rasterSymbolizer(sl, context):
     return {"type": "raster"}  # TODO
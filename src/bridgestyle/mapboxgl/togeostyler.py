@@ -1,2 +1,585 @@
+""" Reads Mapbox GL / MapLibre styles.
+
+The layers of a style are read in a single pass. Each layer becomes a rule, which is added to the GeoStyler style of
+its source layer, so a style with hundreds of layers over a few source layers gives a few styles of many rules.
+Filters in both the expression and the legacy syntax are read, and the expressions are translated to the GeoStyler
+expressions that fromgeostyler.convertExpression() takes (the reverse of its ``func`` table). "match", "case",
+"step" and "interpolate" become filters or "if_then_else", "Categorize" and "Interpolate" functions.
+"""
+import colorsys
+import re
+
+from ..context import ConversionContext
+from ..geostyler.constants import OGC_CONCAT, OGC_IS_EQUAL_TO, OGC_IS_LIKE, OGC_IS_NULL, OGC_PROPERTYNAME
+from ..geostyler.expressions import combine, isLiteral, simplifyRules, translate
+from .fromgeostyler import func
+
+# Mapbox GL operators -> GeoStyler operators and functions. Operators that the writer produces for several
+# GeoStyler ones ("!", "to-number") map to the more general one.
+_operators = {name: operator for operator, name in func.items() if name is not None}
+_operators["!"] = "Not"
+
+_comparisons = {"==": OGC_IS_EQUAL_TO, "!=": "PropertyIsNotEqualTo", "<": "PropertyIsLessThan",
+                "<=": "PropertyIsLessThanOrEqualTo", ">": "PropertyIsGreaterThan",
+                ">=": "PropertyIsGreaterThanOrEqualTo"}
+
+# Marks the translation of an unsupported expression, which makes the expressions that contain it unsupported too
+_UNSUPPORTED = object()
+
+
 def convert(style, options=None):
-    pass  # TODO
+    """ Converts the first source layer of a Mapbox GL style (a dict) to a GeoStyler style.
+    Returns ``(geostyler, icons, warnings)``. Use convertLayers() to convert every source layer. """
+    layers = convertLayers(style, options)
+    if len(layers) > 1:
+        geostyler, icons, warnings = layers[0]
+        warnings.append("The style has %d source layers, only '%s' has been converted"
+                        % (len(layers), geostyler["name"]))
+    return layers[0]
+
+
+def convertLayers(style, options=None):
+    """ Converts a Mapbox GL style (a dict) to a GeoStyler style for each source layer, in the order in which they are
+    first used. Returns a list with a ``(geostyler, icons, warnings)`` tuple for each of them.
+
+    Layers without a source layer (background, raster...) are skipped, with a warning for the first style. """
+    context = ConversionContext(options)
+    styles = {}
+    with context.span("togeostyler"):
+        for layer in style.get("layers", []):
+            sourceLayer = layer.get("source-layer")
+            if sourceLayer is None:
+                context.warnings.append("Skipped layer without source layer: '%s'" % layer.get("id"))
+                continue
+            if sourceLayer not in styles:
+                styles[sourceLayer] = ({"name": sourceLayer, "rules": []}, [], ConversionContext(options))
+            geostyler, _, layerContext = styles[sourceLayer]
+            if layer.get("layout", {}).get("visibility") == "none":
+                continue
+            with context.span("togeostyler.rule"):
+                rule = processLayer(layer, layerContext)
+            if rule is not None:
+                geostyler["rules"].append(rule)
+        if context.options.get("simplify", True):
+            with context.span("togeostyler.simplify"):
+                for geostyler, _, _ in styles.values():
+                    simplifyRules(geostyler["rules"])
+
+    if not styles:
+        return [({"name": style.get("name", "style"), "rules": []}, [], context.warnings)]
+    results = [(geostyler, icons, layerContext.warnings) for geostyler, icons, layerContext in styles.values()]
+    results[0][2][:0] = context.warnings
+    return results
+
+
+# Scale denominator of zoom level 0, see fromgeostyler._toZoomLevel()
+_ZOOM0_SCALE = 279581257
+
+
+def _toScale(zoom):
+    return round(_ZOOM0_SCALE / 2 ** zoom, 2)
+
+
+def processLayer(layer, context):
+    """ Returns the GeoStyler rule for a Mapbox GL layer, or None if the type of the layer or its filter is not
+    supported, or if its filter matches no feature. """
+    processor = _symbolizers.get(layer.get("type"))
+    if processor is None:
+        context.warnings.append("Unsupported layer type '%s': '%s'" % (layer.get("type"), layer.get("id")))
+        return None
+    rule = {"name": layer.get("id", "")}
+    if "filter" in layer:
+        filt = convertFilter(layer["filter"], context)
+        if filt is _UNSUPPORTED:
+            # Without its filter, the layer would draw every feature
+            context.warnings.append("Skipped layer with an unsupported filter: '%s'" % layer.get("id"))
+            return None
+        if filt is False:
+            context.warnings.append("Skipped layer with a filter that matches no feature: '%s'" % layer.get("id"))
+            return None
+        if filt is not None:
+            rule["filter"] = filt
+    scale = {}
+    if "maxzoom" in layer:
+        scale["min"] = _toScale(layer["maxzoom"])
+    if "minzoom" in layer:
+        scale["max"] = _toScale(layer["minzoom"])
+    if scale:
+        rule["scaleDenominator"] = scale
+    rule["symbolizers"] = processor(layer, context)
+    return rule
+
+
+def _rawProperty(layer, name):
+    value = layer.get("paint", {}).get(name)
+    return layer.get("layout", {}).get(name) if value is None else value
+
+
+def _property(layer, name, context, default=None):
+    value = _rawProperty(layer, name)
+    if value is None:
+        return default
+    value = convertValue(value, context)
+    return default if value is None else value
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _multiply(a, b):
+    if isLiteral(a) and isLiteral(b) and not isinstance(a, str) and not isinstance(b, str):
+        return _number(round(a * b, 12))
+    if a == 1:
+        return b
+    if b == 1:
+        return a
+    return ["Mul", a, b]
+
+
+_RGB = re.compile(r"^(rgba?|hsla?)\(([^)]*)\)$")
+
+
+# Positions of the outputs of the functions that "match", "case", "step" and "interpolate" become
+_outputs = {"if_then_else": slice(2, 4), "Categorize": slice(2, -1, 2), "Interpolate": slice(3, -2, 2)}
+
+
+def _color(value):
+    """ Returns a color as a "#rrggbb" string, if it is a literal, and its alpha. The literal colors that a
+    data-driven color results in are converted as well, without their alpha. """
+    if isinstance(value, list) and value and value[0] in _outputs:
+        result = node = list(value)
+        # "match" and "case" become a chain of "if_then_else" functions, which can be very long
+        while node[0] == "if_then_else" and isinstance(node[3], list) and node[3] and node[3][0] == "if_then_else":
+            node[2] = _color(node[2])[0]
+            node[3] = list(node[3])
+            node = node[3]
+        node[_outputs[node[0]]] = [_color(output)[0] for output in node[_outputs[node[0]]]]
+        return result, 1
+    if not isinstance(value, str):
+        return value, 1
+    value = value.strip().lower()
+    if re.match(r"^#[0-9a-f]{3,4}$", value):
+        value = "#" + "".join(c * 2 for c in value[1:])
+    if re.match(r"^#[0-9a-f]{8}$", value):
+        return value[:7], _number(round(int(value[7:], 16) / 255, 3))
+    match = _RGB.match(value)
+    if match is None:
+        return value, 1
+    parts = [p.strip() for p in match.group(2).replace("/", ",").split(",")]
+    try:
+        alpha = float(parts[3]) if len(parts) > 3 else 1
+        if match.group(1).startswith("hsl"):
+            h, s, l = float(parts[0]) / 360, float(parts[1].rstrip("%")) / 100, float(parts[2].rstrip("%")) / 100
+            rgb = [c * 255 for c in colorsys.hls_to_rgb(h, l, s)]
+        else:
+            rgb = [float(p.rstrip("%")) * (2.55 if p.endswith("%") else 1) for p in parts[:3]]
+    except (ValueError, IndexError):
+        return value, 1
+    return "#%02x%02x%02x" % tuple(round(min(max(c, 0), 255)) for c in rgb), _number(alpha)
+
+
+def _fillSymbolizer(layer, context):
+    sl = {"kind": "Fill", "opacity": 1.0}
+    pattern = _property(layer, "fill-pattern", context)
+    if isinstance(pattern, str):
+        sl["graphicFill"] = [{"kind": "Icon", "image": pattern, "spriteName": pattern}]
+    else:
+        color, alpha = _color(_property(layer, "fill-color", context, "#000000"))
+        sl["color"] = color
+        sl["fillOpacity"] = _multiply(alpha, _property(layer, "fill-opacity", context, 1))
+    outlineColor = _property(layer, "fill-outline-color", context)
+    if outlineColor is not None:
+        sl["outlineColor"], sl["outlineOpacity"] = _color(outlineColor)
+        sl["outlineWidth"] = 1
+    return [sl]
+
+
+def _lineSymbolizer(layer, context):
+    color, alpha = _color(_property(layer, "line-color", context, "#000000"))
+    width = _property(layer, "line-width", context, 1)
+    sl = {"kind": "Line", "color": color, "width": width,
+          "opacity": _multiply(alpha, _property(layer, "line-opacity", context, 1))}
+    for name, key in (("line-cap", "cap"), ("line-join", "join"), ("line-offset", "perpendicularOffset")):
+        value = _property(layer, name, context)
+        if value is not None:
+            sl[key] = value
+    dasharray = _property(layer, "line-dasharray", context)
+    if isinstance(dasharray, list) and all(isLiteral(v) and not isinstance(v, str) for v in dasharray):
+        # Dash lengths are in line widths in Mapbox GL, in pixels in GeoStyler
+        factor = width if isLiteral(width) and not isinstance(width, str) else 1
+        sl["dasharray"] = " ".join(str(_number(round(v * factor, 12))) for v in dasharray)
+    return [sl]
+
+
+def _circleSymbolizer(layer, context):
+    color, alpha = _color(_property(layer, "circle-color", context, "#000000"))
+    strokeColor, strokeAlpha = _color(_property(layer, "circle-stroke-color", context, "#000000"))
+    strokeWidth = _property(layer, "circle-stroke-width", context, 0)
+    sl = {"kind": "Mark", "wellKnownName": "circle", "color": color,
+          "size": _multiply(2, _property(layer, "circle-radius", context, 5)),
+          "fillOpacity": _multiply(alpha, _property(layer, "circle-opacity", context, 1)),
+          "strokeColor": strokeColor, "strokeWidth": strokeWidth,
+          "strokeOpacity": 0 if strokeWidth == 0 else
+          _multiply(strokeAlpha, _property(layer, "circle-stroke-opacity", context, 1))}
+    return [sl]
+
+
+_TOKEN = re.compile(r"\{([^{}]+)\}")
+
+
+def _label(value):
+    # Legacy labels are strings with {attribute} tokens
+    if not isinstance(value, str) or "{" not in value:
+        return value
+    parts = []
+    for i, part in enumerate(_TOKEN.split(value)):
+        if i % 2:
+            parts.append([OGC_PROPERTYNAME, part])
+        elif part:
+            parts.append(part)
+    return parts[0] if len(parts) == 1 else [OGC_CONCAT] + parts
+
+
+def _symbolSymbolizer(layer, context):
+    symbolizers = []
+    image = _property(layer, "icon-image", context)
+    if isinstance(image, str):
+        # The writer divides the size by 64 to get the icon scale
+        icon = {"kind": "Icon", "image": image, "size": _multiply(64, _property(layer, "icon-size", context, 1))}
+        for name, key in (("icon-rotate", "rotate"), ("icon-opacity", "opacity")):
+            value = _property(layer, name, context)
+            if value is not None:
+                icon[key] = value
+        symbolizers.append(icon)
+    elif image is not None:
+        context.warnings.append("Unsupported icon image expression in layer '%s'" % layer.get("id"))
+
+    label = _property(layer, "text-field", context)
+    if label is not None:
+        color, alpha = _color(_property(layer, "text-color", context, "#000000"))
+        # A list of font names, or an expression
+        font = _rawProperty(layer, "text-font") or ["Open Sans Regular"]
+        if not all(isinstance(name, str) for name in font):
+            font = [convertValue(font, context)]
+        text = {"kind": "Text", "label": _label(label), "color": color,
+                "size": _property(layer, "text-size", context, 16), "font": font[0]}
+        if alpha != 1:
+            text["opacity"] = alpha
+        haloWidth = _property(layer, "text-halo-width", context, 0)
+        if haloWidth != 0:
+            text["haloColor"], text["haloOpacity"] = _color(_property(layer, "text-halo-color", context, "#000000"))
+            text["haloSize"] = haloWidth
+        offset = _property(layer, "text-offset", context)
+        if isinstance(offset, list) and len(offset) == 2:
+            text["offset"] = offset
+        rotate = _property(layer, "text-rotate", context)
+        if rotate is not None:
+            text["rotate"] = rotate
+        if _property(layer, "symbol-placement", context) in ("line", "line-center"):
+            text["followLine"] = True
+        symbolizers.append(text)
+    return symbolizers
+
+
+_symbolizers = {
+    "fill": _fillSymbolizer,
+    "line": _lineSymbolizer,
+    "circle": _circleSymbolizer,
+    "symbol": _symbolSymbolizer,
+}
+
+
+#######################
+
+def convertValue(value, context):
+    """ Converts a property value: a literal, an expression or a legacy function ({"stops": ...}). """
+    if isinstance(value, dict):
+        value = _legacyFunction(value, context)
+    if isinstance(value, list) and value and isinstance(value[0], str):
+        return convertExpression(value, context)
+    return value
+
+
+def _legacyFunction(function, context):
+    # Returns the expression of a legacy function
+    stops = function.get("stops", [])
+    if "property" not in function:
+        context.warnings.append("Zoom dependent values are not supported, the value of the first stop is used")
+        return stops[0][1] if stops else function.get("default")
+    attribute = ["get", function["property"]]
+    kind = function.get("type", "exponential" if stops and not isinstance(stops[0][0], str) else "interval")
+    if kind == "identity":
+        return attribute
+    outputs = [v for stop in stops for v in stop]
+    if kind == "categorical":
+        return ["match", attribute] + outputs + [function.get("default")]
+    if kind == "interval":
+        return ["step", attribute, stops[0][1]] + outputs[2:]
+    return ["interpolate", ["linear"], attribute] + outputs
+
+
+def _isExpressionFilter(filt):
+    # The same test as the one of the Mapbox GL style specification
+    if isinstance(filt, bool):
+        return True
+    if not isinstance(filt, list) or not filt:
+        return False
+    operator = filt[0]
+    if operator == "has":
+        return len(filt) >= 2 and filt[1] not in ("$id", "$type")
+    if operator == "in":
+        return len(filt) >= 3 and (not isinstance(filt[1], str) or isinstance(filt[2], list))
+    if operator in ("!in", "!has", "none"):
+        return False
+    if operator in _comparisons:
+        return len(filt) != 3 or isinstance(filt[1], list) or isinstance(filt[2], list)
+    if operator in ("any", "all"):
+        return all(isinstance(f, bool) or _isExpressionFilter(f) for f in filt[1:])
+    return True
+
+
+def convertFilter(filt, context):
+    """ Converts a layer filter, in the expression or the legacy syntax, to a GeoStyler filter. Filters that match
+    every feature are converted to None, and those that match no feature to False. Unsupported filters are converted
+    to _UNSUPPORTED, with a warning, but unsupported parts of a top level "all", "any" or "none" filter are left
+    out. """
+    if not _isExpressionFilter(filt):
+        return _legacyFilter(filt, context)
+    if isinstance(filt, list) and filt and filt[0] in ("all", "any"):
+        # Unsupported operands are only left out at the top level, where they cannot be negated
+        args = [translate(f, _expandExpression, _convertLiteral, context) for f in filt[1:]]
+        operands = [arg for arg in args if arg is not _UNSUPPORTED]
+        result = _logical(filt, operands) if operands or not args else _UNSUPPORTED
+    else:
+        result = translate(filt, _expandExpression, _convertLiteral, context)
+    return None if result is True else result
+
+
+def _legacyFilter(filt, context, top=True):
+    operator = filt[0]
+    if operator in ("all", "any", "none"):
+        clauses = [_legacyFilter(f, context, False) for f in filt[1:]]
+        if _UNSUPPORTED in clauses:
+            # Unsupported clauses are only left out at the top level, where they cannot be negated
+            clauses = [c for c in clauses if c is not _UNSUPPORTED]
+            if not top or not clauses:
+                return _UNSUPPORTED
+        if not clauses:
+            return None if operator != "any" else False
+        if operator == "all":
+            return combine("And", clauses)
+        return ["Not", combine("Or", clauses)] if operator == "none" else combine("Or", clauses)
+    key = filt[1] if len(filt) > 1 else None
+    if not isinstance(key, str) or key in ("$type", "$id"):
+        context.warnings.append("Unsupported filter: %s" % filt)
+        return _UNSUPPORTED
+    attribute = [OGC_PROPERTYNAME, key]
+    if operator in _comparisons and len(filt) == 3:
+        if filt[2] is None:
+            return _isNull(attribute, operator == "==")
+        return [_comparisons[operator], attribute, filt[2]]
+    if operator in ("in", "!in") and len(filt) > 2:
+        clauses = combine("Or", [[OGC_IS_EQUAL_TO, attribute, value] for value in filt[2:]])
+        return ["Not", clauses] if operator == "!in" else clauses
+    if operator in ("has", "!has"):
+        return _isNull(attribute, operator == "!has")
+    context.warnings.append("Unsupported filter: %s" % filt)
+    return _UNSUPPORTED
+
+
+def _isNull(exp, isNull=True):
+    return [OGC_IS_NULL, exp] if isNull else ["Not", [OGC_IS_NULL, exp]]
+
+
+def convertExpression(exp, context):
+    """ Converts a Mapbox GL expression to a GeoStyler expression. Unsupported expressions are converted to None,
+    with a warning. """
+    result = translate(exp, _expandExpression, _convertLiteral, context)
+    return None if result is _UNSUPPORTED else result
+
+
+def _convertLiteral(value, context):
+    return value
+
+
+def _expandExpression(exp, context):
+    operator = exp[0]
+    if not isinstance(operator, str):
+        return (), context, _array
+    if operator == "literal":
+        return (), context, _literal
+    if operator == "get" or operator == "has":
+        if len(exp) == 2 and isinstance(exp[1], str):
+            return (), context, _get if operator == "get" else _has
+    elif operator == "in" and len(exp) == 3:
+        if isinstance(exp[2], list) and exp[2] and exp[2][0] == "literal" and isinstance(exp[2][1], list):
+            return exp[1:2], context, _inValues
+        if isinstance(exp[1], str) and isinstance(exp[2], list):
+            # "LIKE %substring%" filters, as the writer produces them
+            return exp[2:], context, _like
+    elif operator == "match" and len(exp) >= 5:
+        return [exp[1]] + exp[3:-1:2] + exp[-1:], context, _match
+    elif operator == "case" and len(exp) >= 4:
+        return exp[1:], context, _case
+    elif operator == "step" and len(exp) >= 3:
+        if exp[1] == ["zoom"]:
+            context.warnings.append("Zoom dependent values are not supported, the value of the first stop is used")
+            return exp[2:3], context, _first
+        return [exp[1], exp[2]] + exp[4::2], context, _step
+    elif operator.startswith("interpolate") and len(exp) >= 5:
+        if exp[2] == ["zoom"]:
+            context.warnings.append("Zoom dependent values are not supported, the value of the first stop is used")
+            return exp[4:5], context, _first
+        if exp[1] != ["linear"]:
+            context.warnings.append("Unsupported interpolation %s, values are interpolated linearly" % exp[1])
+        return [exp[2]] + exp[4::2], context, _interpolate
+    elif operator == "^" and len(exp) == 3 and exp[1] == ["e"]:
+        return exp[2:], context, _exp
+    elif operator in _comparisons:
+        return exp[1:3], context, _comparison
+    elif operator in ("all", "any"):
+        return exp[1:], context, _logical
+    elif operator in ("+", "*", "-", "/"):
+        return exp[1:], context, _arithmetic
+    elif operator in _operators:
+        return exp[1:], context, _function
+    context.warnings.append("Unsupported expression: '%s'" % operator)
+    return (), context, _unsupported
+
+
+def _unsupported(exp, args):
+    return _UNSUPPORTED
+
+
+def _array(exp, args):
+    return exp
+
+
+def _literal(exp, args):
+    return exp[1]
+
+
+def _first(exp, args):
+    return args[0]
+
+
+def _get(exp, args):
+    return [OGC_PROPERTYNAME, exp[1]]
+
+
+def _has(exp, args):
+    return _isNull([OGC_PROPERTYNAME, exp[1]], False)
+
+
+def _inValues(exp, args):
+    if args[0] is _UNSUPPORTED:
+        return _UNSUPPORTED
+    return combine("Or", [[OGC_IS_EQUAL_TO, args[0], value] for value in exp[2][1]])
+
+
+def _like(exp, args):
+    if args[0] is _UNSUPPORTED:
+        return _UNSUPPORTED
+    return [OGC_IS_LIKE, args[0], "%" + exp[1] + "%"]
+
+
+def _comparison(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    a, b = args
+    if exp[0] in ("==", "!=") and (a is None or b is None):
+        return _isNull(a if b is None else b, exp[0] == "==")
+    return [_comparisons[exp[0]], a, b]
+
+
+def _logical(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    # Literal operands either decide the result or can be left out
+    if exp[0] == "any" and True in args:
+        return True
+    if exp[0] == "all" and False in args:
+        return False
+    operands = [arg for arg in args if not isinstance(arg, bool)]
+    if not operands:
+        return exp[0] == "all"
+    return combine("And" if exp[0] == "all" else "Or", operands)
+
+
+def _arithmetic(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    operator = _operators[exp[0]]
+    if len(args) == 1:
+        return ["Sub", 0, args[0]] if exp[0] == "-" else args[0]
+    result = args[0]
+    for arg in args[1:]:
+        result = [operator, result, arg]
+    return result
+
+
+def _exp(exp, args):
+    return _function(["exp"], args)
+
+
+def _function(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    operator = _operators[exp[0]]
+    if operator == "Not" and isinstance(args[0], bool):
+        return not args[0]
+    if operator == "Not" and isinstance(args[0], list) and args[0] and args[0][0] == "Not":
+        return args[0][1]
+    return [operator] + args
+
+
+def _ifThenElse(branches, fallback):
+    result = fallback
+    for condition, output in reversed(branches):
+        result = ["if_then_else", condition, output, result]
+    return result
+
+
+def _case(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    return _ifThenElse(list(zip(args[:-1:2], args[1:-1:2])), args[-1])
+
+
+def _match(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    value, outputs, fallback = args[0], args[1:-1], args[-1]
+    conditions = [combine("Or", [[OGC_IS_EQUAL_TO, value, label]
+                                 for label in (labels if isinstance(labels, list) else [labels])])
+                  for labels in exp[2:-1:2]]
+    if all(isinstance(output, bool) for output in outputs) and isinstance(fallback, bool):
+        # A filter: the values that give the other output than the fallback
+        matching = [condition for condition, output in zip(conditions, outputs) if output is not fallback]
+        if not matching:
+            return fallback
+        return ["Not", combine("Or", matching)] if fallback else combine("Or", matching)
+    return _ifThenElse(list(zip(conditions, outputs)), fallback)
+
+
+def _step(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    node = ["Categorize", args[0], args[1]]
+    for threshold, output in zip(exp[3::2], args[2:]):
+        node.extend([threshold, output])
+    # Values equal to a threshold belong to the class above it
+    return node + ["succeeding"]
+
+
+def _interpolate(exp, args):
+    if _UNSUPPORTED in args:
+        return _UNSUPPORTED
+    node = ["Interpolate", args[0]]
+    for stop, output in zip(exp[3::2], args[1:]):
+        node.extend([stop, output])
+    mode = "color" if all(isinstance(output, str) for output in args[1:]) else "numeric"
+    return node + [mode, "linear"]
@@ -3,7 +3,14 @@ from . import togeostyler
 
 
 def toGeostyler(style, options=None):
-    return togeostyler.convert(style, options)  # TODO
+    return togeostyler.convert(style, options)
+
+
+def toGeostylerLayers(style, options=None, jobs=None):
+    """ Converts every LAYER of a Mapfile to its own GeoStyler style. Returns a list with
+    a (geostyler, icons, warnings) tuple for each layer. The Mapfile is read in a single pass,
+    so ``jobs`` is not used. """
+    return togeostyler.convertLayers(style, options)
 
 
 def fromGeostyler(style, options=None):
@@ -1,80 +1,177 @@
+import io
 import os
+import re
+from types import GeneratorType
 
-from ..qgis.expressions import (
+from ..geostyler.constants import (
     OGC_PROPERTYNAME,
     OGC_IS_EQUAL_TO,
     OGC_CONCAT,
     OGC_SUB
 )
+from ..context import ConversionContext
+from ..profiling import span
+from ..expressioncache import expressionCache
+from ..geostyler.expressions import translate, valueSet
 
-_warnings = []
+INDENT = "  "
+WRITE_BUFFER_LINES = 1024
 
 
-def convertToDict(geostyler):
-    global _warnings
-    _warnings = []
-    global _symbols
-    _symbols = []
-    layer = processLayer(geostyler)
-    return layer, _symbols, _warnings
+def convertToDict(geostyler, options=None):
+    context = ConversionContext(options)
+    with context.span("mapserver"):
+        layer = processLayer(geostyler, context)
+    return layer, context.symbols, context.warnings
 
 
 def convert(geostyler, options=None):
-    d, _, _ = convertToDict(geostyler)
-    mapfile = convertDictToMapfile(d)
-    symbols = convertDictToMapfile({"SYMBOLS": _symbols})
-    return mapfile, symbols, _warnings
+    d, symbolsDict, warnings = convertToDict(geostyler, options)
+    with span(options, "mapserver.serialize"):
+        mapfile = convertDictToMapfile(d)
+        symbols = convertDictToMapfile({"SYMBOLS": symbolsDict})
+    return mapfile, symbols, warnings
+
+
+def write_mapfile(geostyler, fp, options=None, symbolsFp=None):
+    """ Writes the Mapfile LAYER for a GeoStyler style to a text stream and returns the list of warnings.
+
+    Rules are converted and written one CLASS at a time. The SYMBOLS they need are written to
+    ``symbolsFp`` (if given) once the layer is complete.
+    """
+    context = ConversionContext(options)
+    with context.span("mapserver"):
+        rules = geostyler.get("rules", [])
+        classItem = findClassItem(rules)
+        classes = (_processRule(rule, context, classItem) for rule in rules)
+        writeDictToMapfile(_layerData(geostyler, classes, classItem), fp)
+        if symbolsFp is not None:
+            writeDictToMapfile({"SYMBOLS": context.symbols}, symbolsFp)
+    return context.warnings
 
 
 def convertDictToMapfile(d):
-    def _toString(element, indent):
-        s = ""
-        INDENT = "  " * indent
+    output = io.StringIO()
+    writeDictToMapfile(d, output)
+    return output.getvalue()
+
+
+def writeDictToMapfile(d, fp):
+    """ Writes a Mapfile dict to a text stream.
+
+    Dicts become blocks closed by END, lists (or generators) of dicts are written one after the other,
+    tuples are written as space-separated values. Lines are buffered and written in chunks.
+    """
+    lines = []
+
+    def _write(element, indent):
         for k, v in element.items():
             if isinstance(v, dict):
-                s += "%s%s\n" % (INDENT, k)
-                s += _toString(v, indent + 1)
-                s += INDENT + "END\n"
-            elif isinstance(v, list):
+                lines.append("%s%s\n" % (indent, k))
+                _write(v, indent + INDENT)
+                lines.append(indent + "END\n")
+            elif isinstance(v, (list, GeneratorType)):
                 for item in v:
-                    s += _toString(item, indent)
+                    _write(item, indent)
+                    if len(lines) >= WRITE_BUFFER_LINES:
+                        fp.write("".join(lines))
+                        lines.clear()
             elif isinstance(v, tuple):
-                s += "%s%s %s\n" % (INDENT, k, " ".join([str(item) for item in v]))
+                lines.append("%s%s %s\n" % (indent, k, " ".join([str(item) for item in v])))
             else:
-                s += "%s%s %s\n" % (INDENT, k, v)
+                lines.append("%s%s %s\n" % (indent, k, v))
 
-        return s
+    _write(d, "")
+    fp.write("".join(lines))
 
-    return _toString(d, 0)
 
-
-def processLayer(layer):
+def processLayer(layer, context):
     classes = []
+    rules = layer.get("rules", [])
+    classItem = findClassItem(rules)
 
-    for rule in layer.get("rules", []):
-        clazz = processRule(rule)
+    for rule in rules:
+        clazz = _processRule(rule, context, classItem)
         classes.append(clazz)
 
+    return _layerData(layer, classes, classItem)
+
+
+def _processRule(rule, context, classItem=None):
+    with context.span("mapserver.rule", rule):
+        return processRule(rule, context, classItem)
+
+
+def _layerData(layer, classes, classItem=None):
     layerData = {
         "LAYER": {
             "NAME": _quote(layer.get("name", "")),
             "STATUS": "ON",
             "SIZEUNITS": "pixels",
-            "CLASSES": classes,
         }
     }
+    if classItem is not None:
+        layerData["LAYER"]["CLASSITEM"] = _quote(classItem)
+    layerData["LAYER"]["CLASSES"] = classes
     return layerData
 
 
-def processRule(rule):
+def findClassItem(rules):
+    """ Returns the attribute to use as the CLASSITEM of the layer, if all the rule filters test that attribute
+    for equality with strings (as in unique value styles), or else None. MapServer compares the CLASSITEM as a
+    string, so numbers keep logical expressions, which also match values written as "5.000" or "05".
+
+    With a CLASSITEM, the classes get string, list or regular expressions that MapServer matches against the
+    attribute much faster than logical expressions. Rules without a filter are fine, and so are ELSE rules after
+    the last filtered rule, as MapServer uses the first class that matches a feature.
+    """
+    attribute = None
+    otherwise = False
+    for rule in rules:
+        filt = rule.get("filter")
+        if filt is None:
+            continue
+        if filt == "ELSE":
+            otherwise = True
+            continue
+        values = valueSet(filt) if not otherwise else None
+        if values is None or attribute not in (None, values[0]):
+            return None
+        if not all(isinstance(v, str) for v in values[1]):
+            return None
+        attribute = values[0]
+    return attribute
+
+
+# Characters with a special meaning in (POSIX extended) regular expressions, and the expression delimiter
+_REGEX_SPECIAL = re.compile(r'([\\.^$|?*+()\[\]{}/])')
+
+
+def _classExpression(filt):
+    # The expression that matches the values of a rule filter against the CLASSITEM
+    values = valueSet(filt)[1]
+    if len(values) == 1 and '"' not in values[0]:
+        return _quote(values[0])
+    if all(v and v.strip() == v and not any(c in v for c in ",{}") for v in values):
+        return "{%s}" % ",".join(values)
+    return "/^(%s)$/" % "|".join(_REGEX_SPECIAL.sub(r"\\\1", v) for v in values)
+
+
+def processRule(rule, context, classItem=None):
     d = {"NAME": _quote(rule.get("name", "") or "default")}
     name = rule.get("name", "rule")
 
-    expression = convertExpression(rule.get("filter", None))
-    if expression is not None:
-        d["EXPRESSION"] = expression
+    filt = rule.get("filter", None)
+    if classItem is not None:
+        # Rules were checked by findClassItem(): ELSE rules come last and need no expression
+        if filt is not None and filt != "ELSE":
+            d["EXPRESSION"] = _classExpression(filt)
+    else:
+        expression = convertExpression(filt, context)
+        if expression is not None:
+            d["EXPRESSION"] = expression
 
-    styles = [{"STYLE": processSymbolizer(s)} for s in rule["symbolizers"]]
+    styles = [{"STYLE": processSymbolizer(s, context)} for s in rule["symbolizers"]]
 
     if "scaleDenominator" in rule:
         scale = rule["scaleDenominator"]
@@ -107,73 +204,98 @@ func = {
 }  # TODO
 
 
-def convertExpression(exp):
+def convertExpression(exp, context):
+    if not isinstance(exp, list) or exp[0] == OGC_PROPERTYNAME:
+        # Literals and attribute names are cheaper to translate than to look up
+        return _convertExpression(exp, context)
+    return expressionCache.translate("mapserver", exp, _convertExpression, context)
+
+
+def _convertExpression(exp, context):
+    return translate(exp, _expandExpression, _convertLiteral, context)
+
+
+def _expandExpression(exp, context):
+    funcName = func.get(exp[0], None)
+    if funcName is None:
+        context.warnings.append(
+            "Unsupported expression function for MapServer conversion: '%s'"
+            % exp[0]
+        )
+        return (), context, _unsupported
+    elif funcName == OGC_PROPERTYNAME:
+        return (), context, _propertyName
+    else:
+        return exp[1:], context, _operator
+
+
+def _unsupported(exp, args):
+    return None
+
+
+def _propertyName(exp, args):
+    return '"[%s]"' % exp[1]
+
+
+def _operator(exp, args):
+    funcName = func[exp[0]]
+    if len(args) == 1:
+        return "%s(%s)" % (funcName, args[0])
+    if len(args) == 2:
+        return "(%s %s %s)" % (args[0], funcName, args[1])
+    # "And" and "Or" with more operands
+    return "(%s)" % (" %s " % funcName).join(str(arg) for arg in args)
+
+
+def _convertLiteral(exp, context):
     if exp is None:
         return None
-    if isinstance(exp, list):
-        funcName = func.get(exp[0], None)
-        if funcName is None:
-            _warnings.append(
-                "Unsupported expression function for MapServer conversion: '%s'"
-                % exp[0]
-            )
-            return None
-        elif funcName == OGC_PROPERTYNAME:
-            return '"[%s]"' % exp[1]
-        else:
-            arg1 = convertExpression(exp[1])
-            if len(exp) == 3:
-                arg2 = convertExpression(exp[2])
-                return "(%s %s %s)" % (arg1, funcName, arg2)
-            else:
-                return "%s(%s)" % (funcName, arg1)
-    else:
-        try:
-            f = float(exp)
-            return exp
-        except:
-            return _quote(exp)
+    try:
+        f = float(exp)
+        return exp
+    except:
+        return _quote(exp)
 
 
-def processSymbolizer(sl):
+def processSymbolizer(sl, context):
     symbolizerType = sl["kind"]
     if symbolizerType == "Icon":
-        symbolizer = _iconSymbolizer(sl)
+        symbolizer = _iconSymbolizer(sl, context)
     if symbolizerType == "Line":
-        symbolizer = _lineSymbolizer(sl)
+        symbolizer = _lineSymbolizer(sl, context)
     if symbolizerType == "Fill":
-        symbolizer = _fillSymbolizer(sl)
+        symbolizer = _fillSymbolizer(sl, context)
     if symbolizerType == "Mark":
-        symbolizer = _markSymbolizer(sl)
+        symbolizer = _markSymbolizer(sl, context)
     if symbolizerType == "Text":
-        symbolizer = _textSymbolizer(sl)
+        symbolizer = _textSymbolizer(sl, context)
     if symbolizerType == "Raster":
-        symbolizer = _rasterSymbolizer(sl)
+        symbolizer = _rasterSymbolizer(sl, context)
 
-    geom = _geometryFromSymbolizer(sl)
+    geom = _geometryFromSymbolizer(sl, context)
     if geom is not None:
-        _warnings.append("Derived geometries are not supported in mapbox gl")
+        context.warnings.append("Derived geometries are not supported in mapbox gl")
 
     return symbolizer
 
 
-def _symbolProperty(sl, name, default=None):
+def _symbolProperty(sl, name, context, default=None):
     if name in sl:
-        return convertExpression(sl[name])
+        return convertExpression(sl[name], context)
     else:
         return default
 
 
-def _textSymbolizer(sl):
+def _textSymbolizer(sl, context):
     style = {}
-    color = _symbolProperty(sl, "color")
-    fontFamily = _symbolProperty(sl, "font")
-    label = _symbolProperty(sl, "label")
-    size = _symbolProperty(sl, "size")
+    color = _symbolProperty(sl, "color", context)
+    fontFamily = _symbolProperty(sl, "font", context)
+    label = _symbolProperty(sl, "label", context)
+    size = _symbolProperty(sl, "size", context)
     if "offset" in sl:
         offset = sl["offset"]
-        offsetx = convertExpression(offset[0])
-        offsety = convertExpression(offset[1])
+        offsetx = convertExpression(offset[0], context)
+        offsety = convertExpression(offset[1], context)
         style["OFFSET"] = (offsetx, offsety)
 
     style["TEXT"] = label
@@ -200,19 +322,19 @@ def _textSymbolizer(sl):
     return {"LABEL": style}
 
 
-def _lineSymbolizer(sl, graphicStrokeLayer=0):
-    opacity = _symbolProperty(sl, "opacity", 1.0) * 100
-    color = _symbolProperty(sl, "color")
+def _lineSymbolizer(sl, context, graphicStrokeLayer=0):
+    opacity = _symbolProperty(sl, "opacity", context, 1.0) * 100
+    color = _symbolProperty(sl, "color", context)
     graphicStroke = sl.get("graphicStroke", None)
-    width = _symbolProperty(sl, "width")
-    dasharray = _symbolProperty(sl, "dasharray")
-    cap = _symbolProperty(sl, "cap")
-    join = _symbolProperty(sl, "join")
-    offset = _symbolProperty(sl, "offset")
+    width = _symbolProperty(sl, "width", context)
+    dasharray = _symbolProperty(sl, "dasharray", context)
+    cap = _symbolProperty(sl, "cap", context)
+    join = _symbolProperty(sl, "join", context)
+    offset = _symbolProperty(sl, "offset", context)
 
     style = {}
     if graphicStroke is not None:
-        name = _createSymbol(graphicStroke[0])  # TODO: support multiple symbol layers
+        name = _createSymbol(graphicStroke[0], context)  # TODO: support multiple symbol layers
         style["SYMBOL"] = _quote(name)
     if color is not None:
         style["WIDTH"] = width
@@ -228,18 +350,18 @@ def _lineSymbolizer(sl, graphicStrokeLayer=0):
     return style
 
 
-def _geometryFromSymbolizer(sl):
-    geomExpr = convertExpression(sl.get("geometry", None))
+def _geometryFromSymbolizer(sl, context):
+    geomExpr = convertExpression(sl.get("geometry", None), context)
     return geomExpr
 
 
-def _createSymbol(sl):
+def _createSymbol(sl, context):
     name = ""
     symbolizerType = sl["kind"]
     if symbolizerType == "Icon":
         path = os.path.basename(sl["image"])
         name = "icon_" + os.path.splitext(path)[0]
-        _symbols.append(
+        context.symbols.append(
             {"SYMBOL": {"TYPE": "PIXMAP", "IMAGE": _quote(path), "NAME": _quote(name)}}
         )
     elif symbolizerType == "Mark":
@@ -248,7 +370,7 @@ def _createSymbol(sl):
             svgFilename = shape.split("//")[-1]
             svgName = os.path.splitext(svgFilename)[0]
             name = "svgicon_" + svgName
-            _symbols.append(
+            context.symbols.append(
                 {
                     "SYMBOL": {
                         "TYPE": "svg",
@@ -262,7 +384,7 @@ def _createSymbol(sl):
             font, code = token.split("#")
             character = chr(int(code, 16))
             name = "txtmarker_%s_%s" % (font, character)
-            _symbols.append(
+            context.symbols.append(
                 {
                     "SYMBOL": {
                         "TYPE": "TRUETYPE",
@@ -278,26 +400,26 @@ def _createSymbol(sl):
     return name
 
 
-def _iconSymbolizer(sl):
-    rotation = _symbolProperty(sl, "rotate") or 0
-    size = _symbolProperty(sl, "size")
-    color = _symbolProperty(sl, "color")
-    name = _createSymbol(sl)
+def _iconSymbolizer(sl, context):
+    rotation = _symbolProperty(sl, "rotate", context) or 0
+    size = _symbolProperty(sl, "size", context)
+    color = _symbolProperty(sl, "color", context)
+    name = _createSymbol(sl, context)
 
     style = {"SYMBOL": _quote(name), "ANGLE": rotation, "SIZE": size}
 
     return style
 
 
-def _markSymbolizer(sl):
+def _markSymbolizer(sl, context):
     # outlineDasharray = _symbolProperty(sl, "outlineDasharray")
     # opacity = _symbolProperty(sl, "opacity")
-    size = _symbolProperty(sl, "size")
-    rotation = _symbolProperty(sl, "rotate") or 0
-    color = _symbolProperty(sl, "color")
-    outlineColor = _symbolProperty(sl, "strokeColor")
-    outlineWidth = _symbolProperty(sl, "strokeWidth")
-    name = _createSymbol(sl)
+    size = _symbolProperty(sl, "size", context)
+    rotation = _symbolProperty(sl, "rotate", context) or 0
+    color = _symbolProperty(sl, "color", context)
+    outlineColor = _symbolProperty(sl, "strokeColor", context)
+    outlineWidth = _symbolProperty(sl, "strokeWidth", context)
+    name = _createSymbol(sl, context)
     style = {"SYMBOL": _quote(name), "COLOR": color, "SIZE": size, "ANGLE": rotation}
     if outlineColor is not None:
         style["OUTLINECOLOR"] = outlineColor
@@ -306,28 +428,28 @@ def _markSymbolizer(sl):
     return style
 
 
-def _fillSymbolizer(sl):
+def _fillSymbolizer(sl, context):
     style = {}
-    opacity = _symbolProperty(sl, "opacity", 1.0) * 100
-    color = _symbolProperty(sl, "color")
+    opacity = _symbolProperty(sl, "opacity", context, 1.0) * 100
+    color = _symbolProperty(sl, "color", context)
     graphicFill = sl.get("graphicFill", None)
     if graphicFill is not None:
-        name = _createSymbol(graphicFill[0])  # TODO: support multiple symbol layers
+        name = _createSymbol(graphicFill[0], context)  # TODO: support multiple symbol layers
         style["SYMBOL"] = _quote(name)
     style["OPACITY"] = opacity
     if color is not None:
         style["COLOR"] = color
 
-    outlineColor = _symbolProperty(sl, "outlineColor")
+    outlineColor = _symbolProperty(sl, "outlineColor", context)
     if outlineColor is not None:
-        outlineWidth = _symbolProperty(sl, "outlineWidth")
+        outlineWidth = _symbolProperty(sl, "outlineWidth", context)
         style["OUTLINECOLOR"] = outlineColor
         style["OUTLINEWIDTH"] = outlineWidth
 
     return style
 
 
-def _rasterSymbolizer(sl):
+def _rasterSymbolizer(sl, context):
     return None
 
 
@@ -1,2 +1,907 @@
-def convert(style, options=None):
-    raise NotImplementedError("togeostyler.convert() has not been implemented")  # TODO
+""" Reads MapServer Mapfiles.
+
+A Mapfile is read in a single pass: one compiled regular expression splits it into tokens, and the blocks
+(MAP, LAYER, CLASS, STYLE, LABEL...) are built with an explicit stack, one token at a time. INCLUDE directives are
+read in place, and SYMBOLSET files are read once and then cached (as the files included), so Mapfiles that share
+them do not read them again. Each LAYER is converted to a GeoStyler style as soon as its END has been read, and is
+then dropped.
+
+A CLASS becomes a rule. EXPRESSION (and layer FILTER) syntax becomes GeoStyler filters: logical expressions are
+parsed with an explicit operator stack, and strings, {lists} and /regular expressions/ compared with the CLASSITEM
+become equality tests (with string values, as MapServer compares them as strings) or "PropertyIsLike" filters.
+MapServer draws a feature with the first class that it matches: a class without expression after classes with one
+becomes an ELSE rule, the other filters are kept as they are. With a layer FILTER, the filters of these classes are
+negated instead, as an ELSE rule would also get the features that the layer FILTER leaves out. Classes with
+expressions that cannot be converted are skipped, with a warning.
+"""
+import functools
+import html
+import os
+import re
+
+from ..context import ConversionContext
+from ..geostyler.constants import OGC_CONCAT, OGC_IS_EQUAL_TO, OGC_IS_LIKE, OGC_PROPERTYNAME
+from ..geostyler.expressions import combine, simplifyRules
+
+# Each match is a token, with the whitespace and comments before it (or the end of the text)
+_TOKENS = re.compile(r"""(?P<space>(?:\s|\#[^\n]*)*)(?:
+    (?P<string>"(?:[^"\\]|\\.)*"i?|'(?:[^'\\]|\\.)*'i?)
+  | (?P<regex>/(?:[^/\\\n]|\\.)*/i?(?=[\s)]|$))
+  | (?P<list>\{[^}]*\})
+  | (?P<attribute>\[[^\]]*\])
+  | (?P<paren>[()])
+  | (?P<word>[^\s"'\#()\[\]{}]+)
+  | (?P<other>\S)
+  | \Z
+)""", re.VERBOSE)
+
+_IDENTIFIER = re.compile(r"^[A-Za-z_]\w*$")
+# Numbers with leading zeros (such as codes) are kept as strings
+_NUMBER = re.compile(r"^[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+# Blocks closed by END. STYLE is a block only in CLASS, LABEL and LEADER blocks (SCALEBAR and QUERYMAP have a STYLE
+# directive), SYMBOL only in MAP and SYMBOLSET blocks, and SYMBOLSET only in a symbol file
+_BLOCKS = {"MAP", "LAYER", "CLASS", "STYLE", "LABEL", "LEADER", "LEGEND", "SCALEBAR", "WEB", "PROJECTION", "METADATA",
+           "VALIDATION", "OUTPUTFORMAT", "QUERYMAP", "REFERENCE", "GRID", "FEATURE", "POINTS", "PATTERN",
+           "COMPOSITE", "CLUSTER", "JOIN", "SCALETOKEN", "VALUES"}
+
+# Directives that are recognized even when they are not the first word on their line. Other words start a directive
+# when they are first on their line.
+_KEYWORDS = _BLOCKS | {
+    "END", "INCLUDE", "SYMBOL", "SYMBOLSET", "NAME", "TYPE", "STATUS", "DATA", "CLASSITEM", "LABELITEM", "FILTER",
+    "FILTERITEM", "EXPRESSION", "TEXT", "COLOR", "OUTLINECOLOR", "BACKGROUNDCOLOR", "WIDTH", "OUTLINEWIDTH", "SIZE",
+    "MINSIZE", "MAXSIZE", "ANGLE", "OPACITY", "OFFSET", "GAP", "INITIALGAP", "LINECAP", "LINEJOIN", "FONT",
+    "POSITION", "MINSCALEDENOM", "MAXSCALEDENOM", "MINSCALE", "MAXSCALE", "IMAGE", "FILLED", "CHARACTER",
+    "ANCHORPOINT", "GEOMTRANSFORM", "SIZEUNITS", "PRIORITY", "BUFFER", "PARTIALS", "FORCE", "REPEATDISTANCE", "WRAP",
+    "MAXLENGTH", "GROUP", "KEYIMAGE", "TEMPLATE",
+}
+
+# Files are cached by path and modification time
+CACHE_SIZE = 256
+
+
+def convert(mapfile, options=None):
+    """ Converts the first LAYER of a Mapfile (given as a string) to a GeoStyler style.
+    Returns ``(geostyler, icons, warnings)``. Use convertLayers() to convert every layer. """
+    layers = convertLayers(mapfile, options)
+    if len(layers) > 1:
+        geostyler, icons, warnings = layers[0]
+        warnings.append("The Mapfile has %d layers, only '%s' has been converted" % (len(layers), geostyler["name"]))
+    return layers[0]
+
+
+def convertLayers(mapfile, options=None):
+    """ Converts every LAYER of a Mapfile (given as a string) to a GeoStyler style. Returns a list with a
+    ``(geostyler, icons, warnings)`` tuple for each layer.
+
+    INCLUDE and SYMBOLSET paths are relative to the "basepath" option (by default the current folder). """
+    context = ConversionContext(options)
+    reader = _MapfileReader(context)
+    with context.span("togeostyler"):
+        with context.span("togeostyler.parse"):
+            tokens = _TokenStream(mapfile, context.options.get("basepath") or os.getcwd(), context)
+            parse(tokens, reader, context)
+        reader.resolveSymbols()
+        if context.options.get("simplify", True):
+            with context.span("togeostyler.simplify"):
+                for geostyler, _, _ in reader.layers:
+                    simplifyRules(geostyler["rules"])
+    if not reader.layers:
+        return [({"name": "layer", "rules": []}, [], context.warnings)]
+    reader.layers[0][2][:0] = context.warnings
+    return reader.layers
+
+
+def convertFile(path, options=None):
+    """ Converts every LAYER of a Mapfile (see convertLayers()), with the INCLUDE and SYMBOLSET paths relative
+    to its folder. """
+    with open(path) as f:
+        mapfile = f.read()
+    return convertLayers(mapfile, dict(options or {}, basepath=os.path.dirname(os.path.abspath(path))))
+
+
+#######################
+
+def tokenize(text):
+    """ Yields the ``(kind, text, lineStart)`` tokens of a Mapfile, where kind is "string", "regex", "list",
+    "attribute", "paren", "word" or "other", and lineStart tells whether the token is the first on its line. """
+    for match in _TOKENS.finditer(text):
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        yield kind, match.group(kind), not match.start() or "\n" in match.group("space")
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _readFile(path, mtime):
+    with open(path) as f:
+        return f.read()
+
+
+def _fileText(path):
+    return _readFile(path, os.stat(path).st_mtime_ns)
+
+
+class _TokenStream:
+    """ The tokens of a Mapfile, with those of the files it includes in their place. """
+
+    # MapServer allows 5 levels of includes
+    MAX_DEPTH = 5
+
+    def __init__(self, text, basepath, context):
+        self.basepath = basepath
+        self.context = context
+        self.files = [(tokenize(text), None)]
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while self.files:
+            token = next(self.files[-1][0], None)
+            if token is not None:
+                return token
+            self.files.pop()
+        raise StopIteration
+
+    def include(self, name):
+        path = os.path.join(self.basepath, name)
+        if len(self.files) > self.MAX_DEPTH or any(path == included for _, included in self.files):
+            self.context.warnings.append(f"Too many nested includes: '{name}'")
+            return
+        try:
+            text = _fileText(path)
+        except OSError as e:
+            self.context.warnings.append(f"Cannot read included file '{name}': {e}")
+            return
+        self.files.append((tokenize(text), path))
+
+
+def parse(tokens, reader, context):
+    """ Builds the blocks of a Mapfile from its tokens. Blocks are dicts of the directives and blocks they hold:
+    {"NAME": [[value]], "STYLE": [block, ...], ...}, in which every directive has the list of its values, and the
+    type of a block is stored under "" (values outside directives, as in PATTERN blocks, are stored under None).
+    The reader gets every block as soon as it is complete: ``reader.block(block)`` returns whether to keep the block
+    in its parent. SYMBOLSET files are passed to ``reader.symbolset(name)``. """
+    root = {"": ""}
+    stack = [root]
+    directive = None
+    keyword = None
+    for kind, text, lineStart in tokens:
+        block = stack[-1]
+        if keyword == "PATTERN" and not directive and kind != "string":
+            # A PATTERN block (a PATTERN with a string value is read as a directive)
+            block["PATTERN"].pop()
+            stack.append({"": "PATTERN"})
+            block = stack[-1]
+            directive = keyword = None
+        if kind == "word" and _IDENTIFIER.match(text):
+            upper = text.upper()
+            if upper == "END":
+                if len(stack) == 1:
+                    context.warnings.append("Unexpected END")
+                else:
+                    _closeBlock(stack, reader)
+                directive = keyword = None
+                continue
+            if lineStart or upper in _KEYWORDS:
+                if (upper in _BLOCKS and upper not in ("PATTERN", "STYLE")) \
+                        or (upper == "STYLE" and block[""] in ("CLASS", "LABEL", "LEADER")) \
+                        or (upper == "SYMBOL" and block[""] in ("MAP", "SYMBOLSET", "")) \
+                        or (upper == "SYMBOLSET" and block[""] == ""):
+                    stack.append({"": upper})
+                    directive = keyword = None
+                else:
+                    directive = []
+                    keyword = upper
+                    block.setdefault(upper, []).append(directive)
+                continue
+        if kind == "paren" and text == "(":
+            kind, text = "expression", _expressionText(text, tokens)
+        if keyword == "INCLUDE" and kind == "string":
+            block.pop("INCLUDE")
+            tokens.include(_unquote(text))
+            directive = keyword = None
+            continue
+        if keyword == "SYMBOLSET" and kind == "string":
+            reader.symbolset(_unquote(text))
+        if directive is not None:
+            directive.append((kind, text))
+        else:
+            block.setdefault(None, []).append((kind, text))
+    if len(stack) > 1:
+        context.warnings.append("Missing END of %s" % stack[-1][""])
+        while len(stack) > 1:
+            _closeBlock(stack, reader)
+
+
+def _closeBlock(stack, reader):
+    block = stack.pop()
+    if reader.block(block):
+        stack[-1].setdefault(block[""], []).append(block)
+
+
+def _expressionText(text, tokens):
+    # The text of a parenthesized expression, up to its closing parenthesis
+    parts = [text]
+    depth = 1
+    for kind, text, _ in tokens:
+        parts.append(text)
+        if kind == "paren":
+            depth += 1 if text == "(" else -1
+            if not depth:
+                break
+    return " ".join(parts)
+
+
+def _unquote(text):
+    if text.endswith("i") and len(text) > 2 and text[-2] in "\"'":
+        text = text[:-1]
+    return re.sub(r"\\(.)", r"\1", text[1:-1])
+
+
+def _literal(text):
+    if _NUMBER.match(text):
+        return int(text) if text.lstrip("+-").isdigit() else float(text)
+    return text
+
+
+#######################
+
+class _MapfileReader:
+    """ Converts the LAYER blocks of a Mapfile as they are parsed, and keeps the symbols that they use. """
+
+    def __init__(self, context):
+        self.context = context
+        self.symbols = {}
+        self.layers = []
+        self.pending = []  # styles with symbols that were not defined yet: (symbolizers, index, style, layer)
+
+    def block(self, block):
+        kind = block[""]
+        if kind == "LAYER":
+            context = ConversionContext(self.context.options)
+            with self.context.span("togeostyler.layer"):
+                geostyler = processLayer(block, self, context)
+            self.layers.append((geostyler, [], context.warnings))
+            return False
+        if kind == "SYMBOL":
+            symbol = _symbol(block)
+            if symbol["name"]:
+                self.symbols.setdefault(symbol["name"], symbol)
+            return False
+        return True
+
+    def symbolset(self, name):
+        try:
+            symbols = _symbolset(os.path.join(self.context.options.get("basepath") or os.getcwd(), name))
+        except OSError as e:
+            self.context.warnings.append(f"Cannot read symbol set '{name}': {e}")
+            return
+        for symbolName, symbol in symbols.items():
+            self.symbols.setdefault(symbolName, symbol)
+
+    def symbol(self, name):
+        return self.symbols.get(name)
+
+    def resolveSymbols(self):
+        # Symbols may be defined after the layers that use them
+        for symbolizers, index, style, layer in self.pending:
+            symbolizers[index] = _styleSymbolizer(style, layer, self, layer["context"], pending=False)
+        for symbolizers, _, _, _ in self.pending:
+            symbolizers[:] = [sl for sl in symbolizers if sl is not None]
+        self.pending.clear()
+
+
+class _SymbolsetReader:
+
+    def __init__(self):
+        self.symbols = {}
+
+    def symbolset(self, name):
+        pass
+
+    def block(self, block):
+        if block[""] == "SYMBOL":
+            symbol = _symbol(block)
+            if symbol["name"]:
+                self.symbols.setdefault(symbol["name"], symbol)
+            return False
+        return True
+
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _readSymbolset(path, mtime):
+    context = ConversionContext()
+    reader = _SymbolsetReader()
+    parse(_TokenStream(_readFile(path, mtime), os.path.dirname(path), context), reader, context)
+    return reader.symbols
+
+
+def _symbolset(path):
+    return _readSymbolset(path, os.stat(path).st_mtime_ns)
+
+
+def _symbol(block):
+    return {
+        "name": _string(block, "NAME"),
+        "type": (_string(block, "TYPE") or "").lower(),
+        "image": _string(block, "IMAGE"),
+        "font": _string(block, "FONT"),
+        "character": _string(block, "CHARACTER"),
+        "filled": (_string(block, "FILLED") or "").lower() == "true",
+    }
+
+
+#######################
+
+def _first(block, key):
+    occurrences = block.get(key)
+    return occurrences[0] if occurrences else []
+
+
+def _token(block, key):
+    values = _first(block, key)
+    return values[0] if values else None
+
+
+def _value(token):
+    if token is None:
+        return None
+    kind, text = token
+    if kind == "string":
+        return _unquote(text)
+    if kind == "attribute":
+        return [OGC_PROPERTYNAME, text[1:-1]]
+    if kind == "word":
+        return _literal(text)
+    return text
+
+
+def _string(block, key):
+    value = _value(_token(block, key))
+    return None if value is None else str(value)
+
+
+def _number(block, key, default=None):
+    value = _value(_token(block, key))
+    if isinstance(value, str):
+        value = _literal(value)
+    return default if value is None or isinstance(value, str) else value
+
+
+def _color(block, key):
+    """ Returns the color of a COLOR-like directive as "#rrggbb" (or an attribute) and its alpha, or (None, 1). """
+    values = [_value(token) for token in _first(block, key)]
+    if len(values) >= 3 and all(isinstance(v, (int, float)) for v in values):
+        if any(v < 0 for v in values[:3]):
+            return None, 1
+        return "#%02x%02x%02x" % tuple(int(v) for v in values[:3]), 1
+    if len(values) == 1 and isinstance(values[0], str) and re.match(r"^#[0-9a-fA-F]{6}([0-9a-fA-F]{2})?$", values[0]):
+        color = values[0].lower()
+        return (color[:7], round(int(color[7:], 16) / 255, 3)) if len(color) == 9 else (color, 1)
+    if len(values) == 1 and isinstance(values[0], list):
+        return values[0], 1
+    return None, 1
+
+
+_ATTRIBUTE = re.compile(r"\[([^\]]+)\]")
+
+
+def _substitute(text):
+    # Strings with [attribute] references: Concatenate of their parts
+    if "[" not in text:
+        return text
+    parts = []
+    for i, part in enumerate(_ATTRIBUTE.split(text)):
+        if i % 2:
+            parts.append([OGC_PROPERTYNAME, part])
+        elif part:
+            parts.append(part)
+    return parts[0] if len(parts) == 1 else [OGC_CONCAT] + parts
+
+
+#######################
+
+def processLayer(block, reader, context):
+    """ Returns the GeoStyler style of a LAYER block. """
+    layer = {
+        "type": (_string(block, "TYPE") or "").upper() or _guessType(block, context),
+        "classItem": _string(block, "CLASSITEM"),
+        "labelItem": _string(block, "LABELITEM"),
+        "context": context,
+    }
+    geostyler = {"name": _string(block, "NAME") or "layer", "rules": []}
+    layerFilter = _filter(_expression(block, "FILTER"), _string(block, "FILTERITEM"), context)
+    layerScale = _scale(block)
+    if layer["type"] == "RASTER":
+        opacity = _number(block, "OPACITY", 100)
+        geostyler["rules"].append({"name": geostyler["name"], "symbolizers": [
+            {"kind": "Raster", "opacity": opacity / 100, "channelSelection": {}}]})
+        return geostyler
+    if layer["type"] not in ("POINT", "LINE", "POLYGON", "ANNOTATION"):
+        context.warnings.append("Unsupported layer type: '%s'" % layer["type"])
+        return geostyler
+
+    previousFilters = []
+    for clazz in block.get("CLASS", []):
+        rule = {"name": _string(clazz, "NAME") or ""}
+        expression = _expression(clazz, "EXPRESSION")
+        if expression is not None:
+            filt = _filter(expression, layer["classItem"], context)
+            if filt is None:
+                # Without its filter, the class would draw every feature
+                context.warnings.append("Skipped class with an unsupported expression: '%s'" % rule["name"])
+                continue
+            previousFilters.append(filt)
+        elif previousFilters:
+            # The first class that matches a feature is used: a class without expression after classes with one
+            # gets the features that these do not match
+            filt = "ELSE" if layerFilter is None else ["Not", combine("Or", previousFilters)]
+        else:
+            filt = None
+        if layerFilter is not None and filt != "ELSE":
+            filt = layerFilter if filt is None else combine("And", [layerFilter, filt])
+        if filt is not None:
+            rule["filter"] = filt
+        scale = _intersection(layerScale, _scale(clazz))
+        if scale:
+            rule["scaleDenominator"] = scale
+        symbolizers = []
+        labels = list(clazz.get("LABEL", []))
+        for style in clazz.get("STYLE", []):
+            # Labels written within styles
+            labels.extend(style.pop("LABEL", []))
+            if len(style) == 1:
+                continue
+            sl = _styleSymbolizer(style, layer, reader, context)
+            if sl is _PENDING:
+                reader.pending.append((symbolizers, len(symbolizers), style, layer))
+                symbolizers.append(None)
+            elif sl is not None:
+                symbolizers.append(sl)
+        text = _token(clazz, "TEXT")
+        for label in labels:
+            symbolizers.append(_textSymbolizer(label, text, layer, context))
+        rule["symbolizers"] = symbolizers
+        geostyler["rules"].append(rule)
+    return geostyler
+
+
+def _guessType(block, context):
+    # Layers without TYPE: the type that their styles are written for
+    context.warnings.append("Layer without TYPE, guessed from its styles")
+    for clazz in block.get("CLASS", []):
+        for style in clazz.get("STYLE", []):
+            if "SIZE" in style or "SYMBOL" in style:
+                return "POINT"
+            if "WIDTH" in style or "LINECAP" in style or "PATTERN" in style:
+                return "LINE"
+            if "COLOR" in style or "OUTLINECOLOR" in style:
+                return "POLYGON"
+    return "ANNOTATION"
+
+
+def _scale(block):
+    scale = {}
+    for key, names in (("min", ("MINSCALEDENOM", "MINSCALE")), ("max", ("MAXSCALEDENOM", "MAXSCALE"))):
+        for name in names:
+            value = _number(block, name)
+            if value is not None:
+                scale[key] = value
+                break
+    return scale
+
+
+def _intersection(layerScale, classScale):
+    scale = dict(layerScale)
+    if "min" in classScale:
+        scale["min"] = max(classScale["min"], scale.get("min", classScale["min"]))
+    if "max" in classScale:
+        scale["max"] = min(classScale["max"], scale.get("max", classScale["max"]))
+    return scale
+
+
+def _expression(block, key):
+    # Values such as !([a] > 1) are read as a single expression
+    values = _first(block, key)
+    if len(values) > 1:
+        return "expression", " ".join(text for _, text in values)
+    return values[0] if values else None
+
+
+def _filter(token, item, context):
+    """ Converts an EXPRESSION or FILTER value to a GeoStyler filter: a logical expression, or a string, list or
+    regular expression that the value of ``item`` (CLASSITEM or FILTERITEM) is compared with, as a string. """
+    if token is None:
+        return None
+    kind, text = token
+    if kind == "expression":
+        return parseExpression(text, context)
+    if item is None:
+        context.warnings.append("Unsupported expression without CLASSITEM: %s" % text)
+        return None
+    attribute = [OGC_PROPERTYNAME, item]
+    if kind == "regex":
+        return _regexFilter(attribute, text[1:text.rindex("/")], context)
+    if kind == "list":
+        return combine("Or", [[OGC_IS_EQUAL_TO, attribute, value] for value in text[1:-1].split(",")])
+    if kind == "string" and text.endswith("i"):
+        return [OGC_IS_EQUAL_TO, ["strToLower", attribute], _unquote(text).lower()]
+    return [OGC_IS_EQUAL_TO, attribute, _unquote(text) if kind == "string" else text]
+
+
+_REGEX_SPECIAL = set(".^$|?*+()[]{}")
+
+
+def _regexLiteral(pattern):
+    # The text that a regular expression matches, if it has no special characters (other than escaped ones)
+    text = []
+    escaped = False
+    for c in pattern:
+        if escaped:
+            text.append(c)
+            escaped = False
+        elif c == "\\":
+            escaped = True
+        elif c in _REGEX_SPECIAL:
+            return None
+        else:
+            text.append(c)
+    return "".join(text)
+
+
+def _regexFilter(attribute, pattern, context):
+    # Regular expressions that match literal values or substrings become equality tests or LIKE filters
+    match = re.match(r"^\^\((.*)\)\$$", pattern)
+    if match:
+        values = [_regexLiteral(v) for v in re.split(r"(?<!\\)\|", match.group(1))]
+        if None not in values:
+            return combine("Or", [[OGC_IS_EQUAL_TO, attribute, v] for v in values])
+    start = pattern.startswith("^")
+    end = pattern.endswith("$") and not pattern.endswith("\\$")
+    text = _regexLiteral(pattern[1 if start else 0:len(pattern) - (1 if end else 0)])
+    if text is None or "%" in text or "_" in text:
+        context.warnings.append("Unsupported regular expression: /%s/" % pattern)
+        return None
+    if start and end:
+        return [OGC_IS_EQUAL_TO, attribute, text]
+    return [OGC_IS_LIKE, attribute, ("" if start else "%") + text + ("" if end else "%")]
+
+
+#######################
+
+# Placeholder for styles with symbols that are not known yet
+_PENDING = object()
+
+
+def _opacity(block, default=None):
+    opacity = _number(block, "OPACITY")
+    return default if opacity is None else opacity / 100
+
+
+def _styleSymbolizer(style, layer, reader, context, pending=True):
+    symbolToken = _token(style, "SYMBOL")
+    symbolName = _value(symbolToken)
+    symbol = None
+    if isinstance(symbolName, str):
+        symbol = reader.symbol(symbolName)
+        if symbol is None and pending and symbolName not in _SHAPES:
+            # Defined further on in the Mapfile, maybe
+            return _PENDING
+    if _token(style, "GEOMTRANSFORM") is not None:
+        context.warnings.append("Unsupported GEOMTRANSFORM in layer style")
+    if layer["type"] == "POLYGON":
+        return _fillSymbolizer(style, symbolName, symbol)
+    if layer["type"] == "LINE":
+        return _lineSymbolizer(style, symbolName, symbol, context)
+    if layer["type"] == "POINT":
+        return _marker(style, symbolName, symbol)
+    return None
+
+
+_SHAPES = {"circle", "square", "triangle", "star", "cross", "x"}
+
+
+def _wellKnownName(name, symbol):
+    if symbol is None:
+        return "circle" if isinstance(name, (int, float)) or name is None else name
+    if symbol["type"] == "ellipse":
+        return "circle"
+    if symbol["type"] == "truetype" and symbol["character"]:
+        character = html.unescape(symbol["character"])
+        return "ttf://%s#%x" % (symbol["font"], ord(character[0]))
+    if symbol["type"] == "svg" and symbol["image"]:
+        return "file://" + symbol["image"]
+    return symbol["name"].lower() if symbol["name"].lower() in _SHAPES else symbol["name"]
+
+
+def _marker(style, name, symbol):
+    # Mark or Icon symbolizer of a style with a symbol
+    if symbol is not None and symbol["type"] == "pixmap" and symbol["image"]:
+        sl = {"kind": "Icon", "image": symbol["image"]}
+    else:
+        sl = {"kind": "Mark", "wellKnownName": _wellKnownName(name, symbol)}
+        color, alpha = _color(style, "COLOR")
+        outlineColor, outlineAlpha = _color(style, "OUTLINECOLOR")
+        sl["color"] = color or "#000000"
+        sl["fillOpacity"] = alpha if color is not None else 0
+        if outlineColor is not None:
+            sl["strokeColor"] = outlineColor
+            sl["strokeWidth"] = _number(style, "OUTLINEWIDTH", _number(style, "WIDTH", 1))
+            sl["strokeOpacity"] = outlineAlpha
+        else:
+            sl["strokeOpacity"] = 0
+    for key, directive in (("size", "SIZE"), ("rotate", "ANGLE")):
+        value = _value(_token(style, directive))
+        if value is not None and not isinstance(value, str):
+            sl[key] = value
+    opacity = _opacity(style)
+    if opacity is not None:
+        sl["opacity"] = opacity
+    return sl
+
+
+_HATCHES = {0: "shape://horline", 45: "shape://slash", 90: "shape://vertline", 135: "shape://backslash"}
+
+
+def _fillSymbolizer(style, name, symbol):
+    sl = {"kind": "Fill", "opacity": _opacity(style, 1.0)}
+    color, alpha = _color(style, "COLOR")
+    if symbol is not None and symbol["type"] == "hatch":
+        sl["graphicFill"] = [{"kind": "Mark", "wellKnownName": _HATCHES.get(_number(style, "ANGLE", 0) % 180,
+                                                                              "shape://slash"),
+                              "color": color or "#000000", "strokeColor": color or "#000000",
+                              "strokeWidth": _number(style, "WIDTH", 1), "size": _number(style, "SIZE", 8)}]
+    elif symbol is not None and symbol["type"] in ("pixmap", "svg", "truetype", "vector", "ellipse"):
+        sl["graphicFill"] = [_marker(style, name, symbol)]
+    elif color is not None:
+        sl["color"] = color
+        sl["fillOpacity"] = alpha
+    outlineColor, outlineAlpha = _color(style, "OUTLINECOLOR")
+    if outlineColor is not None:
+        sl["outlineColor"] = outlineColor
+        sl["outlineWidth"] = _number(style, "OUTLINEWIDTH", _number(style, "WIDTH", 1))
+        sl["outlineOpacity"] = outlineAlpha
+    return sl
+
+
+def _lineSymbolizer(style, name, symbol, context):
+    color, alpha = _color(style, "COLOR")
+    sl = {"kind": "Line", "color": color or "#000000", "width": _number(style, "WIDTH", 1),
+          "opacity": _opacity(style, 1.0) * alpha}
+    for key, directive, values in (("cap", "LINECAP", ("butt", "round", "square")),
+                                   ("join", "LINEJOIN", ("round", "miter", "bevel"))):
+        value = (_string(style, directive) or "").lower()
+        if value in values:
+            sl[key] = value
+    patterns = style.get("PATTERN")
+    if patterns:
+        pattern = patterns[0]
+        if isinstance(pattern, dict):
+            sl["dasharray"] = " ".join(text for _, text in pattern.get(None, []))
+        elif pattern:
+            sl["dasharray"] = str(_value(pattern[0]))
+    offset = [_value(token) for token in _first(style, "OFFSET")]
+    if len(offset) == 2 and offset[1] == -99:
+        sl["perpendicularOffset"] = offset[0]
+    elif offset and any(offset):
+        context.warnings.append("Unsupported line OFFSET: %s" % offset)
+    if symbol is not None and symbol["type"] in ("pixmap", "svg", "truetype", "vector", "ellipse"):
+        marker = _marker(style, name, symbol)
+        marker.pop("opacity", None)
+        sl["graphicStroke"] = [marker]
+        gap = _number(style, "GAP")
+        if gap is not None:
+            sl["graphicStrokeInterval"] = abs(gap)
+    return sl
+
+
+def _textSymbolizer(label, classText, layer, context):
+    text = _token(label, "TEXT") or classText
+    if text is None:
+        value = [OGC_PROPERTYNAME, layer["labelItem"]] if layer["labelItem"] else None
+    elif text[0] == "expression":
+        value = parseExpression(text[1], context)
+    elif text[0] == "string":
+        value = _substitute(_unquote(text[1]))
+    else:
+        value = _value(text)
+    color, alpha = _color(label, "COLOR")
+    size = _number(label, "SIZE")
+    sl = {"kind": "Text", "label": value, "color": color or "#000000", "size": 10 if size is None else size}
+    if alpha != 1:
+        sl["opacity"] = alpha
+    font = _string(label, "FONT")
+    if font is not None:
+        sl["font"] = font
+    haloColor, haloAlpha = _color(label, "OUTLINECOLOR")
+    if haloColor is not None:
+        sl.update({"haloColor": haloColor, "haloOpacity": haloAlpha, "haloSize": _number(label, "OUTLINEWIDTH", 1)})
+    offset = [_value(token) for token in _first(label, "OFFSET")]
+    if len(offset) == 2 and all(isinstance(v, (int, float)) for v in offset):
+        sl["offset"] = offset
+    angle = _value(_token(label, "ANGLE"))
+    if isinstance(angle, str) and angle.upper() == "FOLLOW":
+        sl["followLine"] = True
+    elif isinstance(angle, (int, float)):
+        sl["rotate"] = angle
+    return sl
+
+
+#######################
+
+_EXPRESSION_TOKENS = re.compile(r"""\s*(?:
+    (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<attribute>\[[^\]]+\])
+  | (?P<number>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<operator>&&|\|\||!=|>=|<=|==|=\*|~\*|[=<>~!+\-*/(),])
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<other>\S)
+)""", re.VERBOSE)
+
+# Binary operators: precedence and GeoStyler operator
+_BINARY = {
+    "or": (1, "Or"), "||": (1, "Or"),
+    "and": (2, "And"), "&&": (2, "And"),
+    "=": (4, OGC_IS_EQUAL_TO), "==": (4, OGC_IS_EQUAL_TO), "eq": (4, OGC_IS_EQUAL_TO),
+    "!=": (4, "PropertyIsNotEqualTo"), "ne": (4, "PropertyIsNotEqualTo"),
+    "<": (4, "PropertyIsLessThan"), "lt": (4, "PropertyIsLessThan"),
+    ">": (4, "PropertyIsGreaterThan"), "gt": (4, "PropertyIsGreaterThan"),
+    "<=": (4, "PropertyIsLessThanOrEqualTo"), "le": (4, "PropertyIsLessThanOrEqualTo"),
+    ">=": (4, "PropertyIsGreaterThanOrEqualTo"), "ge": (4, "PropertyIsGreaterThanOrEqualTo"),
+    "~": (4, "~"), "~*": (4, "~*"), "=*": (4, "=*"), "in": (4, "in"),
+    "+": (5, "Add"), "-": (5, "Sub"),
+    "*": (6, "Mul"), "/": (6, "Div"),
+}
+_NOT = (3, "Not", 1)
+_NEGATE = (7, "Negate", 1)
+
+_functions = {"upper": "strToUpper", "lower": "strToLower", "initcap": "strCapitalize", "length": "strLength",
+              "tostring": "to_string"}
+
+
+class _ExpressionError(Exception):
+    pass
+
+
+def parseExpression(text, context):
+    """ Converts a MapServer expression, such as ("[type]" = "road" AND [lanes] > 2), to a GeoStyler expression.
+    Operators are applied with an explicit stack (shunting-yard), so nesting depth is no issue. Unsupported
+    expressions are converted to None, with a warning. """
+    tokens = [(m.lastgroup, m.group(m.lastgroup)) for m in _EXPRESSION_TOKENS.finditer(text) if m.lastgroup]
+    values = []
+    operators = []  # (precedence, operator, arity) tuples, "(" and [function, argument count] lists
+    expectOperand = True
+    i = 0
+    try:
+        while i < len(tokens):
+            kind, token = tokens[i]
+            lower = token.lower()
+            i += 1
+            if expectOperand:
+                if token == "(":
+                    operators.append("(")
+                elif lower in ("!", "not"):
+                    operators.append(_NOT)
+                elif token == "-":
+                    operators.append(_NEGATE)
+                elif kind == "word" and i < len(tokens) and tokens[i][1] == "(":
+                    operators.append([lower, 0])
+                    i += 1
+                elif token == ")" and operators and isinstance(operators[-1], list) and operators[-1][1] == 0:
+                    values.append(_function(operators.pop()[0], []))
+                    expectOperand = False
+                else:
+                    values.append(_operand(kind, token))
+                    expectOperand = False
+            elif token == ")":
+                while operators and isinstance(operators[-1], tuple):
+                    _reduce(operators, values)
+                if not operators:
+                    raise _ExpressionError()
+                top = operators.pop()
+                if isinstance(top, list):
+                    count = top[1] + 1
+                    args = values[-count:]
+                    del values[-count:]
+                    values.append(_function(top[0], args))
+            elif token == ",":
+                while operators and isinstance(operators[-1], tuple):
+                    _reduce(operators, values)
+                if not operators or not isinstance(operators[-1], list):
+                    raise _ExpressionError()
+                operators[-1][1] += 1
+                expectOperand = True
+            elif lower in _BINARY:
+                precedence, operator = _BINARY[lower]
+                while operators and isinstance(operators[-1], tuple) and operators[-1][0] >= precedence:
+                    _reduce(operators, values)
+                operators.append((precedence, operator, 2))
+                expectOperand = True
+            else:
+                raise _ExpressionError()
+        while operators:
+            if not isinstance(operators[-1], tuple):
+                raise _ExpressionError()
+            _reduce(operators, values)
+        if len(values) != 1 or expectOperand:
+            raise _ExpressionError()
+    except (_ExpressionError, IndexError, ValueError, TypeError):
+        context.warnings.append("Unsupported expression: %s" % text)
+        return None
+    return values[0]
+
+
+def _operand(kind, token):
+    if kind == "string":
+        return _substitute(_unquote(token))
+    if kind == "attribute":
+        return [OGC_PROPERTYNAME, token[1:-1]]
+    if kind == "number":
+        return _literal(token)
+    if kind == "word" and token.lower() in ("true", "false"):
+        return token.lower() == "true"
+    raise _ExpressionError()
+
+
+def _function(name, args):
+    return [_functions.get(name, name)] + args
+
+
+def _reduce(operators, values):
+    _, operator, arity = operators.pop()
+    if arity == 1:
+        values.append(_unary(operator, values.pop()))
+    else:
+        b = values.pop()
+        a = values.pop()
+        values.append(_binary(operator, a, b))
+
+
+def _unary(operator, a):
+    if operator == "Negate":
+        return -a if isinstance(a, (int, float)) and not isinstance(a, bool) else ["Sub", 0, a]
+    if isinstance(a, list) and a and a[0] == "Not":
+        return a[1]
+    return ["Not", a]
+
+
+def _isText(value):
+    return (isinstance(value, str) and _literal(value) is value) or \
+        (isinstance(value, list) and bool(value) and value[0] == OGC_CONCAT)
+
+
+def _binary(operator, a, b):
+    if operator in ("And", "Or"):
+        # The nodes were created by this parser: operands are added in place, so that long chains take linear time
+        if isinstance(a, list) and a and a[0] == operator:
+            a.extend(b[1:] if isinstance(b, list) and b and b[0] == operator else [b])
+            return a
+        return combine(operator, [a, b])
+    if operator in ("~", "~*"):
+        if not isinstance(b, str):
+            raise _ExpressionError()
+        if operator == "~*":
+            a, b = ["strToLower", a], b.lower()
+        return _regexFilter(a, b, _Warnings())
+    if operator == "=*":
+        return [OGC_IS_EQUAL_TO, ["strToLower", a], b.lower() if isinstance(b, str) else ["strToLower", b]]
+    if operator == "in":
+        if not isinstance(b, str):
+            raise _ExpressionError()
+        return combine("Or", [[OGC_IS_EQUAL_TO, a, _literal(v.strip())] for v in b.split(",")])
+    if operator == "Add" and (_isText(a) or _isText(b)):
+        return combine(OGC_CONCAT, [a, b])
+    return [operator, a, b]
+
+
+class _Warnings:
+    """ Raises an error for the warning of an unsupported regular expression within an expression """
+
+    @property
+    def warnings(self):
+        return self
+
+    def append(self, warning):
+        raise _ExpressionError(warning)
@@ -0,0 +1,163 @@
+import threading
+import time
+import tracemalloc
+
+
+class _NoSpan:
+    """ Does nothing. Returned for every span when profiling is disabled. """
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+class _Span:
+    __slots__ = ("profiler", "stage", "rule", "start", "memory")
+
+    def __init__(self, profiler, stage, rule):
+        self.profiler = profiler
+        self.stage = stage
+        self.rule = rule
+
+    def __enter__(self):
+        if self.profiler.memory and tracemalloc.is_tracing():
+            stack = self.profiler._memoryStack()
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # the peak so far belongs to the enclosing span, as the peak is reset for this one
+                stack[-1][1] = max(stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.memory = [current, current]
+            stack.append(self.memory)
+        else:
+            self.memory = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        memory = None
+        if self.memory is not None and tracemalloc.is_tracing():
+            stack = self.profiler._memoryStack()
+            stack.pop()
+            peak = tracemalloc.get_traced_memory()[1]
+            memory = max(self.memory[1], peak) - self.memory[0]
+            if stack:
+                stack[-1][1] = max(stack[-1][1], peak)
+        self.profiler._record(self.stage, self.rule, elapsed, memory)
+        return False
+
+
+class Profiler:
+    """ Collects the time (and optionally the peak memory) spent in each stage of a conversion.
+
+    Pass it in the conversion options as ``options["profiler"]``. The converters then report a span for each
+    stage they go through (e.g. "parse", "togeostyler", "sld") and for each rule they convert (e.g.
+    "sld.rule"), as a dict with the stage, the rule name (or None), the time in seconds and the peak memory
+    in bytes allocated on top of what was in use when the span started (or None).
+
+    Spans are kept in ``spans`` and passed to ``callback`` (if given) as they finish. A plain callable
+    in ``options["profiler"]`` is used as the callback of a new Profiler. With ``memory=True``, memory is
+    traced with tracemalloc between start() and stop() (or within a ``with`` block), which makes the
+    conversion itself several times slower. With ``rules=False`` only whole stages are reported.
+    """
+
+    def __init__(self, callback=None, memory=False, rules=True):
+        self.callback = callback
+        self.memory = memory
+        self.rules = rules
+        self.spans = []
+        self._local = threading.local()
+        self._startedTracing = False
+
+    def start(self):
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._startedTracing = True
+        return self
+
+    def stop(self):
+        if self._startedTracing:
+            tracemalloc.stop()
+            self._startedTracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def span(self, stage, rule=None):
+        """ Returns a context manager that records the time spent in its block as a span of the given stage.
+        ``rule`` is the GeoStyler rule or ArcGIS class (or its name) the span belongs to, if any. """
+        if rule is not None and not self.rules:
+            return NO_SPAN
+        return _Span(self, stage, rule)
+
+    def _memoryStack(self):
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = []
+            return self._local.stack
+
+    def _record(self, stage, rule, elapsed, memory):
+        span = {
+            "stage": stage,
+            "rule": _ruleName(rule),
+            "time": elapsed,
+            "memory": memory,
+        }
+        self.spans.append(span)
+        if self.callback is not None:
+            self.callback(span)
+
+    def summary(self):
+        """ Returns the number of spans, total and maximum time and maximum peak memory of each stage. """
+        stages = {}
+        for span in self.spans:
+            stage = stages.setdefault(span["stage"], {"count": 0, "time": 0.0, "maxTime": 0.0, "memory": None})
+            stage["count"] += 1
+            stage["time"] += span["time"]
+            stage["maxTime"] = max(stage["maxTime"], span["time"])
+            if span["memory"] is not None:
+                stage["memory"] = max(stage["memory"] or 0, span["memory"])
+        return stages
+
+    def report(self):
+        """ Returns the summary as a printable table. """
+        lines = ["%-24s %8s %12s %12s %12s" % ("stage", "count", "time (s)", "max (s)", "peak (KiB)")]
+        for name, stage in self.summary().items():
+            memory = "%.1f" % (stage["memory"] / 1024) if stage["memory"] is not None else "-"
+            lines.append("%-24s %8d %12.4f %12.4f %12s"
+                         % (name, stage["count"], stage["time"], stage["maxTime"], memory))
+        return "\n".join(lines)
+
+
+def _ruleName(rule):
+    if rule is None or isinstance(rule, str):
+        return rule
+    name = rule.get("name")
+    return rule.get("label") if name is None else name
+
+
+def getProfiler(options):
+    """ Returns the Profiler given in the conversion options, if any. """
+    profiler = options.get("profiler") if options else None
+    if profiler is None or isinstance(profiler, Profiler):
+        return profiler
+    return Profiler(callback=profiler)
+
+
+def span(options, stage):
+    """ Returns a span of the given stage for the profiler in the conversion options (if any), for code
+    that runs before a ConversionContext is created. """
+    profiler = getProfiler(options)
+    return NO_SPAN if profiler is None else profiler.span(stage)
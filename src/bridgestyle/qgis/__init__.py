@@ -64,14 +64,12 @@ def layerStyleAsMapfileFolder(layer, folder, additional=None):
     warnings.extend(msWarnings)
     additional = additional or {}
     mserverDict["LAYER"].update(additional)
-    mapfile = mapserver.fromgeostyler.convertDictToMapfile(mserverDict)
-    symbols = mapserver.fromgeostyler.convertDictToMapfile({"SYMBOLS": mserverSymbolsDict})
     filename = os.path.join(folder, layer.name() + ".txt")
     with open(filename, "w", encoding='utf-8') as f:
-        f.write(mapfile)
+        mapserver.fromgeostyler.writeDictToMapfile(mserverDict, f)
     filename = os.path.join(folder, layer.name() + "_symbols.txt")
     with open(filename, "w", encoding='utf-8') as f:
-        f.write(symbols)
+        mapserver.fromgeostyler.writeDictToMapfile({"SYMBOLS": mserverSymbolsDict}, f)
     for icon in icons:
         dst = os.path.join(folder, os.path.basename(icon))
         copyfile(icon, dst)
@@ -1,5 +1,16 @@
 from typing import Optional, Any
 
+from ..geostyler.constants import (
+    OGC_PROPERTYNAME,
+    OGC_IS_EQUAL_TO,
+    OGC_IS_NULL,
+    OGC_IS_NOT_NULL,
+    OGC_IS_LIKE,
+    OGC_CONCAT,
+    OGC_SUB
+)
+from ..geostyler.expressions import combine
+
 try:
     from qgis.core import (
         QgsExpressionNode, QgsExpression, QgsExpressionNodeBinaryOperator,
@@ -21,14 +32,6 @@ class CompatibilityException(Exception):
     pass
 
 
-OGC_PROPERTYNAME = "PropertyName"
-OGC_IS_EQUAL_TO = "PropertyIsEqualTo"
-OGC_IS_NULL = "PropertyIsNull"
-OGC_IS_NOT_NULL = "PropertyIsNotNull"
-OGC_IS_LIKE = "PropertyIsLike"
-OGC_CONCAT = "Concatenate"
-OGC_SUB = "Sub"
-
 _qbo = None      # BinaryOperator
 _nt = None       # NodeType
 BINOPS_MAP = {}  # Mapping of QGIS binary operators to OGC operators (where possible)
@@ -151,6 +154,7 @@ class ExpressionConverter:
         for the field list and the expression context. """
 
         self.layer = layer
+        self.warnings = set()
 
         feature = self._get_feature(layer)
         if feature is None:
@@ -200,7 +204,7 @@ class ExpressionConverter:
         self.warnings.clear()
 
     def convert(self, expression: QgsExpression) -> Any:
-        """ Kicks off the recursive expression walker and returns the converted result. """
+        """ Kicks off the expression walker and returns the converted result. """
         if isinstance(expression, QgsExpression):
             if not expression.isValid():
                 self.warnings.add(f"Invalid expression: {expression.expression()}")
@@ -210,16 +214,55 @@ class ExpressionConverter:
         return None
 
     def _walk(self, node, parent, null_allowed=False, cast_to=None):
+        """ Converts a node bottom-up. The operands of operators and functions are converted with an explicit
+        stack instead of recursion, so deeply nested expressions don't hit the recursion limit. """
+        # Frames: [node, null_allowed, cast_to, operands to convert, converted operands]
+        stack = [[node, null_allowed, cast_to, None, []]]
+        while True:
+            frame = stack[-1]
+            if frame[3] is None:
+                frame[3] = self._operands(frame[0])
+            operands, converted = frame[3], frame[4]
+            if len(converted) < len(operands):
+                stack.append([*operands[len(converted)], None, []])
+                continue
+            exp = self._convert_node(frame[0], parent, frame[1], frame[2], converted)
+            stack.pop()
+            if not stack:
+                return exp
+            stack[-1][4].append(exp)
+
+    def _operands(self, node):
+        """ Returns the (node, null_allowed, cast_to) operands to convert before the given node. """
+        if node.nodeType() == _nt.ntBinaryOperator:
+            left = node.opLeft()
+            castTo = None
+            if left.nodeType() == _nt.ntColumnRef and self.fields is not None:
+                name = self._handle_column_ref(left)[-1]
+                fields = [f for f in self.fields if f.name() == name]
+                if len(fields) == 1:
+                    # Field has been found, get its type
+                    castTo = fields[0].typeName()
+            return [(left, False, None), (node.opRight(), True, castTo)]
+        if node.nodeType() == _nt.ntUnaryOperator:
+            return [(node.operand(), False, None)]
+        if node.nodeType() == _nt.ntFunction and self._function_name(node) is not None:
+            args = node.args()
+            return [(arg, False, None) for arg in args.list()] if args is not None else []
+        return []
+
+    def _convert_node(self, node, parent, null_allowed, cast_to, operands):
+        """ Converts a node, given the conversions of its operands. """
         exp = None
         cast_to = str(cast_to).lower()
         if node.nodeType() == _nt.ntBinaryOperator:
-            exp = self._handle_binary_op(node, parent)
+            exp = self._handle_binary_op(node, parent, *operands)
         elif node.nodeType() == _nt.ntUnaryOperator:
-            exp = self._handle_unary_op(node, parent)
+            exp = self._handle_unary_op(node, *operands)
         elif node.nodeType() == _nt.ntInOperator:
             exp = self._handle_in_op(node)
         elif node.nodeType() == _nt.ntFunction:
-            exp = self._handle_function(node, parent)
+            exp = self._handle_function(node, operands)
         elif node.nodeType() == _nt.ntLiteral:
             exp = self._handle_literal(node)
             if exp is None and null_allowed:
@@ -259,19 +302,13 @@ class ExpressionConverter:
             equals_expr = [BINOPS_MAP[_qbo.boEQ], colRef, self._handle_literal(item)]  # 2 is "="
             propEqualsExprs.append(equals_expr)
 
-        # build into single expression
-        if len(propEqualsExprs) == 1:
-            return propEqualsExprs[0]  # handle 1 item in the list
-        accum = [BINOPS_MAP[_qbo.boOr], propEqualsExprs[0], propEqualsExprs[1]]  # 0="OR"
-        for idx in range(2, len(propEqualsExprs)):
-            accum = [BINOPS_MAP[_qbo.boOr], accum, propEqualsExprs[idx]]  # 0="OR"
-        return accum
+        # build into single (flat) expression
+        return combine(BINOPS_MAP[_qbo.boOr], propEqualsExprs)
 
-    def _handle_binary_op(self, node: QgsExpressionNodeBinaryOperator, parent: QgsExpression):
+    def _handle_binary_op(self, node: QgsExpressionNodeBinaryOperator, parent: QgsExpression, retLeft, retRight):
         op = node.op()
         retOp = BINOPS_MAP[op]
         left = node.opLeft()
-        right = node.opRight()
 
         if op == _qbo.boPlus and self.context is not None:
             # Detect special case where ADD (+) is used to concatenate strings [#93]
@@ -281,14 +318,6 @@ class ExpressionConverter:
                 # TODO: because a 3-item list is returned, this may result in multiple nested Concatenate expressions!
                 retOp = OGC_CONCAT
 
-        retLeft = self._walk(left, parent)
-        castTo = None
-        if left.nodeType() == _nt.ntColumnRef:
-            fields = [f for f in self.fields if f.name() == retLeft[-1]]
-            if len(fields) == 1:
-                # Field has been found, get its type
-                castTo = fields[0].typeName()
-        retRight = self._walk(right, parent, True, castTo)
         if retOp is None and retRight is None:
             if op == _qbo.boIs:
                 # Special case for IS NULL
@@ -303,13 +332,14 @@ class ExpressionConverter:
             elif op == _qbo.boIsNot:
                 # Special case for IS NOT TRUE/FALSE
                 retOp = "PropertyIsNotEqualTo"
+        if op in (_qbo.boAnd, _qbo.boOr):
+            # QGIS chains of ANDs or ORs are nested binary operators: keep them flat
+            return combine(retOp, [retLeft, retRight])
         return [retOp, retLeft, retRight]
 
-    def _handle_unary_op(self, node, parent):
-        op = node.op()
-        operand = node.operand()
-        retOp = UNOPS_MAP[op]
-        retOperand = self._walk(operand, parent)
+    @staticmethod
+    def _handle_unary_op(node, retOperand):
+        retOp = UNOPS_MAP[node.op()]
         if retOp == OGC_SUB:  # handle the particular case of a minus in a negative number
             return [retOp, 0, retOperand]
         else:
@@ -330,20 +360,18 @@ class ExpressionConverter:
                     return [OGC_PROPERTYNAME, field.name()]
         return [OGC_PROPERTYNAME, node.name()]
 
-    def _handle_function(self, node, parent):
-        fnIndex = node.fnIndex()
-        func = QgsExpression.Functions()[fnIndex].name()
+    @staticmethod
+    def _function_name(node):
+        """ Returns the OGC name of a function node, or None if it has none. """
+        return FUNCTION_MAP.get(QgsExpression.Functions()[node.fnIndex()].name())
+
+    def _handle_function(self, node, args):
+        func = QgsExpression.Functions()[node.fnIndex()].name()
         if func == "$geometry":
             return [OGC_PROPERTYNAME, "geom"]
-        fname = FUNCTION_MAP.get(func)
+        fname = self._function_name(node)
         if fname is not None:
-            elems = [fname]
-            args = node.args()
-            if args is not None:
-                args = args.list()
-                for arg in args:
-                    elems.append(self._walk(arg, parent))
-            return elems
+            return [fname] + args
         else:
             raise UnsupportedExpressionException(
                 f"Unsupported function in expression: '{func}'"
@@ -1,8 +1,9 @@
 import json
 import math
 import os
-from typing import Optional
 
+from ..context import ConversionContext
+from ..geostyler.expressions import combine, simplifyRules
 from .expressions import ExpressionConverter, UnsupportedExpressionException
 
 try:
@@ -52,42 +53,30 @@ SHAPE_NAMES = {
     "cross_filled": "shape://plus"
 }
 
-# Global variable
-_expressionConverter: Optional[ExpressionConverter] = None
-_usedIcons = {}
-_usedSprites = {}  # sprite name -> {"image":Image, "image2x":Image}
-_warnings = []
-
 
 def convert(layer, options=None):
     """ Main entry point for converting a QGIS layer to a GeoStyler style. """
-    global _usedIcons, _usedSprites, _warnings
-
-    _usedIcons = {}
-    _usedSprites = {}
-    _warnings = []
+    context = ConversionContext(options)
 
-    geostyler = processLayer(layer)
+    geostyler = processLayer(layer, context)
     if geostyler is None:
         geostyler = {"name": layer.name()}
 
-    return geostyler, _usedIcons, _usedSprites, _warnings
+    return geostyler, context.icons, context.sprites, context.warnings
 
 
-def processLayer(layer):
-    global _expressionConverter
-
-    _expressionConverter = ExpressionConverter(layer)
+def processLayer(layer, context):
+    context.expressionConverter = ExpressionConverter(layer)
 
     geostyler = {"name": layer.name()}
     if layer.type() == layer.VectorLayer:
         rules = []
         renderer = layer.renderer()
         if renderer is None:
-            _warnings.append("No renderer found for layer: %s" % layer.name())
+            context.warnings.append("No renderer found for layer: %s" % layer.name())
             return
         if isinstance(renderer, QgsHeatmapRenderer):
-            symbolizer, transformation = heatmapRenderer(renderer)
+            symbolizer, transformation = heatmapRenderer(renderer, context)
             if symbolizer and transformation:
                 rules = [{"name": layer.name(), "symbolizers": [symbolizer]}]
                 geostyler["rules"] = rules
@@ -100,19 +89,21 @@ def processLayer(layer):
                 else:
                     ruleRenderer = renderer
                 if ruleRenderer is None:
-                    _warnings.append(
+                    context.warnings.append(
                         "Unsupported renderer type: %s" % str(renderer))
                     return
                 for rule in ruleRenderer.rootRule().children():
                     if rule.active():
-                        rules.extend(processRule(rule, None, layer.opacity(), layer))
-            labelingRules = processLabelingLayer(layer)
+                        rules.extend(processRule(rule, context, None, layer.opacity(), layer))
+            labelingRules = processLabelingLayer(layer, context)
             if labelingRules:
                 rules = rules + labelingRules
+            if context.options.get("simplify", True):
+                simplifyRules(rules)
             geostyler["rules"] = rules
     elif layer.type() == layer.RasterLayer:
         rules = [{"name": layer.name(), "symbolizers": [
-            rasterSymbolizer(layer)]}]
+            rasterSymbolizer(layer, context)]}]
         geostyler["rules"] = rules
 
     if layer.blendMode() in BLEND_MODES:
@@ -121,11 +112,11 @@ def processLayer(layer):
     return geostyler
 
 
-def heatmapRenderer(renderer):
+def heatmapRenderer(renderer, context):
     hmRadius = renderer.radius()
     colorRamp = renderer.colorRamp()
     if not isinstance(colorRamp, QgsGradientColorRamp):
-        _warnings.append("Unsupported color ramp class: %s" % str(colorRamp))
+        context.warnings.append("Unsupported color ramp class: %s" % str(colorRamp))
         return None, None
     colMap = {}
     colMap["type"] = "intervals" if colorRamp.isDiscrete() else "ramp"
@@ -142,7 +133,7 @@ def heatmapRenderer(renderer):
     weightAttr = renderer.weightExpression()
     radius = renderer.radius()
     if renderer.radiusUnit() != QgsUnitTypes.RenderUnit.RenderPixels:
-        _warnings.append(
+        context.warnings.append(
             "Radius for heatmap renderer can only be expressed in pixels")
 
     channel = {"grayChannel": {"sourceChannelName": 1}}
@@ -153,17 +144,17 @@ def heatmapRenderer(renderer):
     return symbolizer, transformation
 
 
-def rasterSymbolizer(layer):
+def rasterSymbolizer(layer, context):
     renderer = layer.renderer()
     symbolizer = {"kind": "Raster", "opacity": renderer.opacity(),
-                  "channelSelection": channelSelection(renderer)}
-    colMap = colorMap(renderer)
+                  "channelSelection": channelSelection(renderer, context)}
+    colMap = colorMap(renderer, context)
     if colMap:
         symbolizer["colorMap"] = colMap
     return symbolizer
 
 
-def channelSelection(renderer):
+def channelSelection(renderer, context):
     # handle a WMS layer -- this is wrong, but it throws exceptions...
     if isinstance(renderer, QgsSingleBandColorDataRenderer):
         return {"grayChannel": {"sourceChannelName": str(renderer.usesBands()[0])}}
@@ -182,12 +173,12 @@ def channelSelection(renderer):
             channels["blueChannel"] = {"sourceChannelName": str(bands[2])}
         return channels
     else:
-        _warnings.append(
+        context.warnings.append(
             "Unsupported raster renderer class: '%s'" % str(renderer))
         return {}
 
 
-def colorMap(renderer):
+def colorMap(renderer, context):
     colMap = {}
     mapEntries = []
     if isinstance(renderer, QgsSingleBandGrayRenderer):
@@ -217,10 +208,10 @@ def colorMap(renderer):
             mapEntries.append({"color": c.color.name(), "quantity": c.value,
                                "label": c.label, "opacity": c.color.alphaF()})
     elif isinstance(renderer, QgsMultiBandColorRenderer):
-        _warnings.append(f"Unsupported raster renderer class: '{str(renderer)}'")  # TODO
+        context.warnings.append(f"Unsupported raster renderer class: '{str(renderer)}'")  # TODO
         return None
     else:
-        _warnings.append(f"Unsupported raster renderer class: '{str(renderer)}'")
+        context.warnings.append(f"Unsupported raster renderer class: '{str(renderer)}'")
         return None
 
     colMap["extended"] = True
@@ -243,7 +234,7 @@ def labelThisRule(labeling):
     return labeling.settings().isExpression
 
 
-def processLabelingLayer(layer):
+def processLabelingLayer(layer, context):
     if not layer.labelsEnabled():
         return []
     labeling = layer.labeling()
@@ -251,74 +242,74 @@ def processLabelingLayer(layer):
         return []
 
     if isinstance(labeling, QgsRuleBasedLabeling):
-        return processRuleLabeling(layer, labeling.rootRule(), "labeling")
+        return processRuleLabeling(layer, labeling.rootRule(), "labeling", context)
     if not isinstance(labeling, QgsVectorLayerSimpleLabeling):
-        _warnings.append("Unsupported labeling class: '%s'" % str(labeling))
+        context.warnings.append("Unsupported labeling class: '%s'" % str(labeling))
         return []
-    return [processLabeling(layer, labeling)]
+    return [processLabeling(layer, labeling, context)]
 
 
 # given a rule, calculate the full filter
 # i.e. its an AND of the rule and its parents (and grand parents)
-def getHierarchicalFilter(rule, filter=None):
+def getHierarchicalFilter(rule, context, filter=None):
     if rule is None:
         return filter
     filter = andFilter(
-        processExpression(rule.filterExpression()),
-        getHierarchicalFilter(rule.parent()))
+        processExpression(rule.filterExpression(), context),
+        getHierarchicalFilter(rule.parent(), context))
     return filter
 
 
-def processRuleLabeling(layer, labeling, name):
+def processRuleLabeling(layer, labeling, name, context):
     result = []
     for child in labeling.children():
         if child.active():
             fullname = name + " - " + child.description()
             # filter = andFilter(filter, processExpression(
             #    child.filterExpression()))
-            filter = getHierarchicalFilter(child)
+            filter = getHierarchicalFilter(child, context)
             if labelThisRule(child):
-                symbolizer = processLabeling(layer, child, fullname, filter)
+                symbolizer = processLabeling(layer, child, context, fullname, filter)
                 result.append(symbolizer)
-            result += processRuleLabeling(layer, child, name)
+            result += processRuleLabeling(layer, child, name, context)
     return result
 
 
-def processLabeling(layer, labeling, name="labeling", filter=None):
+def processLabeling(layer, labeling, context, name="labeling", filter=None):
     symbolizer = {"kind": "Text"}
     settings = labeling.settings()
     textFormat = settings.format()
 
     size = _labelingProperty(settings, textFormat,
-                             "size", QgsPalLayerSettings.Property.Size)
+                             "size", context, QgsPalLayerSettings.Property.Size)
     sizeUnits = _labelingProperty(settings, textFormat,
-                                  "sizeUnit", QgsPalLayerSettings.Property.FontSizeUnit)
-    size = str(_handleUnits(size, sizeUnits))
+                                  "sizeUnit", context, QgsPalLayerSettings.Property.FontSizeUnit)
+    size = str(_handleUnits(size, sizeUnits, context))
     color = textFormat.color().name()
     font = textFormat.font().family()
     rotation = _labelingProperty(
-        settings, None, "angleOffset", QgsPalLayerSettings.Property.LabelRotation)
+        settings, None, "angleOffset", context, QgsPalLayerSettings.Property.LabelRotation)
     buff = textFormat.buffer()
     if buff.enabled():
         haloColor = buff.color().name()
         haloSize = _labelingProperty(
-            settings, buff, "size", QgsPalLayerSettings.Property.BufferSize)
+            settings, buff, "size", context, QgsPalLayerSettings.Property.BufferSize)
         haloSizeUnit = _labelingProperty(
-            settings, buff, "sizeUnit", QgsPalLayerSettings.Property.BufferUnit)
-        haloSize = str(_handleUnits(haloSize, haloSizeUnit))
+            settings, buff, "sizeUnit", context, QgsPalLayerSettings.Property.BufferUnit)
+        haloSize = str(_handleUnits(haloSize, haloSizeUnit, context))
         symbolizer.update({"haloColor": haloColor,
                            "haloSize": haloSize,
                            "haloOpacity": buff.opacity()})
 
     if layer.geometryType() == QgsWkbTypes.GeometryType.LineGeometry:
-        offset = _labelingProperty(settings, None, "dist")
+        offset = _labelingProperty(settings, None, "dist", context)
         symbolizer["perpendicularOffset"] = offset
         if settings.placement == QgsPalLayerSettings.Placement.Curved:
             symbolizer["followLine"] = True
     else:
         anchor = quadOffset[settings.quadOffset]
-        offsetX = _labelingProperty(settings, None, "xOffset")
-        offsetY = _labelingProperty(settings, None, "yOffset")
+        offsetX = _labelingProperty(settings, None, "xOffset", context)
+        offsetY = _labelingProperty(settings, None, "yOffset", context)
         symbolizer.update({"offset": [offsetX, offsetY],
                            "anchor": anchor,
                            "rotate": rotation})
@@ -326,9 +317,9 @@ def processLabeling(layer, labeling, name="labeling", filter=None):
     label = None
     exp = settings.getLabelExpression()
     try:
-        label = _expressionConverter.convert(exp)
+        label = context.expressionConverter.convert(exp)
     except UnsupportedExpressionException as e:
-        _warnings.append(str(e))
+        context.warnings.append(str(e))
 
     if label is None:
         label = ''  # default to empty string if expression is bad
@@ -338,7 +329,7 @@ def processLabeling(layer, labeling, name="labeling", filter=None):
                        "label": label,
                        "size": size})
     # background (i.e. road shields)
-    addBackground(textFormat, symbolizer)
+    addBackground(textFormat, symbolizer, context)
 
     result = {"symbolizers": [symbolizer], "name": name}
     if filter is not None:
@@ -359,7 +350,7 @@ def processLabeling(layer, labeling, name="labeling", filter=None):
     return result
 
 
-def addBackground(textFormat, symbolizer):
+def addBackground(textFormat, symbolizer, context):
     background = textFormat.background()
     if not background.enabled():
         return
@@ -388,8 +379,8 @@ def addBackground(textFormat, symbolizer):
     if background_sizeUnit == QgsUnitTypes.RenderUnit.RenderPoints:
         sizeUnits = "Point"
 
-    sizeX = _handleUnits(background_size.width(), sizeUnits)
-    sizeY = _handleUnits(background_size.height(), sizeUnits)
+    sizeX = _handleUnits(background_size.width(), sizeUnits, context)
+    sizeY = _handleUnits(background_size.height(), sizeUnits, context)
 
     fillColor = _toHexColorQColor(background.fillColor())
     strokeColor = _toHexColorQColor(background.strokeColor())
@@ -414,24 +405,24 @@ def andFilter(f1, f2):
         return f2
     if f2 is None:
         return f1
-    return ['And', f1, f2]
+    return combine('And', [f1, f2])
 
 
-def processRule(rule, filters=None, layerOpacity=1, layer=None):
+def processRule(rule, context, filters=None, layerOpacity=1, layer=None):
     ruledefs = []
 
     if rule.isElse():
         filt = "ELSE"
     else:
-        filt = andFilter(processExpression(rule.filterExpression()), filters)
+        filt = andFilter(processExpression(rule.filterExpression(), context), filters)
 
     for subrule in rule.children():
         if subrule.active():
-            ruledefs.extend(processRule(subrule, filt, layerOpacity, layer))
+            ruledefs.extend(processRule(subrule, context, filt, layerOpacity, layer))
 
     symbol = rule.symbol()
     if symbol is not None:
-        symbolizers = _createSymbolizers(rule.symbol(), layerOpacity)
+        symbolizers = _createSymbolizers(rule.symbol(), context, layerOpacity)
         name = rule.label()
         ruledef = {"name": name,
                    "symbolizers": symbolizers}
@@ -465,15 +456,15 @@ def processRuleScale(rule):
             "min": rule.maximumScale()}
 
 
-def processExpression(expstr):
+def processExpression(expstr, context):
     try:
         if expstr:
             exp = QgsExpression(expstr)
-            return _expressionConverter.convert(exp)
+            return context.expressionConverter.convert(exp)
         else:
             return None
     except UnsupportedExpressionException as e:
-        _warnings.append(str(e))
+        context.warnings.append(str(e))
         return None
 
 
@@ -487,7 +478,7 @@ def _cast(v):
         return v
 
 
-def _handleUnits(value, units, propertyConstant=None):
+def _handleUnits(value, units, context, propertyConstant=None):
     if propertyConstant == QgsSymbolLayer.Property.PropertyStrokeWidth and str(value) in ["0", "0.0"]:
         return 1  # hairline width
     if units in ["Point", QgsUnitTypes.RenderUnit.RenderPoints]:
@@ -502,7 +493,7 @@ def _handleUnits(value, units, propertyConstant=None):
             return float(value) * MM2PIXEL
     elif units == "RenderMetersInMapUnits":
         if isinstance(value, list):
-            _warnings.append(
+            context.warnings.append(
                 "Cannot render in map units when using a data-defined size value: '%s'" % str(value))
             return value
         else:
@@ -510,16 +501,16 @@ def _handleUnits(value, units, propertyConstant=None):
     elif units in ["Pixel", QgsUnitTypes.RenderUnit.RenderMillimeters]:
         return value
     else:
-        _warnings.append("Unsupported units: '%s'" % units)
+        context.warnings.append("Unsupported units: '%s'" % units)
         return value
 
 
-def _labelingProperty(settings, obj, name, propertyConstant=-1):
+def _labelingProperty(settings, obj, name, context, propertyConstant=-1):
     ddProps = settings.dataDefinedProperties()
     v = None
     if propertyConstant in ddProps.propertyKeys():
         v = processExpression(ddProps.property(
-            propertyConstant).asExpression())  # could return None if expression is bad
+            propertyConstant).asExpression(), context)  # could return None if expression is bad
     if v is None:
         v = getattr(obj or settings, name)
         try:
@@ -531,17 +522,17 @@ def _labelingProperty(settings, obj, name, propertyConstant=-1):
     return _cast(v)
 
 
-def _symbolProperty(symbolLayer, name, propertyConstant=-1, default=0):
+def _symbolProperty(symbolLayer, name, context, propertyConstant=-1, default=0):
     ddProps = symbolLayer.dataDefinedProperties()
     if propertyConstant in ddProps.propertyKeys() and ddProps.isActive(propertyConstant):
         v = processExpression(ddProps.property(
-            propertyConstant).asExpression()) or ""
+            propertyConstant).asExpression(), context) or ""
     else:
         v = symbolLayer.properties().get(name, default)
 
     units = symbolLayer.properties().get(name + "_unit")
     if units is not None:
-        v = _handleUnits(v, units, propertyConstant)
+        v = _handleUnits(v, units, context, propertyConstant)
     return _cast(v)
 
 
@@ -576,13 +567,13 @@ def _opacity(color) -> float:
         return 1.0
 
 
-def _createSymbolizers(symbol, layerOpacity=1):
+def _createSymbolizers(symbol, context, layerOpacity=1):
     opacity = symbol.opacity() * layerOpacity
     symbolizers = []
 
     for indx in range(len(symbol.symbolLayers())):
         sl = symbol.symbolLayers()[indx]
-        symbolizer = _createSymbolizer(sl, opacity)
+        symbolizer = _createSymbolizer(sl, opacity, context)
         if symbolizer is not None:
             if not isinstance(symbolizer, list):
                 symbolizer = [symbolizer]
@@ -593,42 +584,42 @@ def _createSymbolizers(symbol, layerOpacity=1):
     return symbolizers
 
 
-def _createSymbolizer(sl, opacity):
+def _createSymbolizer(sl, opacity, context):
     symbolizer = None
     if isinstance(sl, QgsSimpleMarkerSymbolLayer):
-        symbolizer = _simpleMarkerSymbolizer(sl, opacity)
+        symbolizer = _simpleMarkerSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsSimpleLineSymbolLayer):
-        symbolizer = _lineSymbolizer(sl, opacity)
+        symbolizer = _lineSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsMarkerLineSymbolLayer):
-        symbolizer = _markerLineSymbolizer(sl, opacity)
+        symbolizer = _markerLineSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsSimpleFillSymbolLayer):
-        symbolizer = _simpleFillSymbolizer(sl, opacity)
+        symbolizer = _simpleFillSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsPointPatternFillSymbolLayer):
-        symbolizer = _pointPatternFillSymbolizer(sl, opacity)
+        symbolizer = _pointPatternFillSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsLinePatternFillSymbolLayer):
-        symbolizer = _linePatternFillSymbolizer(sl, opacity)
+        symbolizer = _linePatternFillSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsSvgMarkerSymbolLayer):
-        symbolizer = _svgMarkerSymbolizer(sl, opacity)
+        symbolizer = _svgMarkerSymbolizer(sl, opacity, context)
     elif type(sl) is QgsRasterMarkerSymbolLayer:  # only support this exact class but no derived classes (e.g. QgsAnimatedMarkerSymbolLayer)
-        symbolizer = _rasterImageMarkerSymbolizer(sl, opacity)
+        symbolizer = _rasterImageMarkerSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsGeometryGeneratorSymbolLayer):
-        symbolizer = _geomGeneratorSymbolizer(sl, opacity)
+        symbolizer = _geomGeneratorSymbolizer(sl, opacity, context)
     elif isinstance(sl, QgsFontMarkerSymbolLayer):
-        symbolizer = _fontMarkerSymbolizer(sl, opacity)
+        symbolizer = _fontMarkerSymbolizer(sl, opacity, context)
 
     if symbolizer is None:
-        _warnings.append("Symbol layer type not supported: '%s'" %
+        context.warnings.append("Symbol layer type not supported: '%s'" %
                          sl.__class__.__name__)
     return symbolizer
 
 
-def _fontMarkerSymbolizer(sl, opacity):
-    symbolizer = _basePointSymbolizer(sl, opacity)
+def _fontMarkerSymbolizer(sl, opacity, context):
+    symbolizer = _basePointSymbolizer(sl, opacity, context)
     color = _toHexColor(sl.properties()["color"])
-    fontFamily = _symbolProperty(sl, "font")
+    fontFamily = _symbolProperty(sl, "font", context)
     character = str(_symbolProperty(
-        sl, "chr", QgsSymbolLayer.Property.PropertyCharacter))
-    size = _symbolProperty(sl, "size", QgsSymbolLayer.Property.PropertySize)
+        sl, "chr", context, QgsSymbolLayer.Property.PropertyCharacter))
+    size = _symbolProperty(sl, "size", context, QgsSymbolLayer.Property.PropertySize)
     if len(character) == 1:
         hexcode = hex(ord(character))
         name = "ttf://%s#%s" % (fontFamily, hexcode)
@@ -648,18 +639,18 @@ def _fontMarkerSymbolizer(sl, opacity):
     return symbolizer
 
 
-def _lineSymbolizer(sl, opacity):
+def _lineSymbolizer(sl, opacity, context):
     props = sl.properties()
     color = _toHexColor(props["line_color"])
     strokeOpacity = _opacity(props["line_color"])
     width = _symbolProperty(
-        sl, "line_width", QgsSymbolLayer.Property.PropertyStrokeWidth)
+        sl, "line_width", context, QgsSymbolLayer.Property.PropertyStrokeWidth)
     lineStyle = _symbolProperty(
-        sl, "line_style", QgsSymbolLayer.Property.PropertyStrokeStyle)
-    cap = _symbolProperty(sl, "capstyle", QgsSymbolLayer.Property.PropertyCapStyle)
+        sl, "line_style", context, QgsSymbolLayer.Property.PropertyStrokeStyle)
+    cap = _symbolProperty(sl, "capstyle", context, QgsSymbolLayer.Property.PropertyCapStyle)
     cap = "butt" if cap == "flat" else cap
-    join = _symbolProperty(sl, "joinstyle", QgsSymbolLayer.Property.PropertyJoinStyle)
-    offset = _symbolProperty(sl, "offset", QgsSymbolLayer.Property.PropertyOffset)
+    join = _symbolProperty(sl, "joinstyle", context, QgsSymbolLayer.Property.PropertyJoinStyle)
+    offset = _symbolProperty(sl, "offset", context, QgsSymbolLayer.Property.PropertyOffset)
     symbolizer = {"kind": "Line",
                   "color": color,
                   "opacity": opacity * strokeOpacity,
@@ -681,21 +672,21 @@ def _lineSymbolizer(sl, opacity):
     return symbolizer
 
 
-def _markerLineSymbolizer(sl, opacity):
-    offset = _symbolProperty(sl, "offset", QgsSymbolLayer.Property.PropertyOffset)
+def _markerLineSymbolizer(sl, opacity, context):
+    offset = _symbolProperty(sl, "offset", context, QgsSymbolLayer.Property.PropertyOffset)
     symbolizer = {"kind": "Line",
                   "opacity": opacity,
                   "perpendicularOffset": offset}
     subSymbolizers = []
     for subsl in sl.subSymbol().symbolLayers():
-        subSymbolizer = _createSymbolizer(subsl, 1)
+        subSymbolizer = _createSymbolizer(subsl, 1, context)
         if subSymbolizer is not None:
             subSymbolizers.append(subSymbolizer)
     if subSymbolizers:
         interval = _symbolProperty(
-            sl, "interval", QgsSymbolLayer.Property.PropertyInterval)
+            sl, "interval", context, QgsSymbolLayer.Property.PropertyInterval)
         offsetAlong = _symbolProperty(
-            sl, "offset_along_line", QgsSymbolLayer.Property.PropertyOffsetAlongLine)
+            sl, "offset_along_line", context, QgsSymbolLayer.Property.PropertyOffsetAlongLine)
         symbolizer["graphicStroke"] = subSymbolizers
         symbolizer["graphicStrokeInterval"] = interval
         symbolizer["graphicStrokeOffset"] = offsetAlong
@@ -703,42 +694,42 @@ def _markerLineSymbolizer(sl, opacity):
     return symbolizer
 
 
-def _geomGeneratorSymbolizer(sl, opacity):
+def _geomGeneratorSymbolizer(sl, opacity, context):
     subSymbol = sl.subSymbol()
-    symbolizers = _createSymbolizers(subSymbol, opacity)
+    symbolizers = _createSymbolizers(subSymbol, context, opacity)
     geomExp = sl.geometryExpression()
-    geom = processExpression(geomExp)
+    geom = processExpression(geomExp, context)
     for symbolizer in symbolizers:
         symbolizer["Geometry"] = geom
     return symbolizers
 
 
-def _svgMarkerSymbolizer(sl, opacity):
-    marker = _basePointSymbolizer(sl, opacity)
+def _svgMarkerSymbolizer(sl, opacity, context):
+    marker = _basePointSymbolizer(sl, opacity, context)
     color = _toHexColor(sl.properties()["color"])
     marker["color"] = color
-    svg = _markGraphic(sl)
+    svg = _markGraphic(sl, context)
     marker.update(svg)
     return marker
 
 
-def _rasterImageMarkerSymbolizer(sl, opacity):
-    marker = _basePointSymbolizer(sl, opacity)
-    img = _iconGraphic(sl)
+def _rasterImageMarkerSymbolizer(sl, opacity, context):
+    marker = _basePointSymbolizer(sl, opacity, context)
+    img = _iconGraphic(sl, context)
     marker.update(img)
     return marker
 
 
-def _simpleMarkerSymbolizer(sl, opacity):
-    marker = _basePointSymbolizer(sl, opacity)
-    mark = _markGraphic(sl)
+def _simpleMarkerSymbolizer(sl, opacity, context):
+    marker = _basePointSymbolizer(sl, opacity, context)
+    mark = _markGraphic(sl, context)
     marker.update(mark)
     return marker
 
 
-def _basePointSymbolizer(sl, opacity):
+def _basePointSymbolizer(sl, opacity, context):
     props = sl.properties()
-    rotation = _symbolProperty(sl, "angle", QgsSymbolLayer.Property.PropertyAngle)
+    rotation = _symbolProperty(sl, "angle", context, QgsSymbolLayer.Property.PropertyAngle)
     x, y = sl.offset().x(), sl.offset().y()
 
     symbolizer = {
@@ -772,21 +763,19 @@ def _createSprite(sl):
 
     return {"image": img, "image2x": img2x}
 
-def _markLineFillGraphic(sl):
-    global _usedSprites
-    
+def _markLineFillGraphic(sl, context):
     props = sl.properties()
     opacity = _opacity(props["color"])
     spriteName = ""
     name = SHAPE_NAMES["line"]
     outlineStyle = _symbolProperty(
-        sl, "outline_style", QgsSymbolLayer.PropertyStrokeStyle)
+        sl, "outline_style", context, QgsSymbolLayer.PropertyStrokeStyle)
     spriteName = name.replace(":", "_").replace("/", "_")
     # We might need to generate the same sprite in multiple colors, append color to spritename
     col = sl.color()
     spriteName += f"{col.red()}_{col.green()}_{col.blue()}_{col.alpha()}"
    
-    _usedSprites[spriteName] = _createSprite(sl)
+    context.sprites[spriteName] = _createSprite(sl)
 
     linefill = {"strokeOpacity": opacity}
     if spriteName != "":
@@ -806,15 +795,13 @@ def _markLineFillGraphic(sl):
     return linefill
 
 
-def _markGraphic(sl):
-    global _usedIcons, _usedSprites
-
+def _markGraphic(sl, context):
     props = sl.properties()
-    size = _symbolProperty(sl, "size", QgsSymbolLayer.Property.PropertySize)
+    size = _symbolProperty(sl, "size", context, QgsSymbolLayer.Property.PropertySize)
     color = _toHexColor(props["color"])
     outlineColor = _toHexColor(props["outline_color"])
     outlineWidth = _symbolProperty(
-        sl, "outline_width", QgsSymbolLayer.Property.PropertyStrokeWidth)
+        sl, "outline_width", context, QgsSymbolLayer.Property.PropertyStrokeWidth)
     fillOpacity = _opacity(props["color"])
     strokeOpacity = _opacity(props["outline_color"])
     spriteName = ""
@@ -822,19 +809,19 @@ def _markGraphic(sl):
         path = sl.path()
         name = os.path.basename(path)
         spriteName = name.replace(":", "_").replace("/", "_")
-        _usedIcons[sl.path()] = sl
-        _usedSprites[spriteName] = _createSprite(sl)
+        context.icons[sl.path()] = sl
+        context.sprites[spriteName] = _createSprite(sl)
         outlineStyle = "solid"
-        size = _symbolProperty(sl, "size", QgsSymbolLayer.Property.PropertyWidth)
+        size = _symbolProperty(sl, "size", context, QgsSymbolLayer.Property.PropertyWidth)
     except:
         name = props["name"]
         name = SHAPE_NAMES.get(name, name.replace("_", ""))
         outlineStyle = _symbolProperty(
-            sl, "outline_style", QgsSymbolLayer.Property.PropertyStrokeStyle)
+            sl, "outline_style", context, QgsSymbolLayer.Property.PropertyStrokeStyle)
         if outlineStyle == "no":
             outlineWidth = 0
         spriteName = name.replace(":", "_").replace("/", "_")
-        _usedSprites[spriteName] = _createSprite(sl)
+        context.sprites[spriteName] = _createSprite(sl)
 
     mark = {"kind": "Mark",
             "color": color,
@@ -874,11 +861,10 @@ def _markFillPattern(shape, color, size=FIXED_PATTERN_SIZE, strokeWidth=1, rotat
             }
 
 
-def _iconGraphic(sl, color=None):
-    global _usedIcons
-    _usedIcons[sl.path()] = sl
+def _iconGraphic(sl, context, color=None):
+    context.icons[sl.path()] = sl
     path = os.path.basename(sl.path())
-    size = _symbolProperty(sl, "size", QgsSymbolLayer.Property.PropertySize)
+    size = _symbolProperty(sl, "size", context, QgsSymbolLayer.Property.PropertySize)
     return {"kind": "Icon",
             "color": color,
             "image": path,
@@ -891,15 +877,15 @@ def _baseFillSymbolizer(sl, opacity):
             "opacity": opacity}
 
 
-def _linePatternFillSymbolizer(sl, opacity):
+def _linePatternFillSymbolizer(sl, opacity, context):
     symbolizer = _baseFillSymbolizer(sl, opacity)
     color = sl.color().name()
-    strokeWidth = _symbolProperty(sl, "line_width")
-    size = _symbolProperty(sl, "distance", QgsSymbolLayer.Property.PropertyLineDistance)
-    rotation = _symbolProperty(sl, "angle", QgsSymbolLayer.Property.PropertyLineAngle)
+    strokeWidth = _symbolProperty(sl, "line_width", context)
+    size = _symbolProperty(sl, "distance", context, QgsSymbolLayer.Property.PropertyLineDistance)
+    rotation = _symbolProperty(sl, "angle", context, QgsSymbolLayer.Property.PropertyLineAngle)
     marker = _hatchMarkerForAngle(rotation)
     subSymbolizer = _markFillPattern(marker, color, size, strokeWidth, 0)
-    subSymbolizer.update(_markLineFillGraphic(sl))
+    subSymbolizer.update(_markLineFillGraphic(sl, context))
     symbolizer["graphicFill"] = [subSymbolizer]
     return symbolizer
 
@@ -909,18 +895,18 @@ def _hatchMarkerForAngle(angle):
     return ["shape://vertline", "shape://slash", "shape://horline", "shape://backslash"][quadrant]
 
 
-def _pointPatternFillSymbolizer(sl, opacity):
+def _pointPatternFillSymbolizer(sl, opacity, context):
     symbolizer = _baseFillSymbolizer(sl, opacity)
     subSymbolizers = []
     for subsl in sl.subSymbol().symbolLayers():
-        subSymbolizer = _createSymbolizer(subsl, 1)
+        subSymbolizer = _createSymbolizer(subsl, 1, context)
         if subSymbolizers is not None:
             subSymbolizers.append(subSymbolizer)
     if subSymbolizers:
         distancex = _symbolProperty(
-            sl, "distance_x", QgsSymbolLayer.Property.PropertyDistanceX)
+            sl, "distance_x", context, QgsSymbolLayer.Property.PropertyDistanceX)
         distancey = _symbolProperty(
-            sl, "distance_y", QgsSymbolLayer.Property.PropertyDistanceY)
+            sl, "distance_y", context, QgsSymbolLayer.Property.PropertyDistanceY)
         symbolizer["graphicFill"] = subSymbolizers
         distancex = ["Div", distancex, 2] if isinstance(
             distancex, list) else distancex / 2.0
@@ -932,7 +918,7 @@ def _pointPatternFillSymbolizer(sl, opacity):
     return symbolizer
 
 
-def _simpleFillSymbolizer(sl, opacity):
+def _simpleFillSymbolizer(sl, opacity, context):
     props = sl.properties()
     style = props["style"]
 
@@ -954,11 +940,11 @@ def _simpleFillSymbolizer(sl, opacity):
     outlineColor = _toHexColor(props["outline_color"])
     outlineOpacity = _opacity(props["outline_color"])
     outlineStyle = _symbolProperty(
-        sl, "outline_style", QgsSymbolLayer.Property.PropertyStrokeStyle)
-    join = _symbolProperty(sl, "joinstyle", QgsSymbolLayer.Property.PropertyJoinStyle)
+        sl, "outline_style", context, QgsSymbolLayer.Property.PropertyStrokeStyle)
+    join = _symbolProperty(sl, "joinstyle", context, QgsSymbolLayer.Property.PropertyJoinStyle)
     if outlineStyle != "no":
         outlineWidth = _symbolProperty(
-            sl, "outline_width", QgsSymbolLayer.Property.PropertyStrokeWidth)
+            sl, "outline_width", context, QgsSymbolLayer.Property.PropertyStrokeWidth)
         symbolizer.update({"outlineColor": outlineColor,
                            "outlineWidth": outlineWidth,
                            "outlineOpacity": outlineOpacity,
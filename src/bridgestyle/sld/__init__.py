@@ -3,7 +3,7 @@ from . import togeostyler
 
 
 def toGeostyler(style, options=None):
-    return togeostyler.convert(style, options)  # TODO
+    return togeostyler.convert(style, options)
 
 
 def fromGeostyler(style, options=None):
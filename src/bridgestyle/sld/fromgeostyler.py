@@ -1,57 +1,244 @@
+import io
 import os
 from re import compile
-from xml.dom import minidom
-from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, SubElement
 
-from ..qgis.expressions import (
+from ..geostyler.constants import (
     OGC_PROPERTYNAME,
     OGC_IS_EQUAL_TO,
     OGC_IS_NULL,
     OGC_IS_LIKE
 )
 from .transformations import processTransformation
+from .xmlwriter import XmlWriter, createCDATA
+from ..context import ConversionContext
+from ..expressioncache import expressionCache
+from ..geostyler.expressions import combine, isLiteral, translate, valueRange, valueSet
 from ..version import __version__
 from ..geostyler.custom_properties import WellKnownText
 
 REGEX_NONWORDCHARS = compile(r'\W')
 
-_warnings = []
-
 
 def convert(geostyler, options=None):
-    global _warnings
-    _warnings = []
+    output = io.StringIO()
+    warnings = write(geostyler, output, options)
+    return output.getvalue(), warnings
+
+
+def write(geostyler, fp, options=None):
+    """ Writes the SLD for a GeoStyler style to a file-like object and returns the list of warnings.
+
+    Rules are converted and written one at a time. Text streams receive str, other file-like objects
+    (e.g. a file opened in "wb" mode or BytesIO) receive UTF-8 encoded bytes.
+    Set the "compact" option to write the SLD without any indentation or line breaks, and the "mergerules" option
+    to merge the rules of value and range classes (see mergeRules()).
+    """
+    context = ConversionContext(options)
+    with context.span("sld"):
+        _write(geostyler, fp, context)
+    return context.warnings
+
+
+def _write(geostyler, fp, context):
     attribs = {
-        "version": "1.0.0",
-        "xsi:schemaLocation": "http://schemas.opengis.net/sld/1.0.0/StyledLayerDescriptor.xsd",
         "xmlns": "http://www.opengis.net/sld",
         "xmlns:ogc": "http://www.opengis.net/ogc",
         "xmlns:xlink": "http://www.w3.org/1999/xlink",
         "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
+        "version": "1.0.0",
+        "xsi:schemaLocation": "http://schemas.opengis.net/sld/1.0.0/StyledLayerDescriptor.xsd",
     }
 
-    root = Element("StyledLayerDescriptor", attrib=attribs)
-    namedLayer = SubElement(root, "NamedLayer")
-    layerName = SubElement(namedLayer, "Name")
+    writer = XmlWriter(fp, compact=context.options.get("compact", False))
+    writer.declaration()
+    writer.start("StyledLayerDescriptor", attribs)
+    writer.comment(f'Generated by bridge_style ({__version__})')
+    writer.start("NamedLayer")
+    layerName = Element("Name")
     layerName.text = _replaceSpecialCharacters('_', geostyler.get("name", "default"))
-    userStyle = SubElement(namedLayer, "UserStyle")
-    userStyleTitle = SubElement(userStyle, "Title")
+    writer.element(layerName)
+    writer.start("UserStyle")
+    userStyleTitle = Element("Title")
     userStyleTitle.text = geostyler.get("name")
+    writer.element(userStyleTitle)
 
-    featureTypeStyle = SubElement(userStyle, "FeatureTypeStyle")
+    writer.start("FeatureTypeStyle")
     if "transformation" in geostyler:
-        featureTypeStyle.append(processTransformation(geostyler["transformation"]))
-    for rule in geostyler.get("rules", []):
-        featureTypeStyle.append(processRule(rule))
+        writer.element(processTransformation(geostyler["transformation"]))
+    rules = geostyler.get("rules", [])
+    if context.options.get("mergerules"):
+        with context.span("sld.merge"):
+            rules = mergeRules(rules)
+    for rule in rules:
+        with context.span("sld.rule", rule):
+            writer.element(processRule(rule))
     if "blendMode" in geostyler:
-        _addVendorOption(featureTypeStyle, "composite", geostyler["blendMode"])
+        writer.element(_createVendorOption("composite", geostyler["blendMode"]))
+    writer.end()  # FeatureTypeStyle
+    writer.end()  # UserStyle
+    writer.end()  # NamedLayer
+    writer.end()  # StyledLayerDescriptor
+
+
+# Symbolizer properties that are written as expressions, and so may differ between the rules merged by mergeRules()
+MERGEABLE_PROPERTIES = {"color", "width", "size", "outlineColor", "outlineWidth", "strokeColor", "strokeWidth"}
+
+
+def mergeRules(rules):
+    """ Merges consecutive rules that only differ in their filter and in literal symbolizer properties, such as the
+    classes of a unique value or class breaks renderer, into a single rule.
+
+    The filters of the merged rules must test the same attribute for disjoint sets of values, or for adjacent
+    ranges. The properties that differ are written as "Recode" (values) or "Categorize" (ranges) functions of the
+    attribute, and the merged rule gets a filter for the union of the values or ranges, so that GeoServer evaluates
+    a single filter per feature instead of one per class. ELSE rules and rules that can't be merged are kept as
+    they are. Legends show a single entry for a merged rule.
+    """
+    merged = []
+    group = None
+    for rule in rules:
+        key = _ruleKey(rule)
+        if group is not None and key is not None and _canMerge(group, rule, key):
+            _addToGroup(group, rule, key[2])
+            continue
+        if group is not None:
+            merged.append(_mergeGroup(group))
+        if key is None:
+            merged.append(rule)
+            group = None
+        else:
+            group = _newGroup(rule, key)
+    if group is not None:
+        merged.append(_mergeGroup(group))
+    return merged
+
+
+def _ruleKey(rule):
+    # ("values", attribute, values) or ("range", attribute, bounds) for the filter of the rule
+    filt = rule.get("filter")
+    if filt is None or filt == "ELSE":
+        return None
+    values = valueSet(filt)
+    if values is not None:
+        return ("values",) + values
+    bounds = valueRange(filt)
+    if bounds is not None:
+        return ("range",) + bounds
+    return None
+
+
+def _rangeModes(bounds):
+    # The Categorize modes that fit a range: "preceding" if its thresholds belong to the lower class
+    low, lowInclusive, high, highInclusive = bounds
+    modes = set()
+    if (low is None or not lowInclusive) and (high is None or highInclusive):
+        modes.add("preceding")
+    if (low is None or lowInclusive) and (high is None or not highInclusive):
+        modes.add("succeeding")
+    return modes
+
 
-    root.insert(0, ElementTree.Comment(f'Generated by bridge_style ({__version__})'))
-    sldstring = ElementTree.tostring(root, encoding="utf-8", method="xml").decode()
-    dom = minidom.parseString(sldstring)
-    result = dom.toprettyxml(indent="  ", encoding="utf-8").decode(), _warnings
-    return result
+def _newGroup(rule, key):
+    kind, attribute, data = key
+    group = {"kind": kind, "attribute": attribute, "rules": [rule], "data": [data]}
+    if kind == "values":
+        group["values"] = set(data)
+    else:
+        group["low"], group["high"] = data[0], data[2]
+        group["modes"] = _rangeModes(data)
+    return group
+
+
+def _addToGroup(group, rule, data):
+    group["rules"].append(rule)
+    group["data"].append(data)
+    if group["kind"] == "values":
+        group["values"].update(data)
+    else:
+        if data[0] is not None and data[0] == group["high"]:
+            group["high"] = data[2]
+        else:
+            group["low"] = data[0]
+        group["modes"] &= _rangeModes(data)
+
+
+def _canMerge(group, rule, key):
+    kind, attribute, data = key
+    if kind != group["kind"] or attribute != group["attribute"] or not _sameSymbols(group["rules"][0], rule):
+        return False
+    if kind == "values":
+        return group["values"].isdisjoint(data)
+    low, _, high, _ = data
+    adjacent = ((low is not None and low == group["high"])
+                or (high is not None and high == group["low"]))
+    return adjacent and bool(group["modes"] & _rangeModes(data))
+
+
+def _otherProperties(rule):
+    return {name: value for name, value in rule.items() if name not in ("name", "filter", "symbolizers")}
+
+
+def _sameSymbols(first, rule):
+    if _otherProperties(first) != _otherProperties(rule):
+        return False
+    symbolizers = first.get("symbolizers", [])
+    others = rule.get("symbolizers", [])
+    if len(symbolizers) != len(others):
+        return False
+    for symbolizer, other in zip(symbolizers, others):
+        if symbolizer.keys() != other.keys():
+            return False
+        for name, value in symbolizer.items():
+            if value != other[name] and not (name in MERGEABLE_PROPERTIES
+                                             and isLiteral(value) and isLiteral(other[name])):
+                return False
+    return True
+
+
+def _mergeGroup(group):
+    rules = group["rules"]
+    if len(rules) == 1:
+        return rules[0]
+    data = group["data"]
+    prop = [OGC_PROPERTYNAME, group["attribute"]]
+    if group["kind"] == "values":
+        filt = [OGC_IS_EQUAL_TO, ["in", prop] + [v for values in data for v in values], "true"]
+
+        def function(outputs):
+            args = ["Recode", prop]
+            for values, output in zip(data, outputs):
+                for v in values:
+                    args.extend((v, output))
+            return args
+    else:
+        order = sorted(range(len(rules)), key=lambda i: (data[i][0] is not None, data[i][0]))
+        low, lowInclusive = data[order[0]][:2]
+        high, highInclusive = data[order[-1]][2:]
+        bounds = []
+        if low is not None:
+            bounds.append(["PropertyIsGreaterThanOrEqualTo" if lowInclusive else "PropertyIsGreaterThan", prop, low])
+        if high is not None:
+            bounds.append(["PropertyIsLessThanOrEqualTo" if highInclusive else "PropertyIsLessThan", prop, high])
+        filt = combine("And", bounds) if bounds else ["Not", [OGC_IS_NULL, prop]]
+        mode = "preceding" if "preceding" in group["modes"] else "succeeding"
+
+        def function(outputs):
+            args = ["Categorize", prop, outputs[order[0]]]
+            for i in order[1:]:
+                args.extend((data[i][0], outputs[i]))
+            args.append(mode)
+            return args
+
+    symbolizers = []
+    for i, symbolizer in enumerate(rules[0]["symbolizers"]):
+        symbolizer = dict(symbolizer)
+        for name, value in list(symbolizer.items()):
+            outputs = [rule["symbolizers"][i][name] for rule in rules]
+            if any(output != value for output in outputs):
+                symbolizer[name] = function(outputs)
+        symbolizers.append(symbolizer)
+    return dict(rules[0], name=group["attribute"], filter=filt, symbolizers=symbolizers)
 
 
 def processRule(rule):
@@ -166,6 +353,12 @@ def _addSubElement(parent, tag, value=None, attrib={}):
     return sub
 
 
+def _createVendorOption(name, value):
+    element = Element("VendorOption", name=name)
+    _addValueToElement(element, value)
+    return element
+
+
 def _addVendorOption(parent, name, value):
     if value is not None:
         sub = SubElement(parent, "VendorOption", name=name)
@@ -296,7 +489,7 @@ def _textSymbolizer(sl):
 
 def _lineSymbolizer(sl, graphicStrokeLayer=0):
     opacity = _symbolProperty(sl, "opacity")
-    color = sl.get("color", None)
+    color = _symbolProperty(sl, "color")
     graphicStroke = sl.get("graphicStroke", None)
     width = _symbolProperty(sl, "width")
     dasharray = _symbolProperty(sl, "dasharray")
@@ -473,7 +666,7 @@ def _fillSymbolizer(sl, graphicFillLayer=0):
     root = _baseFillSymbolizer(sl)
     symbolizers = [root]
     opacity = float(_symbolProperty(sl, "opacity", 1))
-    color = sl.get("color", None)
+    color = _symbolProperty(sl, "color")
     graphicFill = sl.get("graphicFill", None)
     offset = sl.get("offset", None)
     margin = sl.get("graphicFillMargin")
@@ -555,18 +748,39 @@ operatorToFunction = {
 
 
 def convertExpression(exp, inFunction=False):
-    if exp is None:
-        return None
-    elif isinstance(exp, list):
-        if exp[0] in expression_keys and not (inFunction and exp[0] in operatorToFunction):
-            return handleOperator(exp)
-        else:
-            return handleFunction(exp)
-    else:
-        return handleLiteral(exp)
+    if not isinstance(exp, list) or exp[0] == OGC_PROPERTYNAME:
+        # Literals and attribute names are cheaper to translate than to look up
+        return _convertExpression(exp, inFunction)
+    return expressionCache.translate("sld", exp, _convertExpression, None, inFunction)
+
+
+def _convertExpression(exp, inFunction=False):
+    return translate(exp, _expandExpression, _convertLiteral, inFunction)
+
+
+def _expandExpression(exp, inFunction):
+    if exp[0] in expression_keys and not (inFunction and exp[0] in operatorToFunction):
+        if exp[0] == OGC_PROPERTYNAME:
+            return (), False, handleOperator
+        # Operands of operators are not function arguments, even within a function
+        return _operands(exp), False, handleOperator
+    if exp[0] == "to_string" and len(exp) == 2:
+        return (), True, handleFunction
+    return _operands(exp), True, handleFunction
+
 
+def _operands(exp):
+    operands = exp[1:]
+    if None in operands:
+        return [operand for operand in operands if operand is not None]
+    return operands
 
-def handleOperator(exp):
+
+def _convertLiteral(v, inFunction):
+    return None if v is None else handleLiteral(v)
+
+
+def handleOperator(exp, operands):
     name = exp[0]
     elem = Element("ogc:" + name)
     if name == OGC_IS_LIKE:
@@ -574,24 +788,17 @@ def handleOperator(exp):
     if name == OGC_PROPERTYNAME:
         elem.text = exp[1]
     else:
-        for operand in exp[1:]:
-            if operand is None:
-                continue
-            elem.append(convertExpression(operand))
+        elem.extend(operands)
     return elem
 
 
-def handleFunction(exp):
+def handleFunction(exp, args):
     name = operatorToFunction.get(exp[0], exp[0])
     if name == "to_string" and len(exp) == 2:
         # Special case: SLD/OGC does not know a "cast to string" function
         return handleLiteral(exp[1])
     elem = Element("ogc:Function", name=name)
-    if len(exp) > 1:
-        for arg in exp[1:]:
-            if arg is None:
-                continue
-            elem.append(convertExpression(arg, True))
+    elem.extend(args)
     return elem
 
 
@@ -610,9 +817,3 @@ def handleSpecialLiteral(v):
         elem.append(createCDATA("\n"))
         return elem
     return None
-
-
-def createCDATA(text=None):
-    element = Element("![CDATA[")
-    element.text = text
-    return element
@@ -1,2 +1,462 @@
-def convert(geostyler, options=None):
-    return {}, []
+""" Reads SLD 1.0 and SE 1.1 styles.
+
+The document is read with ElementTree.iterparse(): each Rule is converted as soon as it has been parsed and is then
+removed from the tree, as are the other finished children of the layer and style elements. Only the rule being read
+is held in memory, so the memory use does not grow with the size of the document.
+
+Elements are matched by their local names, whatever their namespace, so that both SLD 1.0 (sld: and ogc: elements)
+and SE 1.1 (se: elements, SvgParameter instead of CssParameter) documents are read.
+"""
+import io
+import re
+from xml.etree.ElementTree import iterparse
+
+from ..context import ConversionContext
+from ..geostyler.constants import OGC_CONCAT, OGC_IS_LIKE, OGC_PROPERTYNAME
+from ..geostyler.custom_properties import WellKnownText
+from ..geostyler.expressions import combine, simplifyRules
+from .fromgeostyler import expression_keys, operatorToFunction
+
+XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+
+# Elements whose finished children are removed from the tree
+_CONTAINERS = {"StyledLayerDescriptor", "NamedLayer", "UserLayer", "UserStyle", "FeatureTypeStyle"}
+
+# Numbers with leading zeros (such as codes) are kept as strings
+_NUMBER = re.compile(r"^[+-]?((0|[1-9]\d*)(\.\d*)?|\.\d+)([eE][+-]?\d+)?$")
+
+_functionToOperator = {function: operator for operator, function in operatorToFunction.items()}
+
+
+def convert(sld, options=None):
+    """ Converts an SLD, given as a string, to a GeoStyler style. Returns ``(geostyler, icons, warnings)``.
+    Use convertFile() for a file, which is then read as it is parsed. """
+    if isinstance(sld, bytes):
+        return convertFile(io.BytesIO(sld), options)
+    return convertFile(io.StringIO(sld), options)
+
+
+def convertFile(source, options=None):
+    """ Converts an SLD file, given as a file name or a file-like object, to a GeoStyler style.
+    Returns ``(geostyler, icons, warnings)``. Only the first style of the document is converted. """
+    context = ConversionContext(options)
+    with context.span("togeostyler"):
+        geostyler = _read(source, context)
+        if context.options.get("simplify", True):
+            with context.span("togeostyler.simplify"):
+                simplifyRules(geostyler["rules"])
+    return geostyler, [], context.warnings
+
+
+_localNames = {}
+
+
+def _localName(tag):
+    name = _localNames.get(tag)
+    if name is None:
+        name = _localNames[tag] = tag.rsplit("}", 1)[-1]
+    return name
+
+
+def _read(source, context):
+    geostyler = {"rules": []}
+    names = {}
+    elements = []
+    path = []
+    layers = styles = 0
+    ruleDepth = 0
+    for event, elem in iterparse(source, events=("start", "end")):
+        if ruleDepth:
+            # The elements within a rule are converted with the rule, once it ends
+            ruleDepth += 1 if event == "start" else -1
+            if ruleDepth:
+                continue
+        name = _localName(elem.tag)
+        if event == "start":
+            if name == "Rule":
+                ruleDepth = 1
+            if name in ("NamedLayer", "UserLayer"):
+                layers += 1
+            elif name == "UserStyle":
+                styles += 1
+                if styles == 2:
+                    context.warnings.append("Only the first style of the SLD has been converted")
+            elements.append(elem)
+            path.append(name)
+            continue
+
+        elements.pop()
+        path.pop()
+        parent = path[-1] if path else None
+        if layers > 1 or styles > 1:
+            pass
+        elif name == "Rule" and parent == "FeatureTypeStyle":
+            with context.span("togeostyler.rule"):
+                rule = processRule(elem, context)
+            if rule is not None:
+                geostyler["rules"].append(rule)
+        elif name in ("Name", "Title") and parent in ("NamedLayer", "UserLayer", "UserStyle"):
+            names.setdefault((parent, name), (elem.text or "").strip())
+        elif name == "Transformation" and parent == "FeatureTypeStyle":
+            transformation = _transformation(elem, context)
+            if transformation is not None:
+                geostyler["transformation"] = transformation
+        elif name == "VendorOption" and parent == "FeatureTypeStyle" and elem.get("name") == "composite":
+            geostyler["blendMode"] = (elem.text or "").strip()
+        if parent in _CONTAINERS:
+            elements[-1].remove(elem)
+
+    for key in (("UserStyle", "Title"), ("UserStyle", "Name"), ("NamedLayer", "Name"), ("UserLayer", "Name")):
+        if names.get(key):
+            geostyler["name"] = names[key]
+            break
+    else:
+        geostyler["name"] = "style"
+    return geostyler
+
+
+def _children(elem):
+    # Local name -> first child element with that name
+    children = {}
+    for child in elem:
+        children.setdefault(_localName(child.tag), child)
+    return children
+
+
+def _text(elem):
+    return (elem.text or "").strip() if elem is not None else None
+
+
+def _literal(text):
+    if text == "\n":
+        return WellKnownText.NEW_LINE
+    stripped = text.strip()
+    if _NUMBER.match(stripped):
+        if stripped.lstrip("+-").isdigit():
+            return int(stripped)
+        return float(stripped)
+    return text
+
+
+def processRule(elem, context):
+    """ Returns the GeoStyler rule for an SLD rule, or None if its filter is not supported: the rule would
+    otherwise apply to more features than it does in the SLD. """
+    rule = {}
+    scale = {}
+    symbolizers = []
+    title = None
+    for child in elem:
+        name = _localName(child.tag)
+        if name == "Name":
+            rule["name"] = _text(child)
+        elif name == "Title":
+            title = _text(child)
+        elif name == "Description":
+            title = _text(_children(child).get("Title")) or title
+        elif name == "Filter":
+            if len(child):
+                filt = convertExpression(child[0], context)
+                if filt is None:
+                    name = _text(_children(elem).get("Name")) or ""
+                    context.warnings.append(f"Skipped rule with an unsupported filter: '{name}'")
+                    return None
+                rule["filter"] = filt
+        elif name == "ElseFilter":
+            rule["filter"] = "ELSE"
+        elif name == "MinScaleDenominator":
+            scale["min"] = _literal(_text(child))
+        elif name == "MaxScaleDenominator":
+            scale["max"] = _literal(_text(child))
+        elif name in _symbolizers:
+            symbolizer = _symbolizers[name](child, context)
+            if symbolizer is not None:
+                symbolizers.append(symbolizer)
+        elif name not in ("LegendGraphic", "Abstract"):
+            context.warnings.append(f"Unsupported rule element: '{name}'")
+    # Rules written by bridgestyle have the original rule name as title
+    rule["name"] = title or rule.get("name") or ""
+    if scale:
+        rule["scaleDenominator"] = scale
+    rule["symbolizers"] = symbolizers
+    return rule
+
+
+def _value(elem, context):
+    # A parameter value: text, an expression, or a mix of both (concatenated)
+    if elem is None:
+        return None
+    parts = []
+    if elem.text and elem.text.strip():
+        parts.append(elem.text)
+    for child in elem:
+        value = convertExpression(child, context)
+        if value is not None:
+            parts.append(value)
+        if child.tail and child.tail.strip():
+            parts.append(child.tail)
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return _literal(parts[0].strip()) if isinstance(parts[0], str) else parts[0]
+    return [OGC_CONCAT] + [_literal(p) if isinstance(p, str) else p for p in parts]
+
+
+def _parameters(elem, context):
+    # CssParameter (SLD 1.0) or SvgParameter (SE 1.1) name -> value
+    parameters = {}
+    if elem is not None:
+        for child in elem:
+            if _localName(child.tag) in ("CssParameter", "SvgParameter"):
+                parameters[child.get("name")] = _value(child, context)
+    return parameters
+
+
+def _addParameters(sl, parameters, names):
+    for parameter, key in names.items():
+        if parameters.get(parameter) is not None:
+            sl[key] = parameters[parameter]
+
+
+def _addValues(sl, children, names, context):
+    for tag, key in names.items():
+        value = _value(children.get(tag), context)
+        if value is not None:
+            sl[key] = value
+
+
+def _displacement(elem, context):
+    children = _children(elem)
+    return [_value(children.get("DisplacementX"), context) or 0,
+            _value(children.get("DisplacementY"), context) or 0]
+
+
+_strokeParameters = {"stroke": "color", "stroke-width": "width", "stroke-opacity": "opacity",
+                     "stroke-linejoin": "join", "stroke-linecap": "cap", "stroke-dasharray": "dasharray"}
+_outlineParameters = {"stroke": "outlineColor", "stroke-width": "outlineWidth", "stroke-opacity": "outlineOpacity",
+                      "stroke-dasharray": "outlineDasharray"}
+_markStrokeParameters = {"stroke": "strokeColor", "stroke-width": "strokeWidth", "stroke-opacity": "strokeOpacity",
+                         "stroke-dasharray": "outlineDasharray"}
+_fillParameters = {"fill": "color", "fill-opacity": "fillOpacity"}
+
+
+def _lineSymbolizer(elem, context):
+    sl = {"kind": "Line"}
+    children = _children(elem)
+    stroke = children.get("Stroke")
+    parameters = _parameters(stroke, context)
+    graphicStroke = _children(stroke).get("GraphicStroke") if stroke is not None else None
+    if graphicStroke is not None:
+        graphic = _graphic(_children(graphicStroke).get("Graphic"), context)
+        if graphic is not None:
+            sl["graphicStroke"] = [graphic]
+            # The dash array of a graphic stroke is the graphic size and the interval between graphics
+            dasharray = str(parameters.get("stroke-dasharray", "")).split()
+            if len(dasharray) == 2:
+                sl["graphicStrokeInterval"] = _literal(dasharray[1])
+            if parameters.get("stroke-dashoffset") is not None:
+                sl["graphicStrokeOffset"] = parameters["stroke-dashoffset"]
+    else:
+        sl.update({"color": "#000000", "width": 1, "opacity": 1.0})
+        _addParameters(sl, parameters, _strokeParameters)
+    _addValues(sl, children, {"PerpendicularOffset": "perpendicularOffset"}, context)
+    return sl
+
+
+def _polygonSymbolizer(elem, context):
+    sl = {"kind": "Fill", "opacity": 1.0}
+    children = _children(elem)
+    fill = children.get("Fill")
+    if fill is not None:
+        graphicFill = _children(fill).get("GraphicFill")
+        if graphicFill is not None:
+            graphic = _graphic(_children(graphicFill).get("Graphic"), context)
+            if graphic is not None:
+                sl["graphicFill"] = [graphic]
+        else:
+            sl.update({"color": "#808080", "fillOpacity": 1.0})
+            _addParameters(sl, _parameters(fill, context), _fillParameters)
+    stroke = children.get("Stroke")
+    if stroke is not None:
+        sl.update({"outlineColor": "#000000", "outlineWidth": 1, "outlineOpacity": 1.0})
+        _addParameters(sl, _parameters(stroke, context), _outlineParameters)
+    return sl
+
+
+def _pointSymbolizer(elem, context):
+    return _graphic(_children(elem).get("Graphic"), context)
+
+
+def _graphic(elem, context):
+    # Mark or Icon symbolizer of a Graphic. Only its first mark or external graphic is used
+    if elem is None:
+        return None
+    children = _children(elem)
+    for child in elem:
+        name = _localName(child.tag)
+        if name == "Mark":
+            sl = _mark(child, context)
+            break
+        if name == "ExternalGraphic":
+            sl = _externalGraphic(child, context)
+            break
+    else:
+        sl = {"kind": "Mark", "wellKnownName": "square", "color": "#808080", "fillOpacity": 1.0,
+              "strokeColor": "#000000", "strokeWidth": 1, "strokeOpacity": 1.0}
+    _addValues(sl, children, {"Opacity": "opacity", "Size": "size", "Rotation": "rotate"}, context)
+    if "Displacement" in children:
+        sl["offset"] = _displacement(children["Displacement"], context)
+    return sl
+
+
+def _mark(elem, context):
+    children = _children(elem)
+    sl = {"kind": "Mark", "wellKnownName": _value(children.get("WellKnownName"), context) or "square"}
+    if "Fill" in children:
+        sl.update({"color": "#808080", "fillOpacity": 1.0})
+        _addParameters(sl, _parameters(children["Fill"], context), _fillParameters)
+    else:
+        sl["fillOpacity"] = 0.0
+    parameters = _parameters(children.get("Stroke"), context)
+    if parameters:
+        sl.update({"strokeColor": "#000000", "strokeWidth": 1, "strokeOpacity": 1.0})
+        _addParameters(sl, parameters, _markStrokeParameters)
+    else:
+        sl["strokeOpacity"] = 0.0
+    return sl
+
+
+def _externalGraphic(elem, context):
+    children = _children(elem)
+    resource = children.get("OnlineResource")
+    sl = {"kind": "Icon", "image": resource.get(XLINK_HREF, "") if resource is not None else ""}
+    if "Format" in children:
+        sl["format"] = _text(children["Format"])
+    return sl
+
+
+def _textSymbolizer(elem, context):
+    sl = {"kind": "Text", "color": "#000000"}
+    children = _children(elem)
+    _addValues(sl, children, {"Label": "label"}, context)
+    _addParameters(sl, _parameters(children.get("Font"), context), {"font-family": "font", "font-size": "size"})
+    _addParameters(sl, _parameters(children.get("Fill"), context), {"fill": "color"})
+    if "Halo" in children:
+        halo = _children(children["Halo"])
+        sl.update({"haloColor": "#FFFFFF", "haloOpacity": 1.0, "haloSize": 1})
+        _addValues(sl, halo, {"Radius": "haloSize"}, context)
+        _addParameters(sl, _parameters(halo.get("Fill"), context), {"fill": "haloColor", "fill-opacity": "haloOpacity"})
+    placement = _children(children["LabelPlacement"]) if "LabelPlacement" in children else {}
+    if "PointPlacement" in placement:
+        point = _children(placement["PointPlacement"])
+        if "AnchorPoint" in point:
+            _addValues(sl, _children(point["AnchorPoint"]),
+                       {"AnchorPointX": "anchorPointX", "AnchorPointY": "anchorPointY"}, context)
+        sl["offset"] = _displacement(point["Displacement"], context) if "Displacement" in point else [0, 0]
+        _addValues(sl, point, {"Rotation": "rotate"}, context)
+    elif "LinePlacement" in placement:
+        _addValues(sl, _children(placement["LinePlacement"]), {"PerpendicularOffset": "perpendicularOffset"}, context)
+    for child in elem:
+        if _localName(child.tag) == "VendorOption":
+            if child.get("name") == "followLine":
+                sl["followLine"] = _text(child) == "true"
+            elif child.get("name") == "group":
+                sl["group"] = _text(child) in ("yes", "true")
+    return sl
+
+
+def _rasterSymbolizer(elem, context):
+    sl = {"kind": "Raster", "opacity": 1.0, "channelSelection": {}}
+    children = _children(elem)
+    _addValues(sl, children, {"Opacity": "opacity"}, context)
+    if "ChannelSelection" in children:
+        for channel in children["ChannelSelection"]:
+            name = _localName(channel.tag)
+            sourceChannel = _text(_children(channel).get("SourceChannelName"))
+            sl["channelSelection"][name[0].lower() + name[1:]] = {"sourceChannelName": sourceChannel}
+    if "ColorMap" in children:
+        colorMap = children["ColorMap"]
+        entries = [{"color": entry.get("color", "#000000"),
+                    "quantity": float(entry.get("quantity", 0)),
+                    "label": entry.get("label", ""),
+                    "opacity": float(entry.get("opacity", 1))}
+                   for entry in colorMap if _localName(entry.tag) == "ColorMapEntry"]
+        sl["colorMap"] = {"type": colorMap.get("type", "ramp"), "colorMapEntries": entries}
+    return sl
+
+
+_symbolizers = {
+    "LineSymbolizer": _lineSymbolizer,
+    "PolygonSymbolizer": _polygonSymbolizer,
+    "PointSymbolizer": _pointSymbolizer,
+    "TextSymbolizer": _textSymbolizer,
+    "RasterSymbolizer": _rasterSymbolizer,
+}
+
+
+def _transformation(elem, context):
+    function = elem[0] if len(elem) else None
+    if function is None or function.get("name") != "vec:Heatmap":
+        context.warnings.append("Unsupported rendering transformation: '%s'"
+                                % (function.get("name") if function is not None else ""))
+        return None
+    transformation = {"type": "vec:Heatmap"}
+    for parameter in function:
+        args = [_literal(arg.text or "") for arg in parameter if _localName(arg.tag) == "Literal"]
+        if len(args) == 2 and args[0] in ("weightAttr", "radiusPixels"):
+            transformation[args[0]] = args[1]
+    return transformation
+
+
+#######################
+
+# Marks the conversion of an unsupported element, which makes the expressions that contain it unsupported too
+_UNSUPPORTED = object()
+
+
+def convertExpression(elem, context):
+    """ Converts an OGC filter or expression element to a GeoStyler expression, the reverse of
+    fromgeostyler.convertExpression(). Expressions with unsupported elements are converted to None,
+    with a warning. """
+    stack = []
+    args = []
+    children = iter(elem)
+    while True:
+        for child in children:
+            # Continue with this element once the child has been converted
+            stack.append((elem, children, args))
+            elem, children, args = child, iter(child), []
+            break
+        else:
+            value = _UNSUPPORTED if _UNSUPPORTED in args else _convertElement(elem, args, context)
+            if not stack:
+                return None if value is _UNSUPPORTED else value
+            elem, children, args = stack.pop()
+            args.append(value)
+
+
+def _convertElement(elem, args, context):
+    name = _localName(elem.tag)
+    if name == OGC_PROPERTYNAME:
+        return [OGC_PROPERTYNAME, _text(elem)]
+    if name == "Literal":
+        return _literal(elem.text or "")
+    if name == "Function":
+        function = elem.get("name")
+        return [_functionToOperator.get(function, function)] + args
+    if name in ("And", "Or"):
+        return combine(name, args)
+    if name == OGC_IS_LIKE:
+        pattern = args[1] if len(args) > 1 else None
+        if isinstance(pattern, str):
+            wildCard, singleChar = elem.get("wildCard", "%"), elem.get("singleChar", "_")
+            pattern = pattern.replace(wildCard, "%").replace(singleChar, "_")
+        return [name, args[0] if args else None, pattern]
+    if name == "PropertyIsBetween" and len(args) == 3:
+        return ["And", ["PropertyIsGreaterThanOrEqualTo", args[0], args[1]],
+                ["PropertyIsLessThanOrEqualTo", args[0], args[2]]]
+    if name in ("LowerBoundary", "UpperBoundary") and args:
+        return args[0]
+    if name in expression_keys:
+        return [name] + args
+    context.warnings.append(f"Unsupported filter element: '{name}'")
+    return _UNSUPPORTED
@@ -0,0 +1,142 @@
+import io
+from xml.etree.ElementTree import Element
+
+CDATA_TAG = "![CDATA["
+
+
+def createCDATA(text=None):
+    """ Returns a pseudo-element that XmlWriter writes as a CDATA section. """
+    element = Element(CDATA_TAG)
+    element.text = text
+    return element
+
+
+def _escapeText(text):
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    if '"' in text:
+        text = text.replace('"', "&quot;")
+    return text
+
+
+def _escapeAttrib(value):
+    value = _escapeText(str(value))
+    if "\n" in value or "\r" in value or "\t" in value:
+        value = value.replace("\n", "&#10;").replace("\r", "&#13;").replace("\t", "&#09;")
+    return value
+
+
+def _cdata(text):
+    return "<![CDATA[%s]]>" % (text or "").replace("]]>", "]]]]><![CDATA[>")
+
+
+def _startTag(tag, attrib):
+    if not attrib:
+        return "<" + tag
+    return "<%s %s" % (tag, " ".join('%s="%s"' % (k, _escapeAttrib(v)) for k, v in attrib.items()))
+
+
+class XmlWriter:
+    """ Writes XML to a file-like object in a single pass.
+
+    The document skeleton is written with start() and end(), while complete ElementTree elements
+    (e.g. a single rule) are written with element(), so that only one of them has to be kept in memory.
+    The output is indented like minidom's toprettyxml(), or has no whitespace at all if ``compact`` is set.
+    Elements created with createCDATA() are written as CDATA sections.
+
+    Text streams (e.g. files opened in "w" mode or StringIO) receive str, any other file-like object
+    (e.g. files opened in "wb" mode or BytesIO) receives UTF-8 encoded bytes.
+    """
+
+    def __init__(self, fp, compact=False, indent="  "):
+        self._fp = fp
+        self._binary = not isinstance(fp, io.TextIOBase)
+        self._indent = "" if compact else indent
+        self._newline = "" if compact else "\n"
+        self._parts = []
+        self._open = []         # tags of the elements started with start()
+        self._pending = False   # True if the last started element has not been closed with ">" yet
+
+    def declaration(self):
+        self._parts.append('<?xml version="1.0" encoding="utf-8"?>' + self._newline)
+
+    def start(self, tag, attrib=None):
+        self._closePending()
+        self._parts.append(self._indent * len(self._open) + _startTag(tag, attrib))
+        self._open.append(tag)
+        self._pending = True
+
+    def end(self):
+        tag = self._open.pop()
+        if self._pending:
+            self._parts.append("/>" + self._newline)
+            self._pending = False
+        else:
+            self._parts.append("%s</%s>%s" % (self._indent * len(self._open), tag, self._newline))
+        if not self._open:
+            self.flush()
+
+    def comment(self, text):
+        self._closePending()
+        self._parts.append("%s<!--%s-->%s" % (self._indent * len(self._open), text, self._newline))
+
+    def element(self, elem):
+        """ Writes a complete ElementTree element (and its children) and flushes the output. """
+        self._closePending()
+        self._writeElement(elem, len(self._open))
+        self.flush()
+
+    def flush(self):
+        if self._parts:
+            data = "".join(self._parts)
+            self._parts = []
+            self._fp.write(data.encode("utf-8") if self._binary else data)
+
+    def _closePending(self):
+        if self._pending:
+            self._parts.append(">" + self._newline)
+            self._pending = False
+
+    def _writeElement(self, elem, depth):
+        write = self._parts.append
+        newline = self._newline
+        # Filters can be nested very deeply, so this uses a stack rather than recursion. Its items are the
+        # elements still to write, and the text that follows the children of an element (tails and end tag).
+        stack = [(elem, depth)]
+        while stack:
+            elem, depth = stack.pop()
+            if depth is None:
+                write(elem)
+                continue
+            indent = self._indent * depth
+            tag = elem.tag
+            if tag == CDATA_TAG:
+                write(_cdata(elem.text))
+                continue
+            if not isinstance(tag, str):
+                # ElementTree.Comment
+                write("%s<!--%s-->%s" % (indent, elem.text, newline))
+                continue
+            start = _startTag(tag, elem.attrib)
+            text = elem.text
+            if len(elem) == 0:
+                if text:
+                    write("%s%s>%s</%s>%s" % (indent, start, _escapeText(text), tag, newline))
+                else:
+                    write("%s%s/>%s" % (indent, start, newline))
+            elif not text and len(elem) == 1 and elem[0].tag == CDATA_TAG and not elem[0].tail:
+                write("%s%s>%s</%s>%s" % (indent, start, _cdata(elem[0].text), tag, newline))
+            else:
+                write(indent + start + ">" + newline)
+                childIndent = indent + self._indent
+                if text:
+                    write(childIndent + _escapeText(text) + newline)
+                stack.append(("%s</%s>%s" % (indent, tag, newline), None))
+                for child in reversed(elem):
+                    if child.tail:
+                        stack.append((childIndent + _escapeText(child.tail) + newline, None))
+                    stack.append((child, depth + 1))
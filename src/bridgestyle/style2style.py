@@ -1,31 +1,95 @@
 import argparse
+import glob
+import importlib
+import json
 import os
+import re
 import shutil
+import traceback
 
-from . import arcgis
-from . import geostyler
-from . import mapboxgl
-from . import sld
+from .profiling import Profiler, span
 
-_exts = {"sld": sld, "geostyler": geostyler, "mapbox": mapboxgl, "lyrx": arcgis}
+# Style file extension -> module of the format. Modules are only imported when a file of their type is converted.
+_exts = {"sld": "sld", "geostyler": "geostyler", "mapbox": "mapboxgl", "lyrx": "arcgis", "map": "mapserver"}
 
 
-def convert(fileA, fileB, options):
+def _backend(ext):
+    return importlib.import_module("." + _exts[ext], __package__)
+
+
+SUMMARY_FILENAME = "style2style_summary.json"
+
+# Characters replaced in layer names to make them usable in file names
+_FILENAME_CHARS = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+class StyleConversionError(Exception):
+    """ Raised when a style file could not be converted. Holds the warnings collected so far. """
+
+    def __init__(self, message, warnings=None):
+        super().__init__(message)
+        self.warnings = warnings or []
+
+
+def _convertFile(fileA, fileB, options, jobs=None):
+    """ Converts a single style file and returns the list of written style files and the list of warnings.
+
+    With the "alllayers" option, every layer of an ArcGIS Pro layer file is converted (by ``jobs`` worker
+    processes) and written to its own file, named after ``fileB`` and the layer.
+    Raises a StyleConversionError if the file could not be converted. """
     extA = os.path.splitext(fileA)[1][1:]
     extB = os.path.splitext(fileB)[1][1:]
     if extA not in _exts:
-        print("Unsupported style type: '%s'" % extA)
-        return
+        raise StyleConversionError("Unsupported style type: '%s'" % extA)
     if extB not in _exts:
-        print("Unsupported style type: '%s'" % extB)
-        return
+        raise StyleConversionError("Unsupported style type: '%s'" % extB)
 
-    with open(fileA) as f:
+    with span(options, "read"), open(fileA) as f:
         styleA = f.read()
 
-    geostyler, icons, geostylerwarnings = _exts[extA].toGeostyler(styleA, options)
-    if geostyler.get("rules", []):
-        styleB, warningsB = _exts[extB].fromGeostyler(geostyler, options)
+    backendA = _backend(extA)
+    # Files that a style refers to (such as Mapfile includes) are relative to its folder
+    optionsA = dict(options or {}, basepath=os.path.dirname(os.path.abspath(fileA)))
+    if options and options.get("alllayers") and hasattr(backendA, "toGeostylerLayers"):
+        return _convertLayers(backendA.toGeostylerLayers(styleA, optionsA, jobs), fileB, options)
+
+    geostyler, icons, geostylerwarnings = backendA.toGeostyler(styleA, optionsA)
+    if not geostyler.get("rules", []):
+        raise StyleConversionError("ERROR: Empty geostyler result (This is most likely caused by the "
+                                   "original style containing only unsupported elements)", geostylerwarnings)
+
+    warningsB = _writeStyle(geostyler, icons, fileB, options)
+    return [fileB], geostylerwarnings + warningsB
+
+
+def _convertLayers(layers, fileB, options):
+    base, ext = os.path.splitext(fileB)
+    outputs = []
+    warnings = []
+    for geostyler, icons, layerWarnings in layers:
+        name = geostyler.get("name") or "layer"
+        warnings.extend(f"{name}: {w}" for w in layerWarnings)
+        if not geostyler.get("rules", []):
+            warnings.append(f"{name}: skipped, empty geostyler result")
+            continue
+        output = "%s_%s" % (base, _FILENAME_CHARS.sub("_", name))
+        n = 1
+        while output + ext in outputs:
+            n += 1
+            output = "%s_%s_%d" % (base, _FILENAME_CHARS.sub("_", name), n)
+        outputs.append(output + ext)
+        warnings.extend(f"{name}: {w}" for w in _writeStyle(geostyler, icons, output + ext, options))
+    if not outputs:
+        raise StyleConversionError("ERROR: Empty geostyler result for all layers (This is most likely caused by "
+                                   "the original style containing only unsupported elements)", warnings)
+    return outputs, warnings
+
+
+def _writeStyle(geostyler, icons, fileB, options):
+    """ Writes a GeoStyler style to a style file, and the icons it uses next to it. Returns the list of warnings. """
+    extB = os.path.splitext(fileB)[1][1:]
+    styleB, warningsB = _backend(extB).fromGeostyler(geostyler, options)
+    with span(options, "write"):
         outputfolder = os.path.dirname(fileB)
         for f in icons:
             dst = os.path.join(outputfolder, os.path.basename(f))
@@ -33,14 +97,112 @@ def convert(fileA, fileB, options):
 
         with open(fileB, "w") as f:
             f.write(styleB)
+        if options and options.get("attributes"):
+            from .geostyler.attributes import requiredAttributes
+            with open(attributesFile(fileB), "w") as f:
+                json.dump(requiredAttributes(geostyler), f, indent=4)
+    return warningsB
+
 
-        for w in geostylerwarnings + warningsB:
+def attributesFile(fileB):
+    """ Returns the name of the file that the attributes needed by a style file are written to
+    (see geostyler.attributes.requiredAttributes()), e.g. roads.attributes.json for roads.sld. """
+    return os.path.splitext(fileB)[0] + ".attributes.json"
+
+
+def convert(fileA, fileB, options, jobs=None):
+    try:
+        _, warnings = _convertFile(fileA, fileB, options, jobs)
+    except StyleConversionError as e:
+        for w in e.warnings:
             print(f"WARNING: {w}")
+        print(str(e))
+        return
+    for w in warnings:
+        print(f"WARNING: {w}")
+
+
+def _globBase(pattern):
+    """ Returns the leading folder of a glob pattern that does not contain any wildcards. """
+    parts = []
+    for part in pattern.replace("\\", "/").split("/"):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return "/".join(parts) or "."
+
+
+def findStyleFiles(src):
+    """ Returns the base folder and the sorted list of supported style files for a source folder
+    (searched recursively) or glob pattern (where ** matches any number of subfolders). """
+    if os.path.isdir(src):
+        base = src
+        files = [os.path.join(root, name) for root, _, names in os.walk(src) for name in names]
     else:
-        for w in geostylerwarnings:
-            print(f"WARNING: {w}")
-        print("ERROR: Empty geostyler result (This is most likely caused by the "
-              "original style containing only unsupported elements)")
+        base = _globBase(src)
+        files = [f for f in glob.glob(src, recursive=True) if os.path.isfile(f)]
+    return base, sorted(f for f in files if os.path.splitext(f)[1][1:] in _exts)
+
+
+def _batchWorker(task):
+    source, destination, options = task
+    result = {"source": source, "destination": destination, "status": "ok", "outputs": [], "warnings": []}
+    try:
+        os.makedirs(os.path.dirname(destination) or ".", exist_ok=True)
+        result["outputs"], result["warnings"] = _convertFile(source, destination, options, 1)
+    except StyleConversionError as e:
+        result.update({"status": "failed", "error": str(e), "warnings": e.warnings})
+    except Exception as e:
+        result.update({"status": "failed", "error": f"{type(e).__name__}: {e}",
+                       "traceback": traceback.format_exc()})
+    return result
+
+
+def convertBatch(src, dst, outputFormat, options=None, jobs=None):
+    """ Converts all style files in a source folder or glob pattern into the given output format.
+
+    The converted files are written to the ``dst`` folder, keeping the folder layout relative to the
+    source folder (or the non-wildcard part of the glob pattern). Files are converted in parallel
+    by ``jobs`` worker processes (all CPUs by default). A failing file does not stop the run.
+
+    Returns a list with the status and warnings of each file, which is also written as
+    JSON to a summary file in the ``dst`` folder.
+    """
+    outputFormat = outputFormat.lstrip(".")
+    if outputFormat not in _exts:
+        raise StyleConversionError("Unsupported style type: '%s'" % outputFormat)
+    options = options or {}
+    base, files = findStyleFiles(src)
+    tasks = []
+    for source in files:
+        relpath = os.path.relpath(source, base)
+        destination = os.path.join(dst, os.path.splitext(relpath)[0] + "." + outputFormat)
+        tasks.append((source, destination, options))
+
+    os.makedirs(dst, exist_ok=True)
+    if jobs == 1 or len(tasks) <= 1:
+        results = [_batchWorker(task) for task in tasks]
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        jobs = jobs or os.cpu_count() or 1
+        chunksize = max(1, len(tasks) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_batchWorker, tasks, chunksize=chunksize))
+
+    with open(os.path.join(dst, SUMMARY_FILENAME), "w") as f:
+        json.dump(results, f, indent=4)
+    return results
+
+
+def _printBatchResults(results):
+    failed = 0
+    for result in results:
+        if result["status"] == "ok":
+            print(f"OK: {result['source']} -> {result['destination']} ({len(result['warnings'])} warnings)")
+        else:
+            failed += 1
+            print(f"FAILED: {result['source']}: {result['error']}")
+    print(f"{len(results) - failed} of {len(results)} files converted, {failed} failed")
 
 
 def main():
@@ -51,11 +213,63 @@ def main():
     parser.add_argument('-e', action='store_true',
                         help="Replace Esri font markers with standard symbols",
                         dest="replaceesri")
-    parser.add_argument('src')
-    parser.add_argument('dst')
+    parser.add_argument('-l', '--layers', action='store_true',
+                        help="Convert every layer of an ArcGIS Pro layer file or Mapfile (or every source layer of a "
+                             "Mapbox GL style) to its own output file, "
+                             "named <output>_<layer name>",
+                        dest="alllayers")
+    parser.add_argument('--icon-folder', dest="iconfolder",
+                        help="Folder to store the icons extracted from the styles in "
+                             "(default: the bridgestyle/icons folder in the system temp folder)")
+    parser.add_argument('--symbol-cache', metavar="FOLDER", dest="symbolcache",
+                        help="Cache converted ArcGIS symbols in a folder, to reuse them in batch workers and later runs")
+    parser.add_argument('--attributes', action='store_true',
+                        help="Also write the attributes that each style uses to a <output>.attributes.json file")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="Number of worker processes in batch mode, or for the layers of a single "
+                             "layer file with -l (default: number of CPUs)")
+    parser.add_argument('-f', '--format', dest="format",
+                        help="Output style type (file extension) in batch mode, e.g. 'sld'")
+    parser.add_argument('--profile', action='store_true',
+                        help="Print the time and peak memory of each conversion stage (this slows the conversion down)")
+    parser.add_argument('--profile-stats', metavar="FILE", dest="profilestats",
+                        help="Write cProfile statistics of the conversion to a file")
+    parser.add_argument('src', help="Style file, or folder or glob pattern for batch mode")
+    parser.add_argument('dst', help="Output style file, or output folder for batch mode")
     args = parser.parse_args()
 
     argsdict = dict(vars(args))
-    del argsdict["src"]
-    del argsdict["dst"]
-    convert(args.src, args.dst, argsdict)
+    for name in ("src", "dst", "jobs", "format", "profile", "profilestats"):
+        del argsdict[name]
+    batch = os.path.isdir(args.src) or glob.has_magic(args.src)
+    if batch and not args.format:
+        parser.error("batch mode requires an output style type (-f/--format)")
+    jobs = args.jobs
+    profiler = None
+    if args.profile:
+        profiler = Profiler(memory=True).start()
+        argsdict["profiler"] = profiler
+    if args.profile or args.profilestats:
+        jobs = 1  # profile the conversions in this process
+    cprofile = None
+    if args.profilestats:
+        import cProfile
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+    try:
+        if batch:
+            try:
+                results = convertBatch(args.src, args.dst, args.format, argsdict, jobs)
+            except StyleConversionError as e:
+                print(str(e))
+                return
+            _printBatchResults(results)
+        else:
+            convert(args.src, args.dst, argsdict, jobs)
+    finally:
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(args.profilestats)
+        if profiler is not None:
+            profiler.stop()
+            print(profiler.report())
@@ -0,0 +1,77 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bridgestyle import arcgis, style2style
+from bridgestyle.arcgis import togeostyler
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data", "arcgis")
+
+
+def _layer(filename, uri):
+    with open(os.path.join(test_data_folder, filename)) as f:
+        layer = json.load(f)["layerDefinitions"][0]
+    layer["uRI"] = uri
+    return layer
+
+
+def _document():
+    # Roads (group) -> [Hash line, Lines (group) -> [Cartographic line, Cities]], Marker line,
+    # plus a layer that is not referenced from anywhere
+    return {
+        "type": "CIMLayerDocument",
+        "layers": ["CIMPATH=map/roads.xml", "CIMPATH=map/marker.xml"],
+        "layerDefinitions": [
+            {"type": "CIMGroupLayer", "name": "Roads", "uRI": "CIMPATH=map/roads.xml",
+             "layers": ["CIMPATH=map/hash.xml", "CIMPATH=map/lines.xml", "CIMPATH=map/missing.xml"]},
+            _layer("Cities.lyrx", "CIMPATH=map/cities.xml"),
+            _layer("Marker Line.lyrx", "CIMPATH=map/marker.xml"),
+            {"type": "CIMGroupLayer", "name": "Lines", "uRI": "CIMPATH=map/lines.xml",
+             "layers": ["CIMPATH=map/cartographic.xml", "CIMPATH=map/cities.xml"]},
+            _layer("Hash Line.lyrx", "CIMPATH=map/hash.xml"),
+            _layer("Cartographic Line.lyrx", "CIMPATH=map/cartographic.xml"),
+            _layer("Countries.lyrx", "CIMPATH=map/countries.xml"),
+        ],
+    }
+
+
+class ArcgisLayersTest(unittest.TestCase):
+
+    def test_feature_layers(self):
+        layers = togeostyler.featureLayers(_document())
+        self.assertEqual([layer["name"] for layer in layers],
+                         ["Hash line", "Cartographic line", "Cities", "Marker line", "Countries"])
+
+    def test_convert_layers(self):
+        document = _document()
+        results = togeostyler.convertLayers(document, jobs=1)
+        expected = [togeostyler.convert({"layerDefinitions": [layer]}) for layer in togeostyler.featureLayers(document)]
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results, expected)
+        self.assertEqual(togeostyler.convertLayers(document, jobs=2), results)
+        self.assertEqual(arcgis.toGeostylerLayers(json.dumps(document), jobs=1), results)
+
+    def test_style2style_layers(self):
+        folder = tempfile.mkdtemp()
+        try:
+            source = os.path.join(folder, "map.lyrx")
+            with open(source, "w") as f:
+                json.dump(_document(), f)
+            outputs, warnings = style2style._convertFile(source, os.path.join(folder, "map.sld"),
+                                                         {"alllayers": True}, 1)
+            self.assertEqual([os.path.basename(output) for output in outputs],
+                             ["map_Hash_line.sld", "map_Cartographic_line.sld", "map_Cities.sld",
+                              "map_Marker_line.sld", "map_Countries.sld"])
+            for output in outputs:
+                self.assertTrue(os.path.getsize(output))
+            # without the option, only the first layer definition is converted, which here is a group layer
+            with self.assertRaises(style2style.StyleConversionError):
+                style2style._convertFile(source, os.path.join(folder, "first.sld"), {}, 1)
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
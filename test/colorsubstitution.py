@@ -0,0 +1,104 @@
+import base64
+import os
+import sys
+import tempfile
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from bridgestyle.arcgis import togeostyler
+from bridgestyle.context import ConversionContext
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+
+def _color(r, g, b):
+    return {"type": "CIMRGBColor", "values": [r, g, b, 100]}
+
+
+SUBSTITUTIONS = [
+    {"oldColor": _color(255, 0, 0), "newColor": _color(0, 255, 0)},
+    {"oldColor": _color(0, 255, 0), "newColor": _color(1, 2, 3)},  # not applied again to substituted pixels
+    {"oldColor": _color(9, 9, 9), "newColor": _color(4, 4, 4)},  # not in the image
+]
+
+PIXELS = [(255, 0, 0, 255), (0, 255, 0, 128), (0, 0, 255, 0), (255, 0, 0, 10), (255, 0, 1, 255), (0, 255, 0, 255)]
+EXPECTED = [(0, 255, 0, 255), (1, 2, 3, 128), (0, 0, 255, 0), (0, 255, 0, 10), (255, 0, 1, 255), (1, 2, 3, 255)]
+
+
+def _png(pixels, mode="RGBA"):
+    image = Image.new(mode, (3, 2))
+    image.putdata(pixels)
+    output = BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
+
+
+def _pixels(data):
+    image = Image.open(BytesIO(data))
+    return [image.getpixel((x, y)) for y in range(image.height) for x in range(image.width)]
+
+
+@unittest.skipIf(Image is None, "Pillow is not installed")
+class ColorSubstitutionTest(unittest.TestCase):
+
+    def setUp(self):
+        togeostyler._colorSubstitutionCache.clear()
+
+    def test_substitution(self):
+        self.assertEqual(_pixels(togeostyler.apply_color_substitution(_png(PIXELS), SUBSTITUTIONS, ConversionContext())), EXPECTED)
+
+    def test_without_numpy(self):
+        with mock.patch.dict(sys.modules, {"numpy": None}):
+            result = togeostyler.apply_color_substitution(_png(PIXELS), SUBSTITUTIONS, ConversionContext())
+        self.assertEqual(_pixels(result), EXPECTED)
+
+    def test_rgb_image(self):
+        result = togeostyler.apply_color_substitution(_png([p[:3] for p in PIXELS], "RGB"), SUBSTITUTIONS, ConversionContext())
+        self.assertEqual(_pixels(result), [p[:3] + (255,) for p in EXPECTED])
+
+    def test_cache(self):
+        data = _png(PIXELS)
+        with mock.patch.object(togeostyler, "_substituteColors", wraps=togeostyler._substituteColors) as substitute:
+            first = togeostyler.apply_color_substitution(data, SUBSTITUTIONS, ConversionContext())
+            self.assertEqual(togeostyler.apply_color_substitution(bytes(data), SUBSTITUTIONS, ConversionContext()), first)
+            self.assertEqual(substitute.call_count, 1)
+            togeostyler.apply_color_substitution(data, SUBSTITUTIONS[1:], ConversionContext())
+            self.assertEqual(substitute.call_count, 2)
+
+
+class ColorSubstitutionFallbackTest(unittest.TestCase):
+
+    def setUp(self):
+        togeostyler._colorSubstitutionCache.clear()
+
+    def test_without_pillow(self):
+        context = ConversionContext()
+        with mock.patch.dict(sys.modules, {"PIL": None}):
+            self.assertEqual(togeostyler.apply_color_substitution(b"GIF89a", SUBSTITUTIONS, context), b"GIF89a")
+        self.assertEqual(context.warnings, ["Pillow is not installed, color substitutions have not been applied"])
+
+    def test_failure(self):
+        context = ConversionContext()
+        with mock.patch.dict(sys.modules, {"PIL": mock.MagicMock()}), \
+                mock.patch.object(togeostyler, "_substituteColors", side_effect=OSError("cannot identify image")):
+            self.assertEqual(togeostyler.apply_color_substitution(b"GIF89a", SUBSTITUTIONS, context), b"GIF89a")
+        self.assertEqual(context.warnings, ["Failed to apply color substitutions: cannot identify image"])
+
+    def test_picture_format(self):
+        layer = {"type": "CIMPictureMarker", "size": 10, "colorSubstitutions": SUBSTITUTIONS,
+                 "url": "data:image/gif;base64," + base64.b64encode(b"GIF89a").decode()}
+        with tempfile.TemporaryDirectory() as folder:
+            context = ConversionContext({"iconfolder": folder})
+            with mock.patch.dict(sys.modules, {"PIL": None}):
+                symbolizer = togeostyler.processSymbolLayer(layer, "CIMPointSymbol", context.options, context)
+            # the image has not been recolored: it keeps its format
+            self.assertTrue(symbolizer["image"].endswith(".gif"))
+            self.assertEqual(os.path.dirname(symbolizer["image"]), folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import json
+import os
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+from bridgestyle.arcgis import togeostyler
+from bridgestyle.mapboxgl import fromgeostyler as mapboxgl
+from bridgestyle.mapserver import fromgeostyler as mapserver
+from bridgestyle.sld import fromgeostyler as sld
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data", "arcgis")
+
+THREADS = 8
+REPEATS = 10
+
+
+def _syntheticGeostyler(i):
+    # Each style uses an unsupported function with a unique name, so that every conversion
+    # produces warnings that can only belong to that particular style.
+    return {
+        "name": f"style{i}",
+        "rules": [
+            {
+                "name": f"rule{i}",
+                "filter": ["PropertyIsEqualTo", ["PropertyName", "type"], i],
+                "symbolizers": [
+                    {
+                        "kind": "Line",
+                        "color": "#%06x" % i,
+                        "opacity": 1.0,
+                        "width": [f"unsupported{i}", ["PropertyName", "width"]],
+                    }
+                ],
+            }
+        ],
+    }
+
+
+def _syntheticArcgis(i):
+    return {
+        "layerDefinitions": [
+            {"name": f"layer{i}", "type": "CIMFeatureLayer", "renderer": {"type": f"CIMUnsupported{i}"}}
+        ]
+    }
+
+
+def _arcgisJob(arcgis):
+    geostyler, icons, warnings = togeostyler.convert(arcgis)
+    return geostyler, icons, list(warnings)
+
+
+def _tryConvert(convert, geostyler):
+    # Some sample styles use features a writer does not support: these must fail the same way every time
+    try:
+        return convert(geostyler)
+    except Exception as e:
+        return repr(e)
+
+
+def _writersJob(geostyler):
+    return (
+        _tryConvert(sld.convert, geostyler),
+        _tryConvert(mapboxgl.convert, geostyler),
+        _tryConvert(mapserver.convert, geostyler),
+    )
+
+
+class ConcurrentConversionTest(unittest.TestCase):
+
+    def _runConcurrently(self, job, inputs):
+        expected = [job(i) for i in inputs]
+        tasks = list(range(len(inputs))) * REPEATS
+        with ThreadPoolExecutor(max_workers=THREADS) as pool:
+            results = list(pool.map(lambda idx: (idx, job(inputs[idx])), tasks))
+        for idx, result in results:
+            self.assertEqual(result, expected[idx])
+
+    def test_arcgis_to_geostyler(self):
+        inputs = []
+        for filename in sorted(os.listdir(test_data_folder)):
+            with open(os.path.join(test_data_folder, filename)) as f:
+                inputs.append(json.load(f))
+        inputs.extend(_syntheticArcgis(i) for i in range(20))
+        self._runConcurrently(_arcgisJob, inputs)
+
+    def test_geostyler_writers(self):
+        inputs = [_syntheticGeostyler(i) for i in range(40)]
+        for filename in sorted(os.listdir(test_data_folder)):
+            with open(os.path.join(test_data_folder, filename)) as f:
+                geostyler, _, _ = togeostyler.convert(json.load(f))
+            inputs.append(geostyler)
+        # Make sure the synthetic styles actually produce (distinct) warnings
+        _, (_, mbWarnings), (_, _, msWarnings) = _writersJob(inputs[3])
+        self.assertTrue(any("unsupported3" in w for w in mbWarnings))
+        self.assertTrue(any("unsupported3" in w for w in msWarnings))
+        self._runConcurrently(_writersJob, inputs)
+
+
+if __name__ == '__main__':
+    unittest.main()
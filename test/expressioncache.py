@@ -0,0 +1,91 @@
+import unittest
+
+from bridgestyle import expressioncache
+from bridgestyle.context import ConversionContext
+from bridgestyle.expressioncache import ExpressionCache
+from bridgestyle.mapboxgl import fromgeostyler as mapboxgl
+from bridgestyle.mapserver import fromgeostyler as mapserver
+from bridgestyle.sld import fromgeostyler as sld
+
+
+def _style(i):
+    return {
+        "name": f"style{i}",
+        "rules": [
+            {
+                "name": f"rule{n}",
+                "filter": ["And", ["PropertyIsEqualTo", ["PropertyName", "type"], n],
+                           ["PropertyIsGreaterThan", ["PropertyName", "pop"], 1000]],
+                "symbolizers": [
+                    {"kind": "Line", "color": "#ff0000", "opacity": 1.0,
+                     "width": ["unsupportedFunction", ["PropertyName", "width"]]}
+                ],
+            }
+            for n in range(10)
+        ],
+    }
+
+
+class ExpressionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        expressioncache.clearCache()
+
+    def tearDown(self):
+        expressioncache.setCacheSize(expressioncache.DEFAULT_MAXSIZE)
+        expressioncache.clearCache()
+
+    def test_shared_by_writers(self):
+        results = [(sld.convert(_style(0)), mapboxgl.convert(_style(0)), mapserver.convert(_style(0)))]
+        info = expressioncache.cacheInfo()
+        # each writer translates 10 different filters and the same width expression 10 times
+        self.assertEqual(info["misses"], 3 * 11)
+        self.assertEqual(info["hits"], 3 * 9)
+        results.append((sld.convert(_style(0)), mapboxgl.convert(_style(0)), mapserver.convert(_style(0))))
+        self.assertEqual(results[0], results[1])
+        info = expressioncache.cacheInfo()
+        self.assertEqual(info["misses"], 33)
+        self.assertEqual(info["hits"], 27 + 60)
+        self.assertAlmostEqual(info["hitRate"], 87 / 120)
+        self.assertEqual(info["size"], 33)
+
+    def test_warnings_replayed(self):
+        _, warnings = mapboxgl.convert(_style(0))
+        self.assertEqual(len(warnings), 10)
+        _, cachedWarnings = mapboxgl.convert(_style(1))
+        self.assertEqual(cachedWarnings, warnings)
+
+    def test_disabled(self):
+        expressioncache.setCacheSize(0)
+        expected = mapserver.convert(_style(0))
+        self.assertEqual(mapserver.convert(_style(0)), expected)
+        self.assertEqual(expressioncache.cacheInfo()["hits"], 0)
+        self.assertEqual(expressioncache.cacheInfo()["size"], 0)
+
+    def test_lru(self):
+        cache = ExpressionCache(maxsize=2)
+        calls = []
+
+        def convert(exp, context):
+            calls.append(exp)
+            context.warnings.append(f"converted {exp}")
+            return list(exp)
+
+        context = ConversionContext()
+        for exp in (["a", 1], ["a", 1.0], ["a", True], ["a", 1], ["a", "1"], ["a", True]):
+            self.assertEqual(cache.translate("test", exp, convert, context), exp)
+        # 1, 1.0, True and "1" are distinct keys, and only the 2 most recently used translations are kept
+        self.assertEqual(calls, [["a", 1], ["a", 1.0], ["a", True], ["a", 1], ["a", "1"], ["a", True]])
+        cache.translate("test", ["a", "1"], convert, context)
+        self.assertEqual(len(calls), 6)
+        self.assertEqual(context.warnings[-1], "converted ['a', '1']")
+        self.assertEqual(cache.info()["size"], 2)
+
+    def test_extra_arguments(self):
+        exp = ["PropertyIsLessThan", ["PropertyName", "a"], 1]
+        self.assertEqual(sld.convertExpression(exp).tag, "ogc:PropertyIsLessThan")
+        self.assertEqual(sld.convertExpression(exp, True).tag, "ogc:Function")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bridgestyle import style2style
+from bridgestyle.geostyler import model
+from bridgestyle.geostyler.attributes import requiredAttributes
+from bridgestyle.geostyler.expressions import propertyNames
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data", "arcgis")
+
+
+def _prop(name):
+    return ["PropertyName", name]
+
+
+STYLE = {
+    "name": "cities",
+    "rules": [
+        {"name": "capitals", "filter": ["PropertyIsEqualTo", _prop("CAPITAL"), 1],
+         "symbolizers": [{"kind": "Mark", "wellKnownName": "circle", "size": ["Div", _prop("POP"), 1000],
+                          "rotate": ["Sub", _prop("ANGLE"), 90]}]},
+        {"name": "labels", "filter": "ELSE", "scaleDenominator": {"max": 50000},
+         "symbolizers": [{"kind": "Text", "label": ["Concatenate", _prop("NAME"), " ", _prop("CODE")],
+                          "offset": [0, ["Mul", _prop("DY"), 2]]}]},
+        {"name": "areas", "scaleDenominator": {"min": 100000},
+         "symbolizers": [{"kind": "Fill", "graphicFill": [{"kind": "Mark", "size": _prop("DENSITY")}]}]},
+    ],
+}
+
+
+class RequiredAttributesTest(unittest.TestCase):
+
+    def test_property_names(self):
+        self.assertEqual(propertyNames(["And", ["PropertyIsEqualTo", _prop("A"), "x"], ["Not", ["Add", _prop("B"), 1]]]),
+                         {"A", "B"})
+        self.assertEqual(propertyNames("ELSE"), set())
+        self.assertEqual(propertyNames([{"size": _prop("A")}, [1, _prop("B")]], {"C"}), {"A", "B", "C"})
+
+    def test_style(self):
+        attributes = requiredAttributes(STYLE)
+        self.assertEqual(attributes["attributes"], ["ANGLE", "CAPITAL", "CODE", "DENSITY", "DY", "NAME", "POP"])
+        self.assertEqual(attributes["rules"], [
+            {"name": "capitals", "attributes": ["ANGLE", "CAPITAL", "POP"]},
+            {"name": "labels", "attributes": ["CODE", "DY", "NAME"], "scaleDenominator": {"max": 50000}},
+            {"name": "areas", "attributes": ["DENSITY"], "scaleDenominator": {"min": 100000}},
+        ])
+        self.assertEqual(attributes["scales"], [
+            {"min": None, "max": 50000, "attributes": ["ANGLE", "CAPITAL", "CODE", "DY", "NAME", "POP"]},
+            {"min": 50000, "max": 100000, "attributes": ["ANGLE", "CAPITAL", "POP"]},
+            {"min": 100000, "max": None, "attributes": ["ANGLE", "CAPITAL", "DENSITY", "POP"]},
+        ])
+        self.assertEqual(requiredAttributes(model.fromDict(STYLE)), attributes)
+
+    def test_style2style(self):
+        folder = tempfile.mkdtemp()
+        try:
+            output = os.path.join(folder, "cities.sld")
+            style2style.convert(os.path.join(test_data_folder, "Cities.lyrx"), output, {"attributes": True})
+            self.assertTrue(os.path.exists(output))
+            with open(style2style.attributesFile(output)) as f:
+                self.assertEqual(json.load(f)["attributes"], ["ADM0CAP", "NAME", "SCALERANK"])
+        finally:
+            shutil.rmtree(folder)
+
+
+if __name__ == '__main__':
+    unittest.main()
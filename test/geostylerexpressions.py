@@ -0,0 +1,151 @@
+import unittest
+
+from bridgestyle import expressioncache
+from bridgestyle.arcgis import togeostyler as arcgis
+from bridgestyle.arcgis.expressions import convertWhereClause
+from bridgestyle.context import ConversionContext
+from bridgestyle.geostyler.expressions import combine, simplify, simplifyRules, translate
+from bridgestyle.mapboxgl import fromgeostyler as mapboxgl
+from bridgestyle.mapserver import fromgeostyler as mapserver
+from bridgestyle.sld import fromgeostyler as sld
+
+VALUES = 5000
+DEPTH = 5000
+
+
+def _equal(name, value):
+    return ["PropertyIsEqualTo", ["PropertyName", name], value]
+
+
+def _style(filt):
+    return {"name": "style", "rules": [
+        {"name": "rule", "filter": filt, "symbolizers": [{"kind": "Line", "color": "#ff0000", "width": 1}]}
+    ]}
+
+
+def _deep(depth):
+    exp = _equal("TYPE", 1)
+    for i in range(depth):
+        exp = ["Not", exp] if i % 2 else ["And", exp, _equal("CODE", i)]
+    return exp
+
+
+class GeostylerExpressionsTest(unittest.TestCase):
+
+    def setUp(self):
+        expressioncache.clearCache()
+
+    def test_combine(self):
+        a, b, c = _equal("A", 1), _equal("B", 2), _equal("C", 3)
+        self.assertEqual(combine("Or", [a]), a)
+        self.assertEqual(combine("Or", [a, b]), ["Or", a, b])
+        self.assertEqual(combine("Or", [combine("Or", [a, b]), c]), ["Or", a, b, c])
+        self.assertEqual(combine("And", [["Or", a, b], c]), ["And", ["Or", a, b], c])
+
+    def test_translate(self):
+        def expand(node, depth):
+            return node[1:], depth + 1, lambda node, children: (node[0], children)
+
+        def leaf(node, depth):
+            return node, depth
+
+        self.assertEqual(translate(["a", ["b", 1, 2], 3], expand, leaf, 0),
+                         ("a", [("b", [(1, 2), (2, 2)]), (3, 1)]))
+        self.assertEqual(translate(7, expand, leaf, 0), (7, 0))
+
+    def test_simplify(self):
+        prop = ["PropertyName", "SIZE"]
+        self.assertEqual(simplify(["Mul", 3.7795275591, ["Mul", 0.5, ["Div", prop, 2]]]),
+                         ["Mul", 1.88976377955, ["Div", prop, 2]])
+        self.assertEqual(simplify(["Add", ["Mul", 2, 3], ["Div", 1, 4]]), 6.25)
+        self.assertEqual(simplify(["Div", 6, 3]), 2)
+        self.assertEqual(simplify(["Add", 0.1, 0.2]), 0.3)
+        self.assertEqual(simplify(["Mul", 1e-7, 1e-6]), 1e-13)
+        self.assertEqual(simplify(["Add", ["Mul", ["Div", prop, 1], 1], 0]), ["Div", prop, 1])
+        # Attributes can be strings, which the operation converts to numbers
+        self.assertEqual(simplify(["Mul", prop, 1]), ["Mul", prop, 1])
+        self.assertEqual(simplify(["Add", 1, ["Add", prop, 2]]), ["Add", 1, ["Add", prop, 2]])
+        self.assertEqual(simplify(["Mul", 2, ["Mul", prop, 3]]), ["Mul", prop, 6])
+        self.assertEqual(simplify(["Sub", 0, prop]), ["Sub", 0, prop])
+        self.assertEqual(simplify(["Div", prop, 0]), ["Div", prop, 0])
+        self.assertEqual(simplify(["Add", "a", 0]), ["Add", "a", 0])
+        a, b, c = _equal("A", 1), _equal("B", 2), _equal("C", 3)
+        self.assertEqual(simplify(["And", ["And", a, b], ["Or", c, c], a]), ["And", a, b, c])
+        self.assertEqual(simplify(["Or", ["And", a, a]]), a)
+        # Nothing to simplify: no copies
+        filt = ["Not", ["PropertyIsLessThan", prop, 1]]
+        self.assertIs(simplify(filt), filt)
+        self.assertEqual(simplify(_deep(500)), _deep(500))  # deeper than MAX_RECURSION
+
+    def test_simplify_rules(self):
+        rules = [{"name": "rule", "filter": ["Or", _equal("A", 1), _equal("A", 1)], "symbolizers": [
+            {"kind": "Mark", "size": ["Mul", 2, 5], "offset": [["Add", 1, 1], 0],
+             "rotate": ["Sub", ["Mul", ["PropertyName", "R"], 2], 0],
+             "font": ["Arial", "Helvetica"]},
+            {"kind": "Fill", "graphicFill": [{"kind": "Mark", "size": ["Div", 10, 4]}]},
+        ]}]
+        self.assertEqual(simplifyRules(rules), [{"name": "rule", "filter": _equal("A", 1), "symbolizers": [
+            {"kind": "Mark", "size": 10, "offset": [2, 0], "rotate": ["Mul", ["PropertyName", "R"], 2],
+             "font": ["Arial", "Helvetica"]},
+            {"kind": "Fill", "graphicFill": [{"kind": "Mark", "size": 2.5}]},
+        ]}])
+
+    def test_where_clause(self):
+        values = ", ".join("'v%d'" % i for i in range(VALUES))
+        filt = convertWhereClause("TYPE IN (%s)" % values, False)
+        self.assertEqual(filt, ["Or"] + [_equal("TYPE", "v%d" % i) for i in range(VALUES)])
+        self.assertEqual(convertWhereClause("TYPE IN ('a')", False), _equal("TYPE", "a"))
+
+    def test_unique_values(self):
+        group = {"classes": [{"label": "class", "symbol": {"symbol": {"type": "CIMPointSymbol", "symbolLayers": []}},
+                              "values": [{"fieldValues": ["1", "a", "x"]}, {"fieldValues": ["2", "<Null>", "y"]}]}]}
+        rules = arcgis.processUniqueValueGroup(["F1", "F2", "F3"], group, {}, ConversionContext())
+        self.assertEqual(rules[0]["filter"], ["Or",
+                                              ["And", _equal("F1", "1"), _equal("F2", "a"), _equal("F3", "x")],
+                                              ["And", _equal("F1", "2"), ["PropertyIsNull", ["PropertyName", "F2"]],
+                                               _equal("F3", "y")]])
+
+    def test_writers(self):
+        filt = ["Or", _equal("A", 1), ["And", _equal("B", "b"), ["PropertyIsLessThan", ["PropertyName", "C"], 2]],
+                _equal("D", 3)]
+        context = ConversionContext()
+        self.assertEqual(mapserver.convertExpression(filt, context),
+                         '(("[A]" = 1) OR (("[B]" = "b") AND ("[C]" < 2)) OR ("[D]" = 3))')
+        self.assertEqual(mapboxgl.convertExpression(filt, context),
+                         ["any", ["==", ["get", "A"], 1], ["all", ["==", ["get", "B"], "b"],
+                                                           ["<", ["get", "C"], 2]], ["==", ["get", "D"], 3]])
+        elem = sld.convertExpression(filt)
+        self.assertEqual(elem.tag, "ogc:Or")
+        self.assertEqual([child.tag for child in elem], ["ogc:PropertyIsEqualTo", "ogc:And", "ogc:PropertyIsEqualTo"])
+        self.assertEqual(context.warnings, [])
+
+    def test_mapbox_special_cases(self):
+        context = ConversionContext()
+        self.assertEqual(mapboxgl.convertExpression(["PropertyIsNull", ["PropertyName", "A"]], context),
+                         ["!", ["has", "A"]])
+        self.assertEqual(mapboxgl.convertExpression(["PropertyIsLike", ["PropertyName", "A"], "%ab%"], context),
+                         ["in", "ab", ["get", "A"]])
+        self.assertEqual(mapboxgl.convertExpression(["exp", ["PropertyName", "A"]], context),
+                         ["^", ["e"], ["get", "A"]])
+        self.assertEqual(mapboxgl.convertExpression(["atan2", ["PropertyName", "Y"], 1], context)[1],
+                         [">", 1, 0])
+        self.assertEqual(context.warnings, [])
+        self.assertIsNone(mapboxgl.convertExpression(["PropertyIsLike", ["PropertyName", "A"], "a%"], context))
+        self.assertIsNone(mapboxgl.convertExpression(["Or", ["strSubstr", "A"], _equal("B", 1)], context)[1])
+        self.assertEqual(len(context.warnings), 2)
+
+    def test_large_filters(self):
+        # Neither wide nor deep filters exceed the recursion limit
+        wide = ["Or"] + [_equal("TYPE", i) for i in range(VALUES)]
+        for filt in (wide, _deep(DEPTH)):
+            sldStyle, warnings = sld.convert(_style(filt))
+            self.assertIn("<ogc:Filter>", sldStyle)
+            mapboxStyle, warnings = mapboxgl.convert(_style(filt))
+            self.assertEqual(warnings, [])
+            mapfile, _, warnings = mapserver.convert(_style(filt))
+            self.assertIn("EXPRESSION", mapfile)
+        self.assertEqual(sldStyle.count("<ogc:Not>"), DEPTH // 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import glob
+import json
+import os
+import unittest
+
+from bridgestyle.geostyler import model
+from bridgestyle.mapboxgl import fromgeostyler as mapboxgl
+from bridgestyle.mapserver import fromgeostyler as mapserver
+from bridgestyle.sld import fromgeostyler as sld
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data")
+
+
+def _style():
+    return {
+        "name": "roads",
+        "blendMode": "multiply",
+        "rules": [
+            {
+                "name": "main",
+                "filter": ["PropertyIsEqualTo", ["PropertyName", "type"], "main"],
+                "scaleDenominator": {"min": 100, "max": 1000},
+                "symbolizers": [
+                    {"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 2, "customProperty": [1, 2]},
+                    {"kind": "Text", "label": ["PropertyName", "name"], "size": 10, "font": "Arial",
+                     "color": "#000000"},
+                    {"kind": "Heatmap", "radius": 5},
+                ],
+            },
+            {"name": "other", "filter": "ELSE", "symbolizers": []},
+        ],
+    }
+
+
+class GeostylerModelTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        files = glob.glob(os.path.join(test_data_folder, "**", "*.geostyler"), recursive=True)
+        self.assertTrue(files)
+        for filename in files:
+            with open(filename) as f:
+                geostyler = json.load(f)
+            style = model.fromDict(geostyler)
+            self.assertEqual(style.toDict(), geostyler)
+            self.assertEqual(json.dumps(style.toDict(), sort_keys=True), json.dumps(geostyler, sort_keys=True))
+
+    def test_typed(self):
+        style = model.fromDict(_style())
+        rule = style.rules[0]
+        self.assertIsInstance(rule, model.Rule)
+        self.assertIsInstance(rule.scaleDenominator, model.ScaleDenominator)
+        self.assertEqual(rule.scaleDenominator.max, 1000)
+        line, text, heatmap = rule.symbolizers
+        self.assertIsInstance(line, model.LineSymbolizer)
+        self.assertIsInstance(text, model.TextSymbolizer)
+        self.assertIsInstance(heatmap, model.OtherSymbolizer)
+        self.assertEqual((line.kind, text.kind, heatmap.kind), ("Line", "Text", "Heatmap"))
+        self.assertEqual(line.extra, {"customProperty": [1, 2]})
+        self.assertIsNone(text.extra)
+        self.assertFalse(hasattr(line, "dasharray"))
+        self.assertFalse(hasattr(rule, "__dict__"))
+        with self.assertRaises(ValueError):
+            line["kind"] = "Fill"
+
+    def test_mapping(self):
+        line = model.LineSymbolizer(color="#ffffff", width=2, customProperty=True)
+        self.assertEqual(dict(line), {"kind": "Line", "color": "#ffffff", "width": 2, "customProperty": True})
+        self.assertEqual(len(line), 4)
+        self.assertEqual(line["width"], 2)
+        self.assertEqual(line.get("dasharray", "5 5"), "5 5")
+        self.assertIn("customProperty", line)
+        self.assertNotIn("dasharray", line)
+        self.assertNotIn("toDict", line)
+        with self.assertRaises(KeyError):
+            line["dasharray"]
+
+    def test_writers_accept_model(self):
+        geostyler = _style()
+        del geostyler["rules"][0]["symbolizers"][2]  # not supported by the writers
+        style = model.fromDict(geostyler)
+        self.assertEqual(sld.convert(style), sld.convert(geostyler))
+        self.assertEqual(mapboxgl.convert(style), mapboxgl.convert(geostyler))
+        self.assertEqual(mapserver.convert(style), mapserver.convert(geostyler))
+
+
+if __name__ == '__main__':
+    unittest.main()
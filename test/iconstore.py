@@ -0,0 +1,79 @@
+import base64
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from bridgestyle import iconstore
+from bridgestyle.arcgis import togeostyler
+
+
+def _pictureClass(i, image):
+    return {
+        "type": "CIMUniqueValueClass",
+        "label": f"class{i}",
+        "symbol": {"type": "CIMSymbolReference", "symbol": {"type": "CIMPointSymbol", "symbolLayers": [
+            {"type": "CIMPictureMarker", "enable": True, "size": 12, "url": "data:image/png;base64,"
+             + base64.b64encode(image).decode()}
+        ]}},
+        "values": [{"type": "CIMUniqueValue", "fieldValues": [str(i)]}],
+    }
+
+
+def _arcgis(images):
+    return {"layerDefinitions": [{
+        "type": "CIMFeatureLayer",
+        "name": "pictures",
+        "renderer": {"type": "CIMUniqueValueRenderer", "fields": ["TYPE"], "groups": [
+            {"type": "CIMUniqueValueGroup", "classes": [_pictureClass(i, image) for i, image in enumerate(images)]}
+        ]},
+    }]}
+
+
+class IconStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_store(self):
+        path = iconstore.storeIcon(b"image1", "png", self.folder)
+        self.assertEqual(os.path.dirname(path), self.folder)
+        self.assertEqual(iconstore.storeIcon(b"image1", "png", self.folder), path)
+        self.assertEqual(os.path.basename(path), iconstore.iconName(b"image1", "png"))
+        self.assertNotEqual(iconstore.storeIcon(b"image2", "png", self.folder), path)
+        self.assertNotEqual(iconstore.storeIcon(b"image1", "jpg", self.folder), path)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), b"image1")
+        self.assertEqual(len(os.listdir(self.folder)), 3)
+
+    def test_arcgis_pictures(self):
+        options = {"iconfolder": self.folder}
+        geostyler, icons, _ = togeostyler.convert(_arcgis([b"a", b"b", b"a", b"a"]), options)
+        self.assertEqual(icons, [os.path.join(self.folder, iconstore.iconName(image, "png")) for image in (b"a", b"b")])
+        self.assertEqual(sorted(os.listdir(self.folder)), sorted(os.path.basename(icon) for icon in icons))
+        images = [rule["symbolizers"][0]["image"] for rule in geostyler["rules"]]
+        self.assertEqual(images, [icons[0], icons[1], icons[0], icons[0]])
+        # stable across conversions
+        self.assertEqual(togeostyler.convert(_arcgis([b"b"]), options)[1], [icons[1]])
+
+    def test_collect(self):
+        paths = [iconstore.storeIcon(bytes([i]) * 100, "png", self.folder) for i in range(5)]
+        now = time.time()
+        for age, path in enumerate(paths):
+            os.utime(path, (now - age * 100, now - age * 100))
+        self.assertEqual(iconstore.collect(self.folder, maxAge=250), paths[3:])
+        # least recently used first
+        self.assertEqual(iconstore.collect(self.folder, maxSize=250), paths[2:3])
+        # using an icon again marks it as recently used
+        iconstore.storeIcon(bytes([1]) * 100, "png", self.folder)
+        self.assertEqual(iconstore.collect(self.folder, maxSize=100), paths[:1])
+        self.assertEqual(os.listdir(self.folder), [os.path.basename(paths[1])])
+        self.assertEqual(iconstore.collect(os.path.join(self.folder, "missing"), maxSize=0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import bridgestyle
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data")
+
+# Generous, so that it only fails if a heavy dependency (such as QGIS) gets imported eagerly
+IMPORT_BUDGET = 0.5
+
+# Makes any import of QGIS fail, as outside a QGIS runtime environment
+_NO_QGIS = "import sys; sys.modules['qgis'] = None\n"
+
+
+def _run(code):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(bridgestyle.__file__)))
+    output = subprocess.run([sys.executable, "-c", _NO_QGIS + code], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+_LOADED = "json.dumps(sorted(m for m, v in sys.modules.items() if v and m.startswith(('bridgestyle.', 'qgis'))))"
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_import_budget(self):
+        elapsed = _run("import json, time\n"
+                       "start = time.perf_counter()\n"
+                       "import bridgestyle.style2style\n"
+                       "print(json.dumps(time.perf_counter() - start))")
+        self.assertLess(elapsed, IMPORT_BUDGET)
+
+    def test_no_backends_on_import(self):
+        loaded = _run("import json\nimport bridgestyle.style2style\nprint(%s)" % _LOADED)
+        for module in loaded:
+            self.assertFalse(module.startswith(("bridgestyle.sld", "bridgestyle.arcgis", "bridgestyle.mapboxgl",
+                                                "bridgestyle.qgis", "qgis")), module)
+
+    def test_convert_without_qgis(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sld = os.path.join(folder, "Cities.sld")
+            mapbox = os.path.join(folder, "Cities.mapbox")
+            source = os.path.join(test_data_folder, "arcgis", "Cities.lyrx")
+            loaded = _run("import json\n"
+                          "from bridgestyle import style2style\n"
+                          "style2style.convert(%r, %r, {})\n"
+                          "print(%s)" % (source, sld, _LOADED))
+            self.assertTrue(os.path.getsize(sld))
+            self.assertIn("bridgestyle.sld.fromgeostyler", loaded)
+            self.assertNotIn("bridgestyle.mapboxgl", loaded)
+            self.assertFalse([m for m in loaded if m.startswith(("bridgestyle.qgis", "qgis"))])
+
+            _run("import json\n"
+                 "from bridgestyle import style2style\n"
+                 "style2style.convert(%r, %r, {})\n"
+                 "print(%s)" % (source, mapbox, _LOADED))
+            with open(mapbox) as f:
+                self.assertEqual(json.load(f)["version"], 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import json
+import unittest
+from unittest import mock
+
+from bridgestyle.mapboxgl import fromgeostyler
+
+
+def _rule(name, filt):
+    return {
+        "name": name,
+        "filter": filt,
+        "symbolizers": [{"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 1}],
+    }
+
+
+def _categories(values, field="type"):
+    return [_rule(str(v), ["PropertyIsEqualTo", ["PropertyName", field], v]) for v in values]
+
+
+def _filters(geostyler, options=None):
+    mbox, _ = fromgeostyler.convert(geostyler, options)
+    return {layer["id"].split(")")[1].split(":")[0]: layer.get("filter") for layer in json.loads(mbox)["layers"]}
+
+
+class ElseFilterTest(unittest.TestCase):
+
+    def test_else_filter(self):
+        rules = _categories(["a", "b"]) + [_rule("other", "ELSE"), _rule("all", None)]
+        filters = _filters({"name": "test", "rules": rules})
+        self.assertEqual(filters["other"], ["!", ["any", ["==", ["get", "type"], "a"],
+                                                  ["==", ["get", "type"], "b"]]])
+        self.assertIsNone(filters["all"])
+
+    def test_filters_converted_once(self):
+        rules = _categories(range(50)) + [_rule(f"else{i}", "ELSE") for i in range(50)]
+        with mock.patch.object(fromgeostyler, "convertExpression", wraps=fromgeostyler.convertExpression) as m:
+            filters = _filters({"name": "test", "rules": rules})
+        filterCalls = [c for c in m.call_args_list if isinstance(c.args[0], list) and c.args[0][0] == "PropertyIsEqualTo"]
+        self.assertEqual(len(filterCalls), 50)
+        elseFilter = ["!", ["any"] + [["==", ["get", "type"], i] for i in range(50)]]
+        for i in range(50):
+            self.assertEqual(filters[f"else{i}"], elseFilter)
+
+    def test_match_else_filter(self):
+        rules = _categories(["a", "b"]) + [
+            _rule("c or a", ["Or", ["PropertyIsEqualTo", ["PropertyName", "type"], "c"],
+                             ["PropertyIsEqualTo", "a", ["PropertyName", "type"]]]),
+            _rule("other", "ELSE"),
+        ]
+        filters = _filters({"name": "test", "rules": rules}, {"elsefilter": "match"})
+        self.assertEqual(filters["other"], ["match", ["get", "type"], ["a", "b", "c"], False, True])
+        self.assertEqual(filters["a"], ["==", ["get", "type"], "a"])
+
+    def test_match_else_filter_fallback(self):
+        for rules in (_categories(["a"]) + _categories(["b"], "kind"),
+                      _categories(["a", 1]),
+                      _categories([1]) + [_rule("big", ["PropertyIsGreaterThan", ["PropertyName", "type"], 5])]):
+            filters = _filters({"name": "test", "rules": rules + [_rule("other", "ELSE")]}, {"elsefilter": "match"})
+            self.assertEqual(filters["other"][0], "!")
+
+
+def _equal(field, value):
+    return ["PropertyIsEqualTo", ["PropertyName", field], value]
+
+
+class ValueSetFilterTest(unittest.TestCase):
+
+    def _filter(self, filt):
+        return _filters({"name": "test", "rules": [_rule("rule", filt)]})["rule"]
+
+    def test_match(self):
+        self.assertEqual(self._filter(["Or", _equal("type", "a"), ["PropertyIsEqualTo", "b", ["PropertyName", "type"]],
+                                       _equal("type", "a")]),
+                         ["match", ["get", "type"], ["a", "b"], True, False])
+        self.assertEqual(self._filter(["Or", _equal("code", 1), _equal("code", 2.0)]),
+                         ["match", ["get", "code"], [1, 2.0], True, False])
+
+    def test_in(self):
+        self.assertEqual(self._filter(["Or", _equal("code", 1.5), _equal("code", 2)]),
+                         ["in", ["get", "code"], ["literal", [1.5, 2]]])
+        self.assertEqual(self._filter(["Or", _equal("code", "1"), _equal("code", 1), _equal("code", True)]),
+                         ["in", ["get", "code"], ["literal", ["1", 1, True]]])
+
+    def test_null(self):
+        # e.g. an ArcGIS unique value class with <Null> among its values
+        self.assertEqual(self._filter(["Or", _equal("type", "a"), ["PropertyIsNull", ["PropertyName", "type"]],
+                                       _equal("type", "b")]),
+                         ["any", ["match", ["get", "type"], ["a", "b"], True, False], ["!", ["has", "type"]]])
+        self.assertEqual(self._filter(["Or", _equal("type", "a"), _equal("type", None)]),
+                         ["any", ["==", ["get", "type"], "a"], ["==", ["get", "type"], None]])
+
+    def test_unchanged(self):
+        for filt in (["Or", _equal("type", "a"), _equal("kind", "b")],
+                     ["Or", _equal("type", "a"), ["PropertyIsGreaterThan", ["PropertyName", "type"], "b"]],
+                     ["Or", _equal("type", "a"), ["PropertyIsNull", ["PropertyName", "kind"]]],
+                     ["Or", _equal("type", "a")]):
+            self.assertEqual(self._filter(filt)[0], "any")
+
+    def test_else(self):
+        rules = [_rule("ab", ["Or", _equal("type", "a"), _equal("type", "b")]), _rule("c", _equal("type", "c")),
+                 _rule("other", "ELSE")]
+        filters = _filters({"name": "test", "rules": rules}, {"elsefilter": "match"})
+        self.assertEqual(filters["other"], ["match", ["get", "type"], ["a", "b", "c"], False, True])
+        rules[1] = _rule("c", _equal("type", 1.5))
+        filters = _filters({"name": "test", "rules": rules}, {"elsefilter": "match"})
+        self.assertEqual(filters["other"], ["!", ["in", ["get", "type"], ["literal", ["a", "b", 1.5]]]])
+
+
+def _fillRule(name, filt, color, width=1):
+    return {"name": name, "filter": filt, "symbolizers": [
+        {"kind": "Fill", "color": color, "opacity": 1.0, "outlineColor": "#333333", "outlineWidth": width}
+    ]}
+
+
+def _layers(rules, options=None):
+    mbox, _ = fromgeostyler.convert({"name": "test", "rules": rules}, options)
+    return json.loads(mbox)["layers"]
+
+
+class MergeLayersTest(unittest.TestCase):
+
+    def test_unique_values(self):
+        rules = [_fillRule(f"class{i}", ["Or", _equal("code", 2 * i), _equal("code", 2 * i + 1)], f"#00000{i}", 1 + i % 2)
+                 for i in range(4)] + [_fillRule("other", "ELSE", "#ffffff")]
+        self.assertEqual(len(_layers(rules)), 10)
+        fill, line, other, otherLine = _layers(rules, {"mergelayers": True})
+        self.assertEqual(fill["filter"], ["match", ["get", "code"], [0, 1, 2, 3, 4, 5, 6, 7], True, False])
+        self.assertEqual(fill["paint"]["fill-color"], ["match", ["get", "code"], [0, 1], "#000000", [2, 3], "#000001",
+                                                       [4, 5], "#000002", "#000003"])
+        self.assertEqual(fill["id"], "test:(rule#0-3)class0:0")
+        self.assertEqual(line["paint"]["line-color"], "#333333")
+        self.assertEqual(line["paint"]["line-width"], ["match", ["get", "code"], [0, 1, 4, 5], 1, 2])
+        self.assertEqual(other["filter"][0], "!")
+        self.assertEqual(other["paint"]["fill-color"], "#ffffff")
+
+    def test_ranges(self):
+        rules = [_fillRule("low", ["PropertyIsLessThanOrEqualTo", ["PropertyName", "pop"], 10], "#000001"),
+                 _fillRule("mid", ["And", ["PropertyIsGreaterThan", ["PropertyName", "pop"], 10],
+                                   ["PropertyIsLessThanOrEqualTo", ["PropertyName", "pop"], 20]], "#000002"),
+                 _fillRule("high", ["PropertyIsGreaterThan", ["PropertyName", "pop"], 20], "#000003")]
+        fill = _layers(rules, {"mergelayers": True})[0]
+        self.assertEqual(fill["paint"]["fill-color"], ["case", ["<=", ["get", "pop"], 10], "#000001",
+                                                       ["all", [">", ["get", "pop"], 10], ["<=", ["get", "pop"], 20]],
+                                                       "#000002", "#000003"])
+
+    def test_several_attributes(self):
+        rules = [_fillRule(f"{a}{b}", ["And", _equal("a", a), _equal("b", b)], f"#00000{a}{b}")
+                 for a in range(2) for b in range(2)]
+        fill = _layers(rules, {"mergelayers": True})[0]
+        self.assertEqual(fill["paint"]["fill-color"][0], "case")
+        self.assertEqual(len(fill["filter"]), 5)
+
+    def test_not_merged(self):
+        for rules in (
+                # overlapping filters: features drawn by both rules
+                [_fillRule("a", _equal("code", 1), "#000001"), _fillRule("ab", ["Or", _equal("code", 1),
+                                                                                 _equal("code", 2)], "#000002")],
+                [_fillRule("a", _equal("code", 1), "#000001"), _fillRule("b", _equal("kind", 2), "#000002")],
+                [_fillRule("a", _equal("code", 1), "#000001"), _fillRule("all", None, "#000002")],
+                # different symbolizers
+                [_fillRule("a", _equal("code", 1), "#000001"), _rule("b", _equal("code", 2))]):
+            self.assertEqual(len(_layers(rules, {"mergelayers": True})), len(_layers(rules)))
+        rules = [_fillRule(f"class{i}", _equal("code", i), "#000000") for i in range(3)]
+        rules[1]["symbolizers"][0]["outlineDasharray"] = "2 2"
+        self.assertEqual(len(_layers(rules, {"mergelayers": True})), 6)
+
+
+def _scaled(name, minzoom, maxzoom):
+    # A rule shown from minzoom to maxzoom
+    rule = _rule(name, None)
+    rule["scaleDenominator"] = {"max": 279581257 / 2 ** minzoom, "min": 279581257 / 2 ** maxzoom}
+    return rule
+
+
+class ZoomLevelsTest(unittest.TestCase):
+
+    def _style(self, rules, options=None):
+        mbox, _ = fromgeostyler.convert({"name": "test", "rules": rules}, options)
+        mbox = json.loads(mbox)
+        return mbox["sources"][fromgeostyler.SOURCE_NAME], mbox["layers"]
+
+    def test_source(self):
+        rules = [_scaled("a", 5, 10), _scaled("b", 6.4, 12.6)]
+        source, layers = self._style(rules)
+        self.assertEqual((source["minzoom"], source["maxzoom"]), (5, 12))
+        self.assertNotIn("tileSize", source)
+        self.assertAlmostEqual(layers[1]["minzoom"], 6.4)
+        source, _ = self._style(rules, {"tilesize": 256})
+        self.assertEqual((source["minzoom"], source["maxzoom"]), (6, 13))
+        self.assertNotIn("tileSize", source)
+        source, _ = self._style(rules, {"tilegrid": {"minzoom": 6, "maxzoom": 11}})
+        self.assertEqual((source["minzoom"], source["maxzoom"]), (6, 11))
+
+    def test_unbounded(self):
+        source, _ = self._style([_scaled("a", 5, 10), _rule("b", None)])
+        self.assertEqual((source["minzoom"], source["maxzoom"]), (0, 20))
+        source, _ = self._style([])
+        self.assertEqual((source["minzoom"], source["maxzoom"]), (0, 20))
+
+    def test_snap(self):
+        _, layers = self._style([_scaled("a", 6.4, 12.6)], {"snapzoom": True})
+        self.assertEqual((layers[0]["minzoom"], layers[0]["maxzoom"]), (6, 13))
+        # Both scales round to zoom level 7: the layer keeps its unsnapped range
+        _, layers = self._style([_scaled("a", 6.6, 7.2)], {"snapzoom": True})
+        self.assertEqual((layers[0]["minzoom"], layers[0]["maxzoom"]), (6.6, 7.2))
+
+
+if __name__ == '__main__':
+    unittest.main()
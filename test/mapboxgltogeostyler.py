@@ -0,0 +1,137 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bridgestyle import mapboxgl, style2style
+from bridgestyle.mapboxgl import fromgeostyler, togeostyler
+
+
+def _layer(id, sourceLayer, kind="line", **properties):
+    layer = {"id": id, "type": kind, "source": "tiles", "source-layer": sourceLayer}
+    layer.update(properties)
+    return layer
+
+
+def _filter(filt):
+    geostyler, _, warnings = togeostyler.convert({"layers": [_layer("roads", "roads", filter=filt)]})
+    rules = geostyler["rules"]
+    return (rules[0].get("filter") if rules else None), warnings
+
+
+def _property(name, value, kind="line"):
+    geostyler, _, _ = togeostyler.convert({"layers": [_layer("roads", "roads", kind, paint={name: value})]})
+    return geostyler["rules"][0]["symbolizers"][0]
+
+
+class MapboxGLReaderTest(unittest.TestCase):
+
+    def test_source_layers(self):
+        style = {"layers": [
+            {"id": "background", "type": "background"},
+            _layer("water", "water", "fill"),
+            _layer("roads", "roads"),
+            _layer("water outline", "water"),
+            _layer("hidden", "roads", layout={"visibility": "none"}),
+            _layer("names", "roads", "symbol", layout={"text-field": "{name} {ref}", "text-font": ["Sans"]}),
+        ]}
+        layers = togeostyler.convertLayers(style)
+        self.assertEqual([(geostyler["name"], [rule["name"] for rule in geostyler["rules"]])
+                          for geostyler, _, _ in layers],
+                         [("water", ["water", "water outline"]), ("roads", ["roads", "names"])])
+        self.assertEqual(layers[0][2], ["Skipped layer without source layer: 'background'"])
+        self.assertEqual(layers[1][0]["rules"][1]["symbolizers"][0]["label"],
+                         ["Concatenate", ["PropertyName", "name"], " ", ["PropertyName", "ref"]])
+        geostyler, _, warnings = mapboxgl.toGeostyler(json.dumps(style))
+        self.assertEqual(geostyler, layers[0][0])
+        self.assertIn("The style has 2 source layers, only 'water' has been converted", warnings)
+
+    def test_filters(self):
+        name = ["PropertyName", "name"]
+        self.assertEqual(_filter(["all", ["==", ["get", "type"], "road"], ["!", ["has", "name"]],
+                                  ["in", "St", ["get", "name"]]]),
+                         (["And", ["PropertyIsEqualTo", ["PropertyName", "type"], "road"], ["PropertyIsNull", name],
+                           ["PropertyIsLike", name, "%St%"]], []))
+        self.assertEqual(_filter(["match", ["get", "name"], ["a", "b"], False, "c", False, True]),
+                         (["Not", ["Or", ["PropertyIsEqualTo", name, "a"], ["PropertyIsEqualTo", name, "b"],
+                                   ["PropertyIsEqualTo", name, "c"]]], []))
+        self.assertEqual(_filter([">=", ["/", ["+", ["get", "a"], 1, 2], 2], ["to-number", ["get", "b"]]])[0],
+                         ["PropertyIsGreaterThanOrEqualTo", ["Div", ["Add", ["Add", ["PropertyName", "a"], 1], 2], 2],
+                          ["parseDouble", ["PropertyName", "b"]]])
+
+    def test_partial_filters(self):
+        a = ["PropertyIsEqualTo", ["PropertyName", "a"], 1]
+        within = ["within", {"type": "Polygon", "coordinates": []}]
+        self.assertEqual(_filter(["any", True, ["==", ["get", "a"], 1]]), (None, []))
+        self.assertEqual(_filter(["all", True, ["==", ["get", "a"], 1]]), (a, []))
+        self.assertEqual(_filter(["all", within, ["==", ["get", "a"], 1]]), (a, ["Unsupported expression: 'within'"]))
+        # Leaving the unsupported operand out would invert the filter: the layer is skipped
+        skipped = "Skipped layer with an unsupported filter: 'roads'"
+        self.assertEqual(_filter(["!", ["all", within, ["==", ["get", "a"], 1]]]),
+                         (None, ["Unsupported expression: 'within'", skipped]))
+        self.assertEqual(_filter(["none", ["all", ["==", "$type", "Point"], ["==", "a", 1]]]),
+                         (None, ["Unsupported filter: ['==', '$type', 'Point']", skipped]))
+        self.assertEqual(_filter(["!", within]), (None, ["Unsupported expression: 'within'", skipped]))
+        self.assertEqual(_filter(["==", ["geometry-type"], "Point"]),
+                         (None, ["Unsupported expression: 'geometry-type'", skipped]))
+        self.assertEqual(_filter(["all"]), (None, []))
+        geostyler, _, warnings = togeostyler.convert({"layers": [_layer("roads", "roads", filter=["all", False])]})
+        self.assertEqual((geostyler["rules"], warnings),
+                         ([], ["Skipped layer with a filter that matches no feature: 'roads'"]))
+
+    def test_legacy_filters(self):
+        name = ["PropertyName", "name"]
+        self.assertEqual(_filter(["all", ["==", "$type", "LineString"], ["!in", "name", "a", "b"], ["has", "ref"],
+                                  ["none", ["<", "rank", 3]]]),
+                         (["And", ["Not", ["Or", ["PropertyIsEqualTo", name, "a"], ["PropertyIsEqualTo", name, "b"]]],
+                           ["Not", ["PropertyIsNull", ["PropertyName", "ref"]]],
+                           ["Not", ["PropertyIsLessThan", ["PropertyName", "rank"], 3]]],
+                          ["Unsupported filter: ['==', '$type', 'LineString']"]))
+
+    def test_data_driven_values(self):
+        rank = ["PropertyName", "rank"]
+        self.assertEqual(_property("line-color", ["case", ["<", ["get", "rank"], 3], "#f00", "rgba(0, 0, 255, 0.5)"])
+                         ["color"], ["if_then_else", ["PropertyIsLessThan", rank, 3], "#ff0000", "#0000ff"])
+        self.assertEqual(_property("line-width", ["step", ["get", "rank"], 1, 3, 2, 10, 4])["width"],
+                         ["Categorize", rank, 1, 3, 2, 10, 4, "succeeding"])
+        self.assertEqual(_property("line-width", {"property": "rank", "stops": [[1, 4], [10, 1]]})["width"],
+                         ["Interpolate", rank, 1, 4, 10, 1, "numeric", "linear"])
+        self.assertEqual(_property("line-width", ["interpolate", ["linear"], ["zoom"], 5, 1, 10, 4])["width"], 1)
+        circle = _property("circle-radius", ["match", ["get", "type"], "city", 10, 5], "circle")
+        self.assertEqual(circle["size"], ["Mul", 2, ["if_then_else", ["PropertyIsEqualTo", ["PropertyName", "type"],
+                                                                      "city"], 10, 5]])
+        labels = [v for i in range(1500) for v in ("type %d" % i, "#%06x" % i)]
+        color = _property("fill-color", ["match", ["get", "type"]] + labels + ["#fff"], "fill")["color"]
+        self.assertEqual(color[2], "#000000")
+        for _ in range(1500):
+            color = color[3]
+        self.assertEqual(color, "#ffffff")
+        fill = _property("fill-color", "hsla(240, 100%, 50%, 0.5)", "fill")
+        self.assertEqual((fill["color"], fill["fillOpacity"]), ("#0000ff", 0.5))
+
+    def test_round_trip(self):
+        geostyler = {"name": "roads", "rules": [
+            {"name": "main", "filter": ["PropertyIsEqualTo", ["PropertyName", "type"], "main"],
+             "scaleDenominator": {"min": 5000, "max": 100000},
+             "symbolizers": [{"kind": "Line", "color": "#ff0000", "opacity": 0.5, "width": 2}]}]}
+        mapbox, _ = fromgeostyler.convert(geostyler)
+        result, _, warnings = mapboxgl.toGeostyler(mapbox)
+        rule = result["rules"][0]
+        self.assertEqual((result["name"], rule["filter"], rule["symbolizers"], warnings),
+                         ("roads", geostyler["rules"][0]["filter"], geostyler["rules"][0]["symbolizers"], []))
+        self.assertAlmostEqual(rule["scaleDenominator"]["min"], 5000, delta=1)
+        self.assertAlmostEqual(rule["scaleDenominator"]["max"], 100000, delta=1)
+
+    def test_style2style_layers(self):
+        style = {"version": 8, "layers": [_layer("water", "water", "fill"), _layer("roads", "roads")]}
+        with tempfile.TemporaryDirectory() as folder:
+            mapbox = os.path.join(folder, "style.mapbox")
+            with open(mapbox, "w") as f:
+                json.dump(style, f)
+            style2style.convert(mapbox, os.path.join(folder, "style.sld"), {"alllayers": True})
+            self.assertTrue(os.path.exists(os.path.join(folder, "style_water.sld")))
+            self.assertTrue(os.path.exists(os.path.join(folder, "style_roads.sld")))
+
+
+if __name__ == '__main__':
+    unittest.main()
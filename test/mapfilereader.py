@@ -0,0 +1,244 @@
+import os
+import tempfile
+import unittest
+
+from bridgestyle import mapserver, style2style
+from bridgestyle.mapserver import fromgeostyler, togeostyler
+
+MAPFILE = """
+MAP
+  NAME "test" # a comment
+  SYMBOLSET "symbols.txt"
+  INCLUDE "layers.inc"
+  SCALEBAR
+    STYLE 1
+    LABEL SIZE 8 END
+  END
+  QUERYMAP STYLE HILITE END
+  LAYER
+    NAME "places"
+    TYPE POINT
+    CLASSITEM "kind"
+    LABELITEM "name"
+    CLASS
+      NAME "towns"
+      EXPRESSION /^(town|village)$/
+      STYLE
+        SYMBOL "pin"
+        SIZE 12
+      END
+      LABEL
+        SIZE 8
+        COLOR "#102030"
+        OUTLINECOLOR 255 255 255
+      END
+    END
+    CLASS
+      EXPRESSION {city,capital}
+      STYLE SYMBOL "star" COLOR 255 0 0 SIZE [size] END
+    END
+    CLASS
+      NAME "other"
+      STYLE
+        SYMBOL "dot"
+        COLOR 0 0 255
+        OUTLINECOLOR 0 0 0
+      END
+    END
+  END
+  SYMBOL
+    NAME "dot"
+    TYPE ellipse
+    POINTS 1 1 END
+    FILLED true
+  END
+END
+"""
+
+LAYERS = """
+LAYER
+  NAME "land use"
+  TYPE POLYGON
+  FILTER ([area] > 1000)
+  MAXSCALEDENOM 50000
+  CLASS
+    NAME "parks"
+    EXPRESSION ("[use]" = "park" OR "[use]" = "garden")
+    MINSCALEDENOM 1000
+    STYLE
+      COLOR "#00ff0080"
+      OUTLINECOLOR 0 100 0
+      WIDTH 2
+    END
+    STYLE
+      SYMBOL "hatch"
+      COLOR 0 0 0
+      ANGLE 45
+    END
+  END
+END
+"""
+
+SYMBOLS = """
+SYMBOLSET
+  SYMBOL
+    NAME "pin"
+    TYPE pixmap
+    IMAGE "pin.png"
+  END
+  SYMBOL
+    NAME "hatch"
+    TYPE hatch
+  END
+END
+"""
+
+
+def _filter(expression, classItem=None):
+    layer = "LAYER TYPE LINE %s CLASS EXPRESSION %s STYLE COLOR 0 0 0 END END END" % (
+        'CLASSITEM "%s"' % classItem if classItem else "", expression)
+    geostyler, _, warnings = togeostyler.convert(layer)
+    rules = geostyler["rules"]
+    return (rules[0].get("filter") if rules else None), warnings
+
+
+class MapfileReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        for name, text in (("test.map", MAPFILE), ("layers.inc", LAYERS), ("symbols.txt", SYMBOLS)):
+            with open(os.path.join(self.folder.name, name), "w") as f:
+                f.write(text)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_mapfile(self):
+        layers = togeostyler.convertFile(os.path.join(self.folder.name, "test.map"))
+        self.assertEqual([geostyler["name"] for geostyler, _, _ in layers], ["land use", "places"])
+        self.assertEqual([warnings for _, _, warnings in layers], [[], []])
+
+        landuse = layers[0][0]["rules"][0]
+        use = ["PropertyName", "use"]
+        self.assertEqual(landuse["filter"], ["And", ["PropertyIsGreaterThan", ["PropertyName", "area"], 1000],
+                                             ["Or", ["PropertyIsEqualTo", use, "park"],
+                                              ["PropertyIsEqualTo", use, "garden"]]])
+        self.assertEqual(landuse["scaleDenominator"], {"min": 1000, "max": 50000})
+        fill, hatch = landuse["symbolizers"]
+        self.assertEqual(fill, {"kind": "Fill", "opacity": 1.0, "color": "#00ff00", "fillOpacity": 0.502,
+                                "outlineColor": "#006400", "outlineWidth": 2, "outlineOpacity": 1})
+        self.assertEqual(hatch["graphicFill"][0]["wellKnownName"], "shape://slash")
+
+        towns, cities, other = layers[1][0]["rules"]
+        kind = ["PropertyName", "kind"]
+        self.assertEqual(towns["filter"], ["Or", ["PropertyIsEqualTo", kind, "town"],
+                                           ["PropertyIsEqualTo", kind, "village"]])
+        icon, text = towns["symbolizers"]
+        self.assertEqual(icon, {"kind": "Icon", "image": "pin.png", "size": 12})
+        self.assertEqual(text, {"kind": "Text", "label": ["PropertyName", "name"], "color": "#102030", "size": 8,
+                                "haloColor": "#ffffff", "haloOpacity": 1, "haloSize": 1})
+        self.assertEqual(cities["filter"], ["Or", ["PropertyIsEqualTo", kind, "city"],
+                                            ["PropertyIsEqualTo", kind, "capital"]])
+        self.assertEqual(cities["symbolizers"][0]["size"], ["PropertyName", "size"])
+        # The symbol is defined after the layer
+        self.assertEqual((other["filter"], other["symbolizers"][0]["wellKnownName"]), ("ELSE", "circle"))
+
+        geostyler, _, warnings = mapserver.toGeostyler(MAPFILE, {"basepath": self.folder.name})
+        self.assertEqual(geostyler, layers[0][0])
+        self.assertEqual(warnings, ["The Mapfile has 2 layers, only 'land use' has been converted"])
+
+    def test_expressions(self):
+        name = ["PropertyName", "name"]
+        self.assertEqual(_filter('(NOT [a] + 1 >= 2 * [b] && ("[name]" ~ "^St" or [c] in "1,2"))'),
+                         (["And", ["Not", ["PropertyIsGreaterThanOrEqualTo", ["Add", ["PropertyName", "a"], 1],
+                                           ["Mul", 2, ["PropertyName", "b"]]]],
+                           ["Or", ["PropertyIsLike", name, "St%"], ["PropertyIsEqualTo", ["PropertyName", "c"], 1],
+                            ["PropertyIsEqualTo", ["PropertyName", "c"], 2]]], []))
+        self.assertEqual(_filter('(upper("[name]") eq "[ref] A")')[0],
+                         ["PropertyIsEqualTo", ["strToUpper", name], ["Concatenate", ["PropertyName", "ref"], " A"]])
+        self.assertEqual(_filter('"Main St"i', "name")[0],
+                         ["PropertyIsEqualTo", ["strToLower", name], "main st"])
+        self.assertEqual(_filter('/Rd$/', "name")[0], ["PropertyIsLike", name, "%Rd"])
+        skipped = "Skipped class with an unsupported expression: ''"
+        self.assertEqual(_filter('/^[a-z]+$/', "name"), (None, ["Unsupported regular expression: /^[a-z]+$/",
+                                                                skipped]))
+        self.assertEqual(_filter('([a] > )'), (None, ["Unsupported expression: ( [a] > )", skipped]))
+        self.assertEqual(_filter("road"), (None, ["Unsupported expression without CLASSITEM: road", skipped]))
+        # Values compared with the CLASSITEM are strings
+        code = ["PropertyName", "code"]
+        self.assertEqual(_filter('"007"', "code")[0], ["PropertyIsEqualTo", code, "007"])
+        self.assertEqual(_filter('7', "code")[0], ["PropertyIsEqualTo", code, "7"])
+        self.assertEqual(_filter('{01,2}', "code")[0], ["Or", ["PropertyIsEqualTo", code, "01"],
+                                                         ["PropertyIsEqualTo", code, "2"]])
+        self.assertEqual(_filter('/^(01|2)$/', "code")[0], ["Or", ["PropertyIsEqualTo", code, "01"],
+                                                             ["PropertyIsEqualTo", code, "2"]])
+        self.assertEqual(_filter('([code] in "01,2")')[0], ["Or", ["PropertyIsEqualTo", code, "01"],
+                                                             ["PropertyIsEqualTo", code, 2]])
+
+    def test_else_with_layer_filter(self):
+        layer = """LAYER TYPE LINE CLASSITEM "type" FILTER ([lanes] > 1)
+          CLASS EXPRESSION "main" STYLE COLOR 255 0 0 END END
+          CLASS EXPRESSION ([ref] = 1) STYLE COLOR 0 255 0 END END
+          CLASS STYLE COLOR 0 0 255 END END
+        END"""
+        main, ref, other = togeostyler.convert(layer)[0]["rules"]
+        lanes = ["PropertyIsGreaterThan", ["PropertyName", "lanes"], 1]
+        self.assertEqual(main["filter"], ["And", lanes, ["PropertyIsEqualTo", ["PropertyName", "type"], "main"]])
+        self.assertEqual(other["filter"], ["And", lanes, ["Not", ["Or", main["filter"][2], ref["filter"][2]]]])
+
+    def test_unsupported_class_expression(self):
+        classes = """CLASS NAME "bad" EXPRESSION ([a] > ) STYLE COLOR 255 0 0 END END
+          CLASS NAME "other" STYLE COLOR 0 0 255 END END"""
+        geostyler, _, warnings = togeostyler.convert("LAYER TYPE LINE %s END" % classes)
+        self.assertEqual([(rule["name"], rule.get("filter")) for rule in geostyler["rules"]], [("other", None)])
+        self.assertEqual(warnings, ["Unsupported expression: ( [a] > )",
+                                    "Skipped class with an unsupported expression: 'bad'"])
+        geostyler, _, _ = togeostyler.convert("LAYER TYPE LINE FILTER ([lanes] > 1) %s END" % classes)
+        self.assertEqual([(rule["name"], rule.get("filter")) for rule in geostyler["rules"]],
+                         [("other", ["PropertyIsGreaterThan", ["PropertyName", "lanes"], 1])])
+
+    def test_round_trip(self):
+        geostyler = {"name": "roads", "rules": [
+            {"name": "main", "filter": ["And", ["PropertyIsEqualTo", ["PropertyName", "type"], "main"],
+                                        ["PropertyIsGreaterThan", ["PropertyName", "lanes"], 2]],
+             "scaleDenominator": {"min": 5000, "max": 100000},
+             "symbolizers": [{"kind": "Line", "color": "#ff0000", "width": 2, "opacity": 0.5},
+                             {"kind": "Text", "label": ["PropertyName", "name"], "color": "#000000", "size": 10,
+                              "font": "Sans"}]},
+            {"name": "other", "filter": ["Not", ["PropertyIsEqualTo", ["PropertyName", "type"], "main"]],
+             "symbolizers": [{"kind": "Line", "color": "#00ff00", "width": 1, "opacity": 1.0, "dasharray": "4 2"}]}]}
+        mapfile, _, _ = fromgeostyler.convert(geostyler)
+        result, _, warnings = mapserver.toGeostyler(mapfile)
+        self.assertEqual(result, geostyler)
+        self.assertEqual(warnings, ["Layer without TYPE, guessed from its styles"])
+
+    def test_include_cache(self):
+        path = os.path.join(self.folder.name, "test.map")
+        togeostyler.convertFile(path)
+        hits = togeostyler._readFile.cache_info().hits
+        togeostyler.convertFile(path)
+        self.assertGreater(togeostyler._readFile.cache_info().hits, hits)
+        with open(os.path.join(self.folder.name, "layers.inc"), "w") as f:
+            f.write('INCLUDE "layers.inc"')
+        _, _, warnings = togeostyler.convertFile(path)[0]
+        self.assertIn("Too many nested includes: 'layers.inc'", warnings)
+
+    def test_large_mapfile(self):
+        classes = "".join('CLASS NAME "c%d" EXPRESSION ([id] = %d) STYLE COLOR 1 2 3 WIDTH 1 END END\n' % (i, i)
+                          for i in range(5000))
+        layers = togeostyler.convertLayers("MAP\n%s\nEND" % "".join(
+            'LAYER NAME "l%d" TYPE LINE\n%s END\n' % (i, classes) for i in range(4)))
+        self.assertEqual(len(layers), 4)
+        rules = layers[3][0]["rules"]
+        self.assertEqual(len(rules), 5000)
+        self.assertEqual(rules[-1]["filter"], ["PropertyIsEqualTo", ["PropertyName", "id"], 4999])
+
+    def test_style2style(self):
+        sld = os.path.join(self.folder.name, "test.sld")
+        style2style.convert(os.path.join(self.folder.name, "test.map"), sld, {"alllayers": True})
+        self.assertTrue(os.path.exists(os.path.join(self.folder.name, "test_land_use.sld")))
+        self.assertTrue(os.path.exists(os.path.join(self.folder.name, "test_places.sld")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import io
+import unittest
+
+from bridgestyle.mapserver import fromgeostyler
+
+
+def _style(rules=3):
+    return {
+        "name": "roads",
+        "rules": [
+            {
+                "name": f"rule {i}",
+                "filter": ["PropertyIsEqualTo", ["PropertyName", "type"], i],
+                "scaleDenominator": {"min": 100, "max": 1000},
+                "symbolizers": [
+                    {"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 2},
+                    {"kind": "Mark", "wellKnownName": "file:///tmp/star.svg", "color": "#00ff00", "opacity": 1.0,
+                     "radius": 3, "strokeColor": "#000000", "strokeWidth": 1, "strokeOpacity": 1.0},
+                ],
+            }
+            for i in range(rules)
+        ],
+    }
+
+
+class MapfileWriterTest(unittest.TestCase):
+
+    def test_format(self):
+        d = {"LAYER": {"NAME": '"a"', "CLASSES": [{"CLASS": {"STYLE": {"COLOR": (1, 2, 3)}}},
+                                                   {"CLASS": {"EXPRESSION": "([x] = 1)"}}]}}
+        self.assertEqual(fromgeostyler.convertDictToMapfile(d), "\n".join([
+            'LAYER',
+            '  NAME "a"',
+            '  CLASS',
+            '    STYLE',
+            '      COLOR 1 2 3',
+            '    END',
+            '  END',
+            '  CLASS',
+            '    EXPRESSION ([x] = 1)',
+            '  END',
+            'END',
+            '',
+        ]))
+
+    def test_write_mapfile(self):
+        style = _style(fromgeostyler.WRITE_BUFFER_LINES)
+        mapfile, symbols, warnings = fromgeostyler.convert(style)
+        output = io.StringIO()
+        symbolsOutput = io.StringIO()
+        self.assertEqual(fromgeostyler.write_mapfile(style, output, symbolsFp=symbolsOutput), warnings)
+        self.assertEqual(output.getvalue(), mapfile)
+        self.assertEqual(symbolsOutput.getvalue(), symbols)
+        self.assertEqual(mapfile.count("  CLASS\n"), fromgeostyler.WRITE_BUFFER_LINES)
+        self.assertIn("SYMBOL\n", symbols)
+
+
+class ClassItemTest(unittest.TestCase):
+
+    def _expressions(self, filters):
+        style = {"name": "roads", "rules": [
+            {"name": "rule", "filter": filt, "symbolizers": [{"kind": "Line", "color": "#ff0000", "width": 1}]}
+            for filt in filters
+        ]}
+        layer, _, _ = fromgeostyler.convertToDict(style)
+        return layer["LAYER"].get("CLASSITEM"), [c["CLASS"].get("EXPRESSION") for c in layer["LAYER"]["CLASSES"]]
+
+    def test_classitem(self):
+        def equal(value):
+            return ["PropertyIsEqualTo", ["PropertyName", "type"], value]
+
+        self.assertEqual(self._expressions([equal("road"), ["Or", equal("path"), equal("2")], equal('say "hi"'),
+                                            ["Or", equal("a,b"), equal("c.d")], "ELSE"]),
+                         ('"type"', ['"road"', "{path,2}", '{say "hi"}', r"/^(a,b|c\.d)$/", None]))
+        # Numbers are not compared as strings
+        mapfile = fromgeostyler.convert(_style())[0]
+        self.assertNotIn("CLASSITEM", mapfile)
+        self.assertIn('EXPRESSION ("[type]" = 1)', mapfile)
+
+    def test_logical_expressions(self):
+        other = ["PropertyIsEqualTo", ["PropertyName", "name"], "road"]
+        cases = [
+            [["PropertyIsEqualTo", ["PropertyName", "type"], "road"], other],  # different attributes
+            [["PropertyIsEqualTo", ["PropertyName", "type"], 1.5]],  # not a string
+            [["PropertyIsEqualTo", ["PropertyName", "type"], "road"],
+             ["PropertyIsEqualTo", ["PropertyName", "type"], 5]],  # not a string
+            [["PropertyIsLessThan", ["PropertyName", "type"], 1]],
+            ["ELSE", ["PropertyIsEqualTo", ["PropertyName", "type"], "road"]],  # ELSE before other classes
+        ]
+        for filters in cases:
+            classItem, expressions = self._expressions(filters)
+            self.assertIsNone(classItem)
+            self.assertTrue(expressions[-1].startswith("("))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import json
+import os
+import unittest
+
+from bridgestyle import arcgis
+from bridgestyle.context import ConversionContext
+from bridgestyle.mapboxgl import fromgeostyler as mapboxgl
+from bridgestyle.mapserver import fromgeostyler as mapserver
+from bridgestyle.profiling import NO_SPAN, Profiler
+from bridgestyle.sld import fromgeostyler as sld
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data")
+
+
+def _style():
+    return {
+        "name": "roads",
+        "rules": [
+            {
+                "name": f"rule{n}",
+                "filter": ["PropertyIsEqualTo", ["PropertyName", "type"], n],
+                "symbolizers": [{"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 2}],
+            }
+            for n in range(3)
+        ],
+    }
+
+
+class ProfilingTest(unittest.TestCase):
+
+    def test_disabled(self):
+        self.assertIs(ConversionContext().span("sld"), NO_SPAN)
+        self.assertIs(ConversionContext({"profiler": None}).span("sld"), NO_SPAN)
+
+    def test_writer_stages(self):
+        profiler = Profiler()
+        options = {"profiler": profiler}
+        self.assertEqual(sld.convert(_style(), options), sld.convert(_style()))
+        self.assertEqual(mapboxgl.convert(_style(), options), mapboxgl.convert(_style()))
+        self.assertEqual(mapserver.convert(_style(), options), mapserver.convert(_style()))
+        summary = profiler.summary()
+        self.assertEqual(list(summary), ["sld.rule", "sld", "mapboxgl.filters", "mapboxgl.rule",
+                                         "mapboxgl.serialize", "mapboxgl", "mapserver.rule", "mapserver",
+                                         "mapserver.serialize"])
+        self.assertEqual(summary["sld.rule"]["count"], 3)
+        self.assertEqual(summary["sld"]["count"], 1)
+        self.assertIsNone(summary["sld"]["memory"])
+        self.assertEqual([s["rule"] for s in profiler.spans if s["stage"] == "mapserver.rule"],
+                         ["rule0", "rule1", "rule2"])
+        self.assertGreaterEqual(summary["sld"]["time"], summary["sld.rule"]["time"])
+
+    def test_callback_and_rules(self):
+        spans = []
+        sld.convert(_style(), {"profiler": spans.append})
+        self.assertEqual([s["stage"] for s in spans], ["sld.rule"] * 3 + ["sld"])
+        profiler = Profiler(rules=False)
+        sld.convert(_style(), {"profiler": profiler})
+        self.assertEqual([s["stage"] for s in profiler.spans], ["sld"])
+
+    def test_arcgis_memory(self):
+        with open(os.path.join(test_data_folder, "arcgis", "Cities.lyrx")) as f:
+            lyrx = f.read()
+        with Profiler(memory=True) as profiler:
+            arcgis.toGeostyler(lyrx, {"profiler": profiler})
+        renderer = json.loads(lyrx)["layerDefinitions"][0]["renderer"]
+        summary = profiler.summary()
+        self.assertEqual(summary["parse"]["count"], 1)
+        self.assertEqual(summary["togeostyler.rule"]["count"],
+                         sum(len(group["classes"]) for group in renderer["groups"]))
+        self.assertGreater(summary["parse"]["memory"], len(lyrx))
+        # the peak of a stage includes the peaks of the stages within it
+        self.assertGreaterEqual(summary["togeostyler"]["memory"], summary["togeostyler.rule"]["memory"])
+        self.assertEqual(json.loads(json.dumps(profiler.spans)), profiler.spans)
+
+
+if __name__ == '__main__':
+    unittest.main()
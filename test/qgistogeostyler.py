@@ -2,13 +2,24 @@ import json
 import os
 import unittest
 
-from qgis.core import QgsRasterLayer, QgsVectorLayer
+from qgis.core import QgsExpression, QgsRasterLayer, QgsVectorLayer
 
 from bridgestyle import qgis
+from bridgestyle.qgis.expressions import ExpressionConverter
 
 
 class QgisToStylerTest(unittest.TestCase):
-    pass
+
+    def test_deep_expression(self):
+        # Deeper than the recursion limit
+        expression = QgsExpression('"a"' + " * 2" * 5000 + " > 1")
+        result = ExpressionConverter(None).convert(expression)
+        depth = 0
+        node = result[1]
+        while isinstance(node, list) and node[0] == "Mul":
+            depth += 1
+            node = node[1]
+        self.assertEqual((result[0], depth, node), ("PropertyIsGreaterThan", 5000, ["PropertyName", "a"]))
 
 
 _layers = {}
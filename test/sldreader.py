@@ -0,0 +1,190 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from bridgestyle import style2style
+from bridgestyle.geostyler.custom_properties import WellKnownText
+from bridgestyle.sld import fromgeostyler, togeostyler
+
+
+def _style(rules=3):
+    return {
+        "name": "roads & rivers",
+        "rules": [
+            {
+                "name": f"rule {i}",
+                "filter": ["And",
+                           ["PropertyIsEqualTo", ["PropertyName", "type"], f"type {i}"],
+                           ["PropertyIsGreaterThan", ["Mul", ["PropertyName", "lanes"], 2], i],
+                           ["Not", ["PropertyIsNull", ["PropertyName", "name"]]]],
+                "scaleDenominator": {"min": 100, "max": 1000},
+                "symbolizers": [
+                    {"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 2, "cap": "butt",
+                     "join": "round", "dasharray": "4 2", "perpendicularOffset": 1},
+                    {"kind": "Text", "label": ["Concatenate", ["PropertyName", "name"], WellKnownText.NEW_LINE],
+                     "size": 10, "font": "Arial", "color": "#000000", "group": True},
+                ],
+            }
+            for i in range(rules)
+        ],
+    }
+
+
+SE = """<?xml version="1.0" encoding="UTF-8"?>
+<StyledLayerDescriptor version="1.1.0" xmlns="http://www.opengis.net/sld" xmlns:se="http://www.opengis.net/se"
+    xmlns:ogc="http://www.opengis.net/ogc" xmlns:xlink="http://www.w3.org/1999/xlink">
+  <NamedLayer>
+    <se:Name>places</se:Name>
+    <UserStyle>
+      <se:Name>places</se:Name>
+      <se:FeatureTypeStyle>
+        <se:Rule>
+          <se:Name>big</se:Name>
+          <se:Description><se:Title>Big places</se:Title></se:Description>
+          <ogc:Filter>
+            <ogc:PropertyIsBetween>
+              <ogc:PropertyName>pop</ogc:PropertyName>
+              <ogc:LowerBoundary><ogc:Literal>1000</ogc:Literal></ogc:LowerBoundary>
+              <ogc:UpperBoundary><ogc:Literal>5000.5</ogc:Literal></ogc:UpperBoundary>
+            </ogc:PropertyIsBetween>
+          </ogc:Filter>
+          <se:PointSymbolizer>
+            <se:Graphic>
+              <se:ExternalGraphic>
+                <se:OnlineResource xlink:type="simple" xlink:href="http://example.com/town.png"/>
+                <se:Format>image/png</se:Format>
+              </se:ExternalGraphic>
+              <se:Size><ogc:Function name="sqrt"><ogc:PropertyName>pop</ogc:PropertyName></ogc:Function></se:Size>
+            </se:Graphic>
+          </se:PointSymbolizer>
+          <se:TextSymbolizer>
+            <se:Label>Town <ogc:PropertyName>name</ogc:PropertyName></se:Label>
+            <se:Font><se:SvgParameter name="font-family">Sans</se:SvgParameter></se:Font>
+            <se:Halo><se:Radius>2</se:Radius></se:Halo>
+          </se:TextSymbolizer>
+        </se:Rule>
+        <se:Rule>
+          <ogc:Filter>
+            <ogc:PropertyIsLike wildCard="*" singleChar="." escapeChar="!">
+              <ogc:PropertyName>name</ogc:PropertyName>
+              <ogc:Literal>St*</ogc:Literal>
+            </ogc:PropertyIsLike>
+          </ogc:Filter>
+          <se:PolygonSymbolizer>
+            <se:Fill><se:SvgParameter name="fill">#00ff00</se:SvgParameter></se:Fill>
+          </se:PolygonSymbolizer>
+        </se:Rule>
+        <se:Rule>
+          <se:ElseFilter/>
+          <se:MaxScaleDenominator>50000</se:MaxScaleDenominator>
+          <se:PointSymbolizer>
+            <se:Graphic>
+              <se:Mark>
+                <se:WellKnownName>circle</se:WellKnownName>
+                <se:Stroke><se:SvgParameter name="stroke">#000000</se:SvgParameter></se:Stroke>
+              </se:Mark>
+            </se:Graphic>
+          </se:PointSymbolizer>
+        </se:Rule>
+      </se:FeatureTypeStyle>
+    </UserStyle>
+    <UserStyle>
+      <se:Name>other</se:Name>
+    </UserStyle>
+  </NamedLayer>
+</StyledLayerDescriptor>
+"""
+
+
+class SldReaderTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        style = _style()
+        sld, _ = fromgeostyler.convert(style)
+        geostyler, icons, warnings = togeostyler.convert(sld)
+        self.assertEqual((icons, warnings), ([], []))
+        self.assertEqual(geostyler, style)
+        self.assertEqual(fromgeostyler.convert(geostyler)[0], sld)
+
+    def test_functions(self):
+        style = {"name": "style", "rules": [{"name": "rule", "filter": ["PropertyIsEqualTo", ["strToLowerCase", [
+            "if_then_else", ["PropertyIsLessThan", ["PropertyName", "a"], 1], "small", "big"]], "small"],
+            "symbolizers": []}]}
+        sld, _ = fromgeostyler.convert(style)
+        self.assertIn('name="lessThan"', sld)
+        self.assertEqual(togeostyler.convert(sld)[0], style)
+
+    def test_se(self):
+        geostyler, _, warnings = togeostyler.convert(SE.encode("utf-8"))
+        self.assertEqual(warnings, ["Only the first style of the SLD has been converted"])
+        self.assertEqual(geostyler["name"], "places")
+        big, like, other = geostyler["rules"]
+        self.assertEqual(big["name"], "Big places")
+        self.assertEqual(big["filter"], ["And", ["PropertyIsGreaterThanOrEqualTo", ["PropertyName", "pop"], 1000],
+                                         ["PropertyIsLessThanOrEqualTo", ["PropertyName", "pop"], 5000.5]])
+        icon, text = big["symbolizers"]
+        self.assertEqual(icon, {"kind": "Icon", "image": "http://example.com/town.png", "format": "image/png",
+                                "size": ["sqrt", ["PropertyName", "pop"]]})
+        self.assertEqual(text["label"], ["Concatenate", "Town ", ["PropertyName", "name"]])
+        self.assertEqual((text["font"], text["haloSize"], text["haloColor"]), ("Sans", 2, "#FFFFFF"))
+        self.assertEqual(like["filter"], ["PropertyIsLike", ["PropertyName", "name"], "St%"])
+        self.assertEqual(like["symbolizers"], [{"kind": "Fill", "opacity": 1.0, "color": "#00ff00",
+                                                "fillOpacity": 1.0}])
+        self.assertEqual((other["filter"], other["scaleDenominator"]), ("ELSE", {"max": 50000}))
+        self.assertEqual(other["symbolizers"][0]["fillOpacity"], 0.0)
+
+    def test_unsupported_filters(self):
+        rule = ('<Rule><Name>%s</Name><ogc:Filter>%s</ogc:Filter>'
+                '<LineSymbolizer><Stroke/></LineSymbolizer></Rule>')
+        code = '<ogc:PropertyIsEqualTo><ogc:PropertyName>code</ogc:PropertyName>' \
+               '<ogc:Literal>%s</ogc:Literal></ogc:PropertyIsEqualTo>'
+        bbox = '<ogc:BBOX><ogc:PropertyName>geom</ogc:PropertyName></ogc:BBOX>'
+        sld = ('<StyledLayerDescriptor xmlns="http://www.opengis.net/sld" xmlns:ogc="http://www.opengis.net/ogc">'
+               '<NamedLayer><UserStyle><FeatureTypeStyle>%s</FeatureTypeStyle></UserStyle></NamedLayer>'
+               '</StyledLayerDescriptor>') % "".join([
+                   rule % ("bbox", "<ogc:And>%s%s</ogc:And>" % (code % "1", bbox)),
+                   rule % ("id", '<ogc:FeatureId fid="roads.1"/>'),
+                   rule % ("codes", code % "01234"),
+                   rule % ("numbers", "<ogc:Or>%s%s</ogc:Or>" % (code % "0", code % "-0.5"))])
+        geostyler, _, warnings = togeostyler.convert(sld)
+        self.assertEqual(warnings, ["Unsupported filter element: 'BBOX'",
+                                    "Skipped rule with an unsupported filter: 'bbox'",
+                                    "Unsupported filter element: 'FeatureId'",
+                                    "Skipped rule with an unsupported filter: 'id'"])
+        codes, numbers = geostyler["rules"]
+        self.assertEqual(codes["filter"], ["PropertyIsEqualTo", ["PropertyName", "code"], "01234"])
+        self.assertEqual(numbers["filter"], ["Or", ["PropertyIsEqualTo", ["PropertyName", "code"], 0],
+                                             ["PropertyIsEqualTo", ["PropertyName", "code"], -0.5]])
+
+    def test_stream(self):
+        style = _style(2000)
+        output = io.BytesIO()
+        fromgeostyler.write(style, output, {"compact": True})
+        output.seek(0)
+        geostyler, _, _ = togeostyler.convertFile(output)
+        self.assertEqual(geostyler, style)
+
+    def test_style2style(self):
+        with tempfile.TemporaryDirectory() as folder:
+            sld = os.path.join(folder, "roads.sld")
+            mapbox = os.path.join(folder, "roads.mapbox")
+            style = _style()
+            for rule in style["rules"]:
+                rule["symbolizers"][1]["label"] = ["PropertyName", "name"]
+            style["rules"].append({"name": "areas", "symbolizers": [
+                {"kind": "Fill", "color": "#00ff00", "fillOpacity": 0.5, "outlineColor": "#000000",
+                 "outlineWidth": 1, "outlineOpacity": 1.0}]})
+            with open(sld, "w") as f:
+                f.write(fromgeostyler.convert(style)[0])
+            style2style.convert(sld, mapbox, {})
+            with open(mapbox) as f:
+                layers = json.load(f)["layers"]
+            self.assertEqual(len(layers), 8)
+            fills = [layer for layer in layers if layer["type"] == "fill"]
+            self.assertEqual([fill["paint"]["fill-opacity"] for fill in fills], [0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
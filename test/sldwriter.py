@@ -0,0 +1,138 @@
+import io
+import unittest
+from xml.etree import ElementTree
+
+from bridgestyle.geostyler.custom_properties import WellKnownText
+from bridgestyle.sld import fromgeostyler
+
+
+def _style(rules=3):
+    return {
+        "name": "roads & rivers",
+        "rules": [
+            {
+                "name": f"rule {i}",
+                "filter": ["PropertyIsEqualTo", ["PropertyName", "name"], f'"{i}" < {i + 1}'],
+                "scaleDenominator": {"min": 100, "max": 1000},
+                "symbolizers": [
+                    {"kind": "Line", "color": "#ff0000", "opacity": 1.0, "width": 2},
+                    {"kind": "Text", "label": ["Concatenate", ["PropertyName", "name"], WellKnownText.NEW_LINE],
+                     "size": 10, "font": "Arial", "color": "#000000"},
+                ],
+            }
+            for i in range(rules)
+        ],
+    }
+
+
+def _parse(sld):
+    return ElementTree.fromstring(sld.encode("utf-8") if isinstance(sld, str) else sld)
+
+
+class SldWriterTest(unittest.TestCase):
+
+    def test_pretty(self):
+        sld, _ = fromgeostyler.convert(_style())
+        lines = sld.splitlines()
+        self.assertEqual(lines[0], '<?xml version="1.0" encoding="utf-8"?>')
+        self.assertTrue(lines[1].startswith("<StyledLayerDescriptor "))
+        self.assertEqual(lines[3], "  <NamedLayer>")
+        self.assertEqual(lines[-1], "</StyledLayerDescriptor>")
+        root = _parse(sld)
+        rules = root.findall(".//{http://www.opengis.net/sld}Rule")
+        self.assertEqual(len(rules), 3)
+        literal = rules[1].find(".//{http://www.opengis.net/ogc}Literal")
+        self.assertEqual(literal.text, '"1" < 2')
+
+    def test_cdata(self):
+        sld, _ = fromgeostyler.convert(_style(1))
+        self.assertIn("<ogc:Literal><![CDATA[\n]]></ogc:Literal>", sld)
+        label = _parse(sld).find(".//{http://www.opengis.net/sld}Label")
+        self.assertEqual(label[0][1].text, "\n")
+
+    def test_compact(self):
+        pretty, _ = fromgeostyler.convert(_style())
+        compact, _ = fromgeostyler.convert(_style(), {"compact": True})
+        self.assertNotIn("\n  ", compact)
+        self.assertLess(len(compact), len(pretty))
+        for a, b in zip(_parse(pretty).iter(), _parse(compact).iter()):
+            self.assertEqual(a.tag, b.tag)
+            self.assertEqual(a.attrib, b.attrib)
+            self.assertEqual((a.text or "").strip(), (b.text or "").strip())
+
+    def test_write(self):
+        sld, warnings = fromgeostyler.convert(_style())
+        text = io.StringIO()
+        self.assertEqual(fromgeostyler.write(_style(), text), warnings)
+        self.assertEqual(text.getvalue(), sld)
+        binary = io.BytesIO()
+        fromgeostyler.write(_style(), binary)
+        self.assertEqual(binary.getvalue(), sld.encode("utf-8"))
+
+    def test_empty(self):
+        sld, _ = fromgeostyler.convert({"name": "empty", "rules": []})
+        self.assertIn("    <UserStyle>\n      <Title>empty</Title>\n      <FeatureTypeStyle/>\n    </UserStyle>", sld)
+
+
+def _fill(filt, color, name="class"):
+    return {"name": name, "filter": filt,
+            "symbolizers": [{"kind": "Fill", "color": color, "opacity": 1.0, "fillOpacity": 1.0,
+                             "outlineColor": "#000000", "outlineWidth": 1, "outlineOpacity": 1.0}]}
+
+
+def _equal(value):
+    return ["PropertyIsEqualTo", ["PropertyName", "TYPE"], value]
+
+
+def _between(low, high):
+    filt = ["PropertyIsLessThanOrEqualTo", ["PropertyName", "POP"], high]
+    return filt if low is None else ["And", ["PropertyIsGreaterThan", ["PropertyName", "POP"], low], filt]
+
+
+class MergeRulesTest(unittest.TestCase):
+
+    def test_values(self):
+        rules = [_fill(_equal("a"), "#ff0000"), _fill(["Or", _equal("b"), _equal("c")], "#00ff00"),
+                 _fill("ELSE", "#0000ff", "other")]
+        merged = fromgeostyler.mergeRules(rules)
+        self.assertEqual(len(merged), 2)
+        self.assertEqual(merged[0]["filter"],
+                         ["PropertyIsEqualTo", ["in", ["PropertyName", "TYPE"], "a", "b", "c"], "true"])
+        symbolizer = merged[0]["symbolizers"][0]
+        self.assertEqual(symbolizer["color"],
+                         ["Recode", ["PropertyName", "TYPE"], "a", "#ff0000", "b", "#00ff00", "c", "#00ff00"])
+        self.assertEqual(symbolizer["outlineColor"], "#000000")
+        self.assertIs(merged[1], rules[2])
+
+        root = _parse(fromgeostyler.convert({"name": "style", "rules": rules}, {"mergerules": True})[0])
+        ns = {"sld": "http://www.opengis.net/sld", "ogc": "http://www.opengis.net/ogc"}
+        self.assertEqual(len(root.findall(".//sld:Rule", ns)), 2)
+        self.assertIsNotNone(root.find(".//sld:Rule/sld:ElseFilter", ns))
+        fill = root.find(".//sld:Fill/sld:CssParameter[@name='fill']/ogc:Function", ns)
+        self.assertEqual(fill.attrib["name"], "Recode")
+
+    def test_ranges(self):
+        rules = [_fill(_between(None, 10), "#ff0000"), _fill(_between(10, 20), "#00ff00"),
+                 _fill(_between(20, 30), "#0000ff")]
+        expected = [{"name": "POP", "filter": ["PropertyIsLessThanOrEqualTo", ["PropertyName", "POP"], 30],
+                     "symbolizers": [dict(rules[0]["symbolizers"][0], color=[
+                         "Categorize", ["PropertyName", "POP"], "#ff0000", 10, "#00ff00", 20, "#0000ff",
+                         "preceding"])]}]
+        self.assertEqual(fromgeostyler.mergeRules(rules), expected)
+        # Classes in descending order
+        self.assertEqual(fromgeostyler.mergeRules(rules[::-1]), expected)
+
+    def test_not_merged(self):
+        rules = [_fill(_equal("a"), "#ff0000"), _fill(_equal("a"), "#00ff00")]  # same values
+        self.assertEqual(fromgeostyler.mergeRules(rules), rules)
+        rules = [_fill(_between(None, 10), "#ff0000"), _fill(_between(20, 30), "#00ff00")]  # not adjacent
+        self.assertEqual(fromgeostyler.mergeRules(rules), rules)
+        rules = [_fill(_equal("a"), "#ff0000"), _fill(_equal("b"), "#00ff00")]
+        rules[1]["symbolizers"][0]["opacity"] = 0.5  # not written as an expression
+        self.assertEqual(fromgeostyler.mergeRules(rules), rules)
+        rules = [_fill(_equal("a"), "#ff0000"), _fill(["PropertyIsEqualTo", ["PropertyName", "CODE"], 1], "#00ff00")]
+        self.assertEqual(fromgeostyler.mergeRules(rules), rules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bridgestyle import style2style
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data", "arcgis")
+
+
+class Style2StyleBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp, "src")
+        self.dst = os.path.join(self.tmp, "dst")
+        os.makedirs(os.path.join(self.src, "nested", "deeper"))
+        shutil.copy(os.path.join(test_data_folder, "Cities.lyrx"), self.src)
+        shutil.copy(os.path.join(test_data_folder, "Hash Line.lyrx"), os.path.join(self.src, "nested"))
+        shutil.copy(os.path.join(test_data_folder, "test.lyrx"), os.path.join(self.src, "nested", "deeper"))
+        with open(os.path.join(self.src, "nested", "broken.lyrx"), "w") as f:
+            f.write("{not json")
+        with open(os.path.join(self.src, "readme.txt"), "w") as f:
+            f.write("not a style")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    def test_folder(self):
+        results = style2style.convertBatch(self.src, self.dst, "geostyler", {}, jobs=2)
+        status = {os.path.relpath(r["destination"], self.dst): r["status"] for r in results}
+        self.assertEqual(status, {
+            "Cities.geostyler": "ok",
+            os.path.join("nested", "Hash Line.geostyler"): "ok",
+            os.path.join("nested", "broken.geostyler"): "failed",
+            os.path.join("nested", "deeper", "test.geostyler"): "ok",
+        })
+        for r in results:
+            self.assertEqual(os.path.exists(r["destination"]), r["status"] == "ok")
+        with open(os.path.join(self.dst, "nested", "deeper", "test.geostyler")) as f:
+            self.assertTrue(json.load(f)["rules"])
+        with open(os.path.join(self.dst, style2style.SUMMARY_FILENAME)) as f:
+            self.assertEqual(json.load(f), results)
+
+    def test_glob(self):
+        pattern = os.path.join(self.src, "nested", "**", "*.lyrx")
+        results = style2style.convertBatch(pattern, self.dst, "geostyler", {}, jobs=1)
+        destinations = sorted(os.path.relpath(r["destination"], self.dst) for r in results)
+        self.assertEqual(destinations, ["Hash Line.geostyler", "broken.geostyler",
+                                        os.path.join("deeper", "test.geostyler")])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import copy
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from bridgestyle.arcgis import symbolcache, togeostyler
+
+test_data_folder = os.path.join(os.path.dirname(__file__), "data", "arcgis")
+
+
+def _arcgis(filename, classes=5):
+    # A unique value renderer where every class uses the symbol of the given layer file
+    with open(os.path.join(test_data_folder, filename)) as f:
+        layer = json.load(f)["layerDefinitions"][0]
+    renderer = layer["renderer"]
+    symbol = renderer["symbol"] if "symbol" in renderer else renderer["groups"][0]["classes"][0]["symbol"]
+    layer["renderer"] = {
+        "type": "CIMUniqueValueRenderer",
+        "fields": ["TYPE"],
+        "groups": [{"type": "CIMUniqueValueGroup", "classes": [
+            {"type": "CIMUniqueValueClass", "label": f"class{i}", "symbol": copy.deepcopy(symbol),
+             "values": [{"type": "CIMUniqueValue", "fieldValues": [str(i)]}]}
+            for i in range(classes)
+        ]}],
+        "visualVariables": [{"type": "CIMRotationVisualVariable",
+                             "rotationTypeZ": "Geographic", "visualVariableInfoZ": {"expression": "$feature.ANGLE"}}],
+    }
+    return {"layerDefinitions": [layer]}
+
+
+class SymbolCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        symbolcache.clearCache()
+        self.folder = tempfile.mkdtemp()
+        self.options = {"iconfolder": os.path.join(self.folder, "icons")}
+
+    def tearDown(self):
+        symbolcache.clearCache()
+        shutil.rmtree(self.folder)
+
+    def _convert(self, filename, **options):
+        return togeostyler.convert(_arcgis(filename), dict(self.options, **options))
+
+    def test_same_result(self):
+        for filename in ("Countries.lyrx", "Marker Line.lyrx", "Hash Line.lyrx", "Cartographic Line.lyrx"):
+            expected = self._convert(filename)
+            self.assertEqual(self._convert(filename, symbolcache=True), expected)
+        info = symbolcache.cacheInfo()
+        self.assertEqual(info["misses"], 4)
+        self.assertEqual(info["hits"], 16)
+
+    def test_independent_copies(self):
+        geostyler, _, _ = self._convert("Cartographic Line.lyrx", symbolcache=True)
+        symbolizers = [rule["symbolizers"] for rule in geostyler["rules"]]
+        # the rotation visual variable is added to each symbolizer afterwards
+        self.assertTrue(all(s["rotate"] == symbolizers[0][0]["rotate"] for r in symbolizers for s in r))
+        self.assertIsNot(symbolizers[0][0], symbolizers[1][0])
+        symbolizers[0][0]["color"] = "#123456"
+        geostyler, _, _ = self._convert("Cartographic Line.lyrx", symbolcache=True)
+        self.assertNotEqual(geostyler["rules"][0]["symbolizers"][0]["color"], "#123456")
+
+    def test_options(self):
+        self._convert("Cartographic Line.lyrx", symbolcache=True)
+        self._convert("Cartographic Line.lyrx", symbolcache=True, replaceesri=True)
+        self.assertEqual(symbolcache.cacheInfo()["misses"], 2)
+        self._convert("Cartographic Line.lyrx")
+        self.assertEqual(symbolcache.cacheInfo()["size"], 2)
+
+    def test_warnings_and_icons(self):
+        expected = self._convert("Countries.lyrx")
+        self._convert("Countries.lyrx", symbolcache=True)
+        _, icons, warnings = self._convert("Countries.lyrx", symbolcache=True)
+        self.assertEqual(icons, expected[1])
+        self.assertEqual(warnings, expected[2])
+
+    def test_folder(self):
+        cache = os.path.join(self.folder, "symbols")
+        expected = self._convert("Countries.lyrx")
+        self.assertEqual(self._convert("Countries.lyrx", symbolcache=cache), expected)
+        self.assertEqual(len(os.listdir(cache)), 1)
+        symbolcache.setCacheSize(0)
+        try:
+            # as in another process
+            self.assertEqual(self._convert("Countries.lyrx", symbolcache=cache), expected)
+            self.assertEqual(symbolcache.cacheInfo()["misses"], 1)
+            # cached icons that no longer exist are converted again
+            shutil.rmtree(self.options["iconfolder"])
+            self.assertEqual(self._convert("Countries.lyrx", symbolcache=cache), expected)
+            self.assertTrue(os.path.exists(expected[1][0]))
+        finally:
+            symbolcache.setCacheSize(symbolcache.DEFAULT_MAXSIZE)
+
+    def test_key(self):
+        options = {"tolowercase": True, "symbolcache": True}
+        key = symbolcache._key({"type": "CIMLineSymbol", "symbolLayers": []}, options)
+        self.assertEqual(symbolcache._key({"symbolLayers": [], "type": "CIMLineSymbol"}, dict(options)), key)
+        self.assertNotEqual(symbolcache._key({"type": "CIMLineSymbol", "symbolLayers": []}, {}), key)
+        self.assertEqual(len(key), 64)
+
+
+if __name__ == '__main__':
+    unittest.main()